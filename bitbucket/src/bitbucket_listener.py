@@ -3,6 +3,7 @@ import datetime
 from http.server import SimpleHTTPRequestHandler
 import logging
 import sys
+import threading
 
 from typing import Any, List, Type, override
 from atlassian.bitbucket import Cloud
@@ -12,7 +13,7 @@ import requests
 
 from myblinkstick.navbar import Navbar
 from myblinkstick.websocket_client import WebsocketClient
-from myblinkstick.workqueue import Workunit
+from myblinkstick.workqueue import DEFAULT_POLL_RECURRENCE, Workunit
 from myblinkstick.application import Sensor
 
 class JsonDataAccess:
@@ -138,28 +139,32 @@ class BuildFailureManager:
         self._ws = ws
         self._config = config
         self._failures = {}
+        # Repositories are polled concurrently, by the work queue's workers
+        self._lock = threading.Lock()
 
     def get_failures( self ) -> dict[str, str]:
-        return self._failures
+        with self._lock:
+            return self._failures.copy()
 
     def set_failed_build( self, repository: str, pipeline_uuid: str ) -> None:
-        had_failure = len( self._failures )
+        with self._lock:
+            had_failure = len( self._failures )
 
-        self._failures[repository] = pipeline_uuid
-        if not had_failure and "notification" in self._config:
-            self._ws.enable( self._config["notification"] )
-        logging.info( str( self._failures ) )
+            self._failures[repository] = pipeline_uuid
+            if not had_failure and "notification" in self._config:
+                self._ws.enable( self._config["notification"] )
+            logging.info( str( self._failures ) )
 
     def clear_failed_build( self, repository: str ) -> None:
-        # TODO: There's a readers/writers race condition here
-        if repository in self._failures:
-            del self._failures[repository]
+        with self._lock:
+            if repository in self._failures:
+                del self._failures[repository]
 
-        logging.info( str( self._config ) )
-        if len( self._failures ) == 0 and "notification" in self._config:
-            self._ws.disable( self._config["notification"] )
+            logging.info( str( self._config ) )
+            if len( self._failures ) == 0 and "notification" in self._config:
+                self._ws.disable( self._config["notification"] )
 
-        logging.info( str( self._failures ) )
+            logging.info( str( self._failures ) )
 
 
 class PipelineWorkunit( Workunit ):
@@ -167,17 +172,13 @@ class PipelineWorkunit( Workunit ):
     def __init__( self,
                   build_failure_manager: BuildFailureManager,
                   df,
-                  period_seconds: int,
                   bitbucket,
-                  workqueue,
                   mongo_data_access: MongoDataAccess,
                   repository: str ):
-        super().__init__( df )
+        super().__init__( df, key=repository )
 
         self._build_failure_manager = build_failure_manager
-        self._period_seconds = period_seconds
         self._bitbucket = bitbucket
-        self._workqueue = workqueue
         self._mongo_data_access = mongo_data_access
         self._repository = repository
 
@@ -202,22 +203,6 @@ class PipelineWorkunit( Workunit ):
             logging.exception( e )
             # TODO: prometheus workunit exception
 
-        finally:
-            try:
-                future = datetime.datetime.now() + datetime.timedelta( seconds=self._period_seconds )
-                self._workqueue.enqueue(
-                    PipelineWorkunit(
-                        self._build_failure_manager,
-                        future,
-                        self._period_seconds,
-                        self._bitbucket,
-                        self._workqueue,
-                        self._mongo_data_access,
-                        self._repository ) )
-            except Exception as e:
-                logging.exception( e )
-                # TODO: prometheus workunit exception
-
 class BitbucketSensor( Sensor ):
     def __init__(self, args: List[str]):
         super().__init__(args, "Bitbucket Listener", "/bitbucket")
@@ -334,15 +319,14 @@ class BitbucketSensor( Sensor ):
         assert self._workqueue is not None
         for pipeline in self._config["pipelines"]:
             # TODO: make period configurable
-            self._workqueue.enqueue(
+            self._workqueue.enqueue_recurring(
                 PipelineWorkunit(
                     self._build_failure_manager,
                     datetime.datetime.now(),
-                    60,
                     self._bitbucket,
-                    self._workqueue,
                     self._mongo_data_access,
-                    pipeline ) )
+                    pipeline ),
+                DEFAULT_POLL_RECURRENCE )
 
         self._up.set(1)
         assert self._terminate_semaphore is not None
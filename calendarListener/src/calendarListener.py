@@ -15,7 +15,7 @@ import yaml
 
 from myblinkstick.navbar import Navbar
 from myblinkstick.application import Sensor
-from myblinkstick.workqueue import Workunit
+from myblinkstick.workqueue import DEFAULT_POLL_RECURRENCE, Workunit
 
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
@@ -77,12 +77,11 @@ httpPathPrefix  = os.environ["HTTP_PATH_PREFIX"] if "HTTP_PATH_PREFIX" in os.env
 
 
 class CalendarWorkunit( Workunit ):
-    def __init__( self, config, ws, dt, calendar, workqueue, tokens_map_lock: threading.Lock, tokens_map, state ):
-        super().__init__( dt )
+    def __init__( self, config, ws, dt, calendar, tokens_map_lock: threading.Lock, tokens_map, state ):
+        super().__init__( dt, key=calendar["name"] )
         self._config = config
         self._ws = ws
         self._calendar = calendar
-        self._workqueue = workqueue
         self._tokens_map_lock = tokens_map_lock
         self._tokens_map = tokens_map
         self._state = state
@@ -173,19 +172,6 @@ class CalendarWorkunit( Workunit ):
             logging.exception( e )
             workunitExceptions.labels( calendar_name ).inc( 1 )
 
-        finally:
-            future = datetime.datetime.now() + datetime.timedelta( seconds=60 )
-            self._workqueue.enqueue(
-                CalendarWorkunit(
-                    self._config,
-                    self._ws,
-                    future,
-                    self._calendar,
-                    self._workqueue,
-                    self._tokens_map_lock,
-                    self._tokens_map,
-                    self._state ) )
-
 
 class CalendarListener( Sensor ):
     def __init__(self, args):
@@ -320,16 +306,16 @@ class CalendarListener( Sensor ):
                     self._state[calendar["name"]] = []
 
                     # TODO: only enqueue for linked accounts
-                    self._workqueue.enqueue(
+                    self._workqueue.enqueue_recurring(
                         CalendarWorkunit(
                             self._config,
                             self._ws,
                             datetime.datetime.now(),
                             calendar,
-                            self._workqueue,
                             self._tokens_map_lock,
                             self._tokens_map,
-                            self._state ) )
+                            self._state ),
+                        DEFAULT_POLL_RECURRENCE )
 
                     f = get_token_filename( calendar )
                     if os.path.exists( f ):
@@ -0,0 +1,217 @@
+from dataclasses import dataclass
+from types import MappingProxyType
+
+from myblinkstick.heap import HeapBy
+
+from flap_damper import FlapDamper
+
+CHANNELS = 8
+
+EMPTY_CHANNEL = MappingProxyType( {} )
+
+@dataclass( frozen=True, slots=True )
+class AlertSnapshot:
+    """
+    An immutable copy of the alert state. `version` increases every time the state changes.
+
+    `visible` holds the name of the visible alert on each channel (or None). `current` holds, for
+    each channel, a read only mapping of alert name -> frozenset of the sources that enabled it.
+    """
+    version: int
+    visible: tuple
+    current: tuple
+
+    def to_json( self ) -> dict:
+        return { "version": self.version,
+                 "visible": list( self.visible ),
+                 "current": [ _channel_to_json( channel ) for channel in self.current ] }
+
+    def diff( self, previous: "AlertSnapshot" ) -> dict:
+        """
+        The channels that changed since `previous`, keyed by channel number: the new visible alert
+        of each changed channel, and the new current alerts of each changed channel.
+        """
+        visible = { str( channel ): name
+                    for channel, (name, old) in enumerate( zip( self.visible, previous.visible ) )
+                    if name != old }
+        # Unchanged channels are the same object in both snapshots
+        current = { str( channel ): _channel_to_json( alerts )
+                    for channel, (alerts, old) in enumerate( zip( self.current, previous.current ) )
+                    if alerts is not old }
+        return { "visible": visible, "current": current }
+
+
+def _channel_to_json( channel ) -> dict:
+    return { name: sorted( sources ) for name, sources in channel.items() }
+
+class AlertIndex:
+    """
+    Tracks which alerts are enabled on each channel, and by which sources, and which alert is
+    visible (highest priority) on each channel.
+
+    Every channel keeps a persistent heap of its shown alerts, so a change only costs work on the
+    channel it touches. Hidden alerts are removed from a heap lazily: they are popped the next time
+    they reach the top.
+
+    An alert is shown when it is enabled, unless `damper` holds it in its previous state: a held
+    transition is applied later, by `reevaluate`.
+
+    Mutators return the set of channels whose visible alert changed.
+    """
+
+    def __init__( self, alerts: dict, channels: int = CHANNELS, damper: FlapDamper | None = None ):
+        # alert name -> alert configuration (must have "name", "channel" and "priority")
+        self._alerts = alerts
+
+        # For each channel: alert name -> set of sources that have the alert enabled. Only alerts
+        # with at least one source are present.
+        self._current = [ {} for _ in range( channels ) ]
+
+        # For each channel: a heap of alert configurations, and the names of the alerts in it
+        self._heaps = [ HeapBy( lambda x: x["priority"] ) for _ in range( channels ) ]
+        self._in_heap = [ set() for _ in range( channels ) ]
+        # For each channel: the names of the alerts that can be visible
+        self._shown = [ set() for _ in range( channels ) ]
+        self._damper = damper
+
+        self._visible = [ None ] * channels
+
+        # source -> set of (channel, alert name) the source has enabled. Lets a source be
+        # unregistered without looking at every alert on every channel.
+        self._by_source = {}
+
+        # Unchanged channels are shared between consecutive snapshots
+        self._snapshot = AlertSnapshot( 0, tuple( self._visible ), ( EMPTY_CHANNEL, ) * channels )
+        self._stale = set()
+
+
+    def channel( self, alert_name: str ) -> int:
+        return self._alerts[alert_name]["channel"]
+
+
+    def is_enabled( self, alert_name: str ) -> bool:
+        return alert_name in self._current[self.channel( alert_name )]
+
+
+    def enable( self, alert_name: str, source ) -> set[int]:
+        channel = self.channel( alert_name )
+        current = self._current[channel]
+
+        if alert_name not in current:
+            current[alert_name] = set()
+            self._show( channel, alert_name, self._damped( alert_name, True ) )
+        if source not in current[alert_name]:
+            current[alert_name].add( source )
+            self._by_source.setdefault( source, set() ).add( (channel, alert_name) )
+            self._stale.add( channel )
+
+        return self._refresh( channel )
+
+
+    def disable( self, alert_name: str, source ) -> set[int]:
+        channel = self.channel( alert_name )
+        current = self._current[channel]
+
+        if alert_name in current and source in current[alert_name]:
+            current[alert_name].remove( source )
+            self._forget( source, channel, alert_name )
+            self._stale.add( channel )
+            if len( current[alert_name] ) == 0:
+                del current[alert_name]
+                self._show( channel, alert_name, self._damped( alert_name, False ) )
+
+        return self._refresh( channel )
+
+
+    def reevaluate( self, alert_name: str ) -> set[int]:
+        """ Applies the damper's held transition of the alert, if it is due """
+        if self._damper is None:
+            return set()
+        channel = self.channel( alert_name )
+        self._show( channel, alert_name, self._damper.reevaluate( alert_name ) )
+        return self._refresh( channel )
+
+
+    def unregister( self, source ) -> set[int]:
+        """ Removes `source` from every alert it has enabled """
+        changed = set()
+        for _, alert_name in self._by_source.pop( source, () ):
+            changed |= self.disable( alert_name, source )
+        return changed
+
+
+    def alerts_of( self, source ) -> list[str]:
+        """ The names of the alerts `source` has enabled """
+        return [ alert_name for _, alert_name in self._by_source.get( source, () ) ]
+
+
+    def visible_alert( self, channel: int ) -> dict | None:
+        """ The configuration of the alert shown on `channel`, or None if the channel is off """
+        name = self._visible[channel]
+        return self._alerts[name] if name is not None else None
+
+
+    def visible_alerts( self ) -> list:
+        return self._visible.copy()
+
+
+    def current_alerts( self ) -> list:
+        return [ { name: sources.copy() for name, sources in current.items() }
+                 for current in self._current ]
+
+
+    def snapshot( self ) -> AlertSnapshot:
+        """ The state as an immutable snapshot. A new snapshot is only built if the state changed. """
+        if len( self._stale ) == 0:
+            return self._snapshot
+
+        current = list( self._snapshot.current )
+        for channel in self._stale:
+            current[channel] = MappingProxyType( { name: frozenset( sources )
+                                                   for name, sources in self._current[channel].items() } )
+        self._stale.clear()
+
+        self._snapshot = AlertSnapshot( self._snapshot.version + 1,
+                                        tuple( self._visible ),
+                                        tuple( current ) )
+        return self._snapshot
+
+
+    def _forget( self, source, channel: int, alert_name: str ):
+        alerts = self._by_source.get( source )
+        if alerts is not None:
+            alerts.discard( (channel, alert_name) )
+            if len( alerts ) == 0:
+                del self._by_source[source]
+
+
+    def _damped( self, alert_name: str, enabled: bool ) -> bool:
+        if self._damper is None:
+            return enabled
+        return self._damper.update( alert_name, enabled )
+
+
+    def _show( self, channel: int, alert_name: str, shown: bool ):
+        if not shown:
+            self._shown[channel].discard( alert_name )
+            return
+        self._shown[channel].add( alert_name )
+        if alert_name not in self._in_heap[channel]:
+            self._heaps[channel].push( self._alerts[alert_name] )
+            self._in_heap[channel].add( alert_name )
+
+
+    def _refresh( self, channel: int ) -> set[int]:
+        heap = self._heaps[channel]
+        shown = self._shown[channel]
+        while heap.size() > 0 and heap.peek()["name"] not in shown:
+            self._in_heap[channel].discard( heap.pop()["name"] )
+
+        visible = heap.peek()["name"] if heap.size() > 0 else None
+        if visible == self._visible[channel]:
+            return set()
+
+        self._visible[channel] = visible
+        # A held transition can change what's visible without changing the current alerts
+        self._stale.add( channel )
+        return { channel }
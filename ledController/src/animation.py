@@ -0,0 +1,153 @@
+import logging
+import math
+import threading
+import time
+
+from prometheus_client import Counter, Histogram
+
+from blinkstick_output import Shade
+from blinkstick_pool import BlinkstickPool
+
+frameSecondsHistogram = Histogram(
+        'blinkstick_frame_seconds',
+        'Time spent rendering an animation frame and handing it to the blinkstick writers',
+        buckets=[0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05] )
+frameLatenessHistogram = Histogram(
+        'blinkstick_frame_lateness_seconds',
+        'How late an animation frame started, compared to when it was scheduled',
+        buckets=[0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25] )
+framesDroppedCounter = Counter(
+        'blinkstick_frames_dropped',
+        'The number of animation frames that were skipped: `late` frames missed their budget, `busy` '
+        'frames found a blinkstick still writing the previous frame',
+        ['reason'] )
+for reason in ["late", "busy"]:
+    framesDroppedCounter.labels( reason ).inc( 0 )
+
+# Defaults for the optional `animation` section of the config
+DEFAULT_FRAME_RATE = 25
+DEFAULT_PERIOD = 1.0
+
+# Each pattern maps the alert's colors, and how far through its period the animation is (0 to 1),
+# to the color to show
+def blink( colors: list[str], phase: float ) -> Shade:
+    return Shade( colors[0], colors[1], 0 if phase < 0.5 else 1 )
+
+def pulse( colors: list[str], phase: float ) -> Shade:
+    return Shade( colors[0], colors[1], (1 - math.cos( 2 * math.pi * phase )) / 2 )
+
+def fade( colors: list[str], phase: float ) -> Shade:
+    return Shade( colors[0], colors[1], 1 - abs( 1 - 2 * phase ) )
+
+def morph( colors: list[str], phase: float ) -> Shade:
+    """ Moves through every color in turn, and back to the first """
+    position = phase * len( colors )
+    i = int( position ) % len( colors )
+    return Shade( colors[i], colors[(i + 1) % len( colors )], position - int( position ) )
+
+PATTERNS = { "blink": blink,
+             "pulse": pulse,
+             "fade":  fade,
+             "morph": morph }
+
+
+def alert_colors( alert: dict ) -> list[str]:
+    """ The colors an alert's pattern moves between: its `colors`, or its `color` and black """
+    return alert.get( "colors", [alert["color"], "black"] )
+
+
+class Animation:
+    def __init__( self, alert: dict, start: float ):
+        self._pattern = PATTERNS[alert["pattern"]]
+        self._colors = alert_colors( alert )
+        self._period = alert.get( "period", DEFAULT_PERIOD )
+        self._start = start
+
+
+    def render( self, now: float ) -> Shade:
+        return self._pattern( self._colors, ((now - self._start) % self._period) / self._period )
+
+
+class Animator( threading.Thread ):
+    """
+    Renders the patterns of the visible alerts, at `frame_rate` frames per second, separately from
+    the message loop.
+
+    Frames are never queued up. A frame that can't start within `frame_budget` seconds of when it
+    was scheduled is dropped, and a blinkstick that is still writing the previous frame skips the
+    new one: a slow usb bus makes the animation choppy, rather than late.
+
+    The thread sleeps while nothing is animated.
+    """
+
+    def __init__( self,
+                  pool: BlinkstickPool,
+                  frame_rate: float = DEFAULT_FRAME_RATE,
+                  frame_budget: float | None = None,
+                  *args, **kwargs ):
+        super().__init__( *args, daemon=True, name="blinkstick animator", **kwargs )
+        self._pool = pool
+        self._interval = 1 / frame_rate
+        self._budget = frame_budget if frame_budget is not None else self._interval
+        # Guards _animations. A frame is rendered and written while holding it, so that once stop()
+        # returns, no more frames are written to the channel.
+        self._condition = threading.Condition()
+        # channel -> Animation
+        self._animations = {}
+        self._stopped = False
+
+
+    def animate( self, channel: int, alert: dict ):
+        with self._condition:
+            self._animations[channel] = Animation( alert, time.monotonic() )
+            self._condition.notify_all()
+
+
+    def stop( self, channel: int ):
+        with self._condition:
+            self._animations.pop( channel, None )
+
+
+    def terminate( self ):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+
+
+    def run( self ):
+        scheduled = None
+        while True:
+            with self._condition:
+                if len( self._animations ) == 0:
+                    scheduled = None
+                    self._condition.wait_for( lambda: self._animations or self._stopped )
+                if self._stopped:
+                    return
+
+                now = time.monotonic()
+                if scheduled is None:
+                    scheduled = now
+                lateness = now - scheduled
+                if lateness > self._budget:
+                    # Skip the frames we've missed, rather than trying to catch up
+                    missed = int( lateness / self._interval ) + 1
+                    framesDroppedCounter.labels( "late" ).inc( missed )
+                    scheduled += missed * self._interval
+                else:
+                    # Negative if woken early by a new animation, which starts straight away
+                    frameLatenessHistogram.observe( max( lateness, 0 ) )
+                    try:
+                        frame = { channel: animation.render( now )
+                                  for channel, animation in self._animations.items() }
+                        skipped = self._pool.write_frame( frame )
+                        if skipped > 0:
+                            framesDroppedCounter.labels( "busy" ).inc( skipped )
+                    except Exception as e:
+                        logging.exception( e )
+                    frameSecondsHistogram.observe( time.monotonic() - now )
+                    scheduled += self._interval
+
+                # Woken early by terminate(), or by a change to the animations
+                timeout = scheduled - time.monotonic()
+                if timeout > 0:
+                    self._condition.wait( timeout )
@@ -0,0 +1,74 @@
+import asyncio
+import logging
+from typing import Callable
+
+import websockets
+
+from client_session import ClientSession
+
+class AsyncWebSocketServer:
+    """
+    Serves the led-controller websocket protocol from a single asyncio event loop.
+
+    Each connection gets a ClientSession and its own outbox, drained by a writer task. A client that
+    reads slowly only delays its own replies. Sessions may send from any thread: replies are handed
+    to the event loop with `call_soon_threadsafe`.
+    """
+
+    def __init__( self,
+                  host: str,
+                  port: int,
+                  session_factory: Callable[[object, Callable[[bytes], None]], ClientSession] ):
+        self._host = host
+        self._port = port
+        self._session_factory = session_factory
+        self._stopped = None
+        self._loop = None
+
+
+    async def _writer( self, websocket, outbox: asyncio.Queue ):
+        while True:
+            payload = await outbox.get()
+            await websocket.send( payload )
+
+
+    async def _handle_connection( self, websocket ):
+        loop = asyncio.get_running_loop()
+        outbox = asyncio.Queue()
+
+        def send( payload: bytes ):
+            loop.call_soon_threadsafe( outbox.put_nowait, payload )
+
+        session = self._session_factory( websocket.remote_address, send )
+        session.connected()
+        writer = asyncio.create_task( self._writer( websocket, outbox ) )
+        try:
+            async for data in websocket:
+                # Only enqueues onto the blinkstick thread: it never waits for the LEDs
+                session.handle( data )
+
+        except websockets.exceptions.ConnectionClosed:
+            pass
+
+        finally:
+            writer.cancel()
+            session.closed()
+
+
+    async def serve( self ):
+        self._loop = asyncio.get_running_loop()
+        self._stopped = asyncio.Event()
+        async with websockets.serve( self._handle_connection, self._host, self._port ):
+            await self._stopped.wait()
+
+
+    def serve_forever( self ):
+        asyncio.run( self.serve() )
+
+
+    def stop( self ):
+        """ Stops the server. Can be called from any thread. """
+        if self._loop is not None and self._stopped is not None:
+            self._loop.call_soon_threadsafe( self._stopped.set )
+        else:
+            logging.warning( "stopping a websocket server that hasn't started" )
@@ -1,10 +1,18 @@
 import logging
 import queue
 import threading
+import time
 
-from prometheus_client import Gauge
+from prometheus_client import Gauge, Histogram
 
-from myblinkstick.heap import HeapBy
+from alert_index import AlertIndex, AlertSnapshot
+from animation import Animator, DEFAULT_FRAME_RATE
+from blinkstick_messages import ( Opcode, Message, Enable, Disable, Batch, Sync, Register, Unregister, Identify,
+                                  Expire, Reevaluate, Attach, Detach, Flush, EXPIRE, TERMINATE )
+from blinkstick_pool import BlinkstickPool, parse_channel_map
+from device_scanner import DeviceScanner, find_blinksticks, DEFAULT_SCAN_MIN_INTERVAL, DEFAULT_SCAN_MAX_INTERVAL
+from flap_damper import FlapDamper, parse_damping
+from journal import Journal, DEFAULT_GRACE_PERIOD, DEFAULT_COMPACT_EVERY
 
 # Outside the class so that during unit testing, the gauge isn't redefined
 hasBlinkstickGauge = Gauge(
@@ -17,16 +25,50 @@ blinkstickAlerts = Gauge(
         'active blinksticks alerts (not masked)',
         ['name'] )
 
+batchSizeHistogram = Histogram(
+        'blinkstick_batch_size',
+        'The number of queued messages applied between two repaints of the blinkstick',
+        buckets=[1, 2, 4, 8, 16, 32, 64, 128, 256] )
+
+queueDepthGauge = Gauge(
+        'blinkstick_queue_depth',
+        'The number of messages waiting for the blinkstick thread',
+        ['type'] )
+queueWaitHistogram = Histogram(
+        'blinkstick_queue_wait_seconds',
+        'Time a message waited in the queue before the blinkstick thread picked it up',
+        ['type'],
+        buckets=[0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1] )
+messageSecondsHistogram = Histogram(
+        'blinkstick_message_seconds',
+        'Time spent applying a message to the alert state',
+        ['type'],
+        buckets=[0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01] )
+repaintSecondsHistogram = Histogram(
+        'blinkstick_repaint_seconds',
+        'Time spent repainting the changed channels and publishing the state after a batch',
+        buckets=[0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01] )
+
+# The metrics of each message type, looked up once rather than for every message
+queueDepth =     { opcode: queueDepthGauge.labels( opcode.name.lower() )         for opcode in Opcode }
+queueWait =      { opcode: queueWaitHistogram.labels( opcode.name.lower() )      for opcode in Opcode }
+messageSeconds = { opcode: messageSecondsHistogram.labels( opcode.name.lower() ) for opcode in Opcode }
+
+# The source that holds a client's alerts, restored from the journal, until the client reconnects
+RESTORED_PREFIX = "restored:"
+
+# Defaults for the optional `batch` section of the config
+DEFAULT_BATCH_MAX_SIZE = 64
+DEFAULT_BATCH_MAX_LATENCY = 0.05
+
 class BlinkstickThread( threading.Thread ):
-    def __init__( self, config, *args, **kwargs ):
+    def __init__( self, config, *args, find_sticks=find_blinksticks, **kwargs ):
         super().__init__( *args, **kwargs )
         self._message_queue = queue.Queue()
 
         for alert in config["alerts"]:
             blinkstickAlerts.labels( alert["name"] ).set( 0 )
 
-        # TODO: validate that all the channels are between 0 and 7
-
         # A convenience function for getting the alert for a given alert name
         self._alerts = {}
         i = 0
@@ -39,178 +81,396 @@ class BlinkstickThread( threading.Thread ):
                 i += 1
         logging.debug( self._alerts )
 
+        # Alert channel -> (device, led index)
+        self._channel_map = parse_channel_map( config )
+
+        # Flapping alerts are held in their state by their damping policy. A held transition is
+        # reevaluated when a timer, one per alert, enqueues a Reevaluate.
+        self._reevaluations = {}
+        damper = FlapDamper( parse_damping( config ), self._schedule_reevaluation )
+
+        # Only touched by this thread, once it is running
+        self._index = AlertIndex( self._alerts, len( self._channel_map ), damper )
+        # Replaced (never mutated) by this thread whenever the state changes. Readers on other
+        # threads can use it without locking.
+        self._snapshot = self._index.snapshot()
+        # Notified whenever a new snapshot is published
+        self._published = threading.Condition()
+
+        # A burst of messages is applied as one batch, and painted once. A batch stops growing once
+        # it holds `maxSize` messages, or once it has been collecting for `maxLatency` seconds.
+        batch = config.get( "batch", {} )
+        self._batch_max_size = batch.get( "maxSize", DEFAULT_BATCH_MAX_SIZE )
+        self._batch_max_latency = batch.get( "maxLatency", DEFAULT_BATCH_MAX_LATENCY )
+
+        # Blinksticks are looked for in the background, and attached as they are plugged in
+        scan = config.get( "scan", {} )
+        self._pool = BlinkstickPool( self._channel_map,
+                                     on_failure=lambda serial: self.enqueue( Detach( serial ) ) )
+        self._scanner = DeviceScanner( self._pool.attached,
+                                       lambda stick, serial, position:
+                                           self.enqueue( Attach( stick, serial, position ) ),
+                                       lambda serial: self.enqueue( Detach( serial ) ),
+                                       find_sticks,
+                                       scan.get( "minInterval", DEFAULT_SCAN_MIN_INTERVAL ),
+                                       scan.get( "maxInterval", DEFAULT_SCAN_MAX_INTERVAL ) )
+
+        # Alerts with a `pattern` are animated by the animator, rather than painted by the loop
+        animation = config.get( "animation", {} )
+        self._animator = Animator( self._pool,
+                                   animation.get( "frameRate", DEFAULT_FRAME_RATE ),
+                                   animation.get( "frameBudget" ) )
+
+        # The alerts of named clients are journaled, and restored when the controller restarts
+        self._journal = None
+        journal = config.get( "journal" )
+        if journal is not None:
+            self._journal = Journal( journal["path"], journal.get( "compactEvery", DEFAULT_COMPACT_EVERY ) )
+            self._grace_period = journal.get( "gracePeriod", DEFAULT_GRACE_PERIOD )
+        self._expiry = None
+        # source -> the name the client gave
+        self._names = {}
+        # The names whose alerts changed during the batch, and need to be journaled
+        self._dirty_names = set()
+
+        # Opcode -> handler that applies the message. Each handler returns the channels that need
+        # to be repainted. Flush and Terminate are handled by the loop itself.
+        self._handlers = { Opcode.ENABLE:     self._on_enable,
+                           Opcode.DISABLE:    self._on_disable,
+                           Opcode.BATCH:      self._on_batch,
+                           Opcode.SYNC:       self._on_sync,
+                           Opcode.REGISTER:   self._on_register,
+                           Opcode.UNREGISTER: self._on_unregister,
+                           Opcode.IDENTIFY:   self._on_identify,
+                           Opcode.EXPIRE:     self._on_expire,
+                           Opcode.REEVALUATE: self._on_reevaluate,
+                           Opcode.ATTACH:     self._on_attach,
+                           Opcode.DETACH:     self._on_detach }
+
         hasBlinkstickGauge.set( 0 )
 
 
-    def enqueue( self, message ):
-        self._message_queue.put( message )
+    def enqueue( self, message: Message ):
+        queueDepth[message.OPCODE].inc( 1 )
+        # Queued with the time it was enqueued, to measure how long it waits
+        self._message_queue.put( (time.perf_counter(), message) )
 
 
     # TODO: make life easy: implement an __exit__ (or whatever it's called)
     def terminate( self ):
-        self.enqueue( { "terminate": True } )
+        self.enqueue( TERMINATE )
+
+    def flush( self ):
+        """ Blocks until every message enqueued before the call has been processed """
+        processed = threading.Event()
+        self.enqueue( Flush( processed ) )
+        processed.wait()
+
+
+    def get_snapshot( self ) -> AlertSnapshot:
+        return self._snapshot
+
+
+    def wait_for_snapshot( self, version: int, timeout: float | None = None ) -> AlertSnapshot:
+        """ Waits for a snapshot newer than `version`. Returns the latest snapshot, even on timeout. """
+        with self._published:
+            self._published.wait_for( lambda: self._snapshot.version > version, timeout )
+            return self._snapshot
+
 
-    # TODO: move to DTO
     def get_visible_alerts( self ):
-        # TODO: wait for a reply. We can't just inspect the value: we need to
-        # wait for our messages to be parsed
-        reply_queue = queue.Queue()
-        message = { "replyQueue":       reply_queue,
-                    "getVisibleAlerts": True }
-        self.enqueue( message )
-        return reply_queue.get()
-
-    # TODO: move to DTO
+        return list( self._snapshot.visible )
+
+
     def get_current_alerts( self ):
-        reply_queue = queue.Queue()
-        message = { "replyQueue":        reply_queue,
-                    "getCurrentAlerts":  True }
-        self.enqueue( message )
-        return reply_queue.get()
+        return list( self._snapshot.current )
 
 
     def run( self ):
         message_queue = self._message_queue
 
-        current_alerts = []
-        for i in range( 0, 8 ):
-            # A heap of tuples: (alert, client)
-            current_alerts.append( {} )
+        index = self._index
+        pool = self._pool
 
-        last_printed = [None, None, None, None, None, None, None, None]
+        last_printed = [None] * len( self._channel_map )
         def potentially_print_state( current ):
             nonlocal last_printed
             if current != last_printed:
                 logging.info( current )
                 last_printed = current
 
-        def noop_update_alert( alert ):
+        def update_alert( alert ):
             nonlocal last_printed
+            # TODO: put this on a blinkstick specific logger
+            logging.debug( "channel: %s; color: %s",
+                           str( self._alerts[alert["name"]]["channel"]),
+                           str( self._alerts[alert["name"]]["color"] ) )
+            if "pattern" in alert:
+                self._animator.animate( alert["channel"], alert )
+            else:
+                self._animator.stop( alert["channel"] )
+                pool.set_color( self._alerts[alert["name"]]["channel"],
+                                self._alerts[alert["name"]]["color"] )
             current = last_printed.copy()
             current[self._alerts[alert["name"]]["channel"]] = alert["name"]
             potentially_print_state( current )
-        update_alert = noop_update_alert
-        def noop_clear_channel( channel ):
+        def clear_channel( channel ):
             nonlocal last_printed
+            logging.debug( "channel: %s; color: black",
+                           str( channel ) )
+            self._animator.stop( channel )
+            pool.set_color( channel, "black" )
             current = last_printed.copy()
             current[channel] = None
             potentially_print_state( current )
-        clear_channel = noop_clear_channel
 
-        stick = None
-        try:
-            import usb                        # pylint: disable=import-outside-toplevel
-            from blinkstick import blinkstick # pylint: disable=import-outside-toplevel
-
-            sticks = blinkstick.find_all()
-            if len( sticks ) == 0:
-                logging.error( "no blink sticks found!" )
-            else:
-                hasBlinkstickGauge.set( 1 )
-                logging.debug( len( sticks ) )
-                stick = sticks[0]
-                logging.debug( stick )
-
-                def update_blinkstick_alert( alert ):
-                    # TODO: put this on a blinkstick specific logger
-                    # TODO: normalize with the noonpUpdateAlert / noopClearChannel
-                    logging.debug( "channel: %s; color: %s",
-                                   str( self._alerts[alert["name"]]["channel"]),
-                                   str( self._alerts[alert["name"]]["color"] ) )
-                    stick.set_color( index=self._alerts[alert["name"]]["channel"],
-                                     name=self._alerts[alert["name"]]["color"] )
-                def clear_blinkstick_channel( channel ):
-                    logging.debug( "channel: %s; color: black",
-                                   str( channel ) )
-                    stick.set_color( index=channel,
-                                     name="black" )
-
-                update_alert = update_blinkstick_alert
-                clear_channel = clear_blinkstick_channel
-
-            # Turn the led off, if it was left on by a previous invocation
-            for i in range( 0, 8 ):
-                clear_channel( i )
-
-        except (usb.core.USBError, usb.core.NoBackendError):
-            logging.error( "no blinksticks found!" )
-
-        except ModuleNotFoundError:
-            logging.error( "no blinksticks found!" )
+        if self._journal is not None:
+            self._restore()
 
+        # The blinksticks that are already plugged in are attached, and painted, by the first batch.
         # Continue to process events, even if no blink stick is found. It's useful for debugging.
-        # TODO: periodically look for a blink stick being connected or disconnected?
+        # A blinkstick that is plugged in later is found by the scanner.
+        self._scanner.scan()
+        self._scanner.start()
+        self._animator.start()
+
         while True:
-            message = message_queue.get( block=True )
-            logging.debug( str( message ) )
-            try:
-                if "terminate" in message and message["terminate"]:
-                    return
-
-                elif "enable" in message or "disable" in message:
-                    alert_name = message["enable"] if "enable" in message else message["disable"]
-                    logging.debug( alert_name )
-
-                    if alert_name not in self._alerts:
-                        logging.debug( "unrecognized alert: %s; known alerts: %s",
-                                       str( alert_name ),
-                                       str( self._alerts ) )
-                        # Someone is trying to set an alert that doesn't exist. Continue on like
-                        # nothing has happened.
-                        continue
-
-                    channel = self._alerts[alert_name]["channel"]
-                    if alert_name not in current_alerts[channel]:
-                        current_alerts[channel][alert_name] = set()
-
-                    if "enable" in message:
-                        current_alerts[channel][alert_name].add( message["source"] )
-                    else:
-                        if alert_name in current_alerts[channel]:
-                            if message["source"] in current_alerts[channel][alert_name]:
-                                current_alerts[channel][alert_name].remove( message["source"] )
-
-                            if len( current_alerts[channel][alert_name] ) == 0:
-                                del current_alerts[channel][alert_name]
-                    blinkstickAlerts.labels(alert_name).set(
-                        alert_name in current_alerts[channel] and len( current_alerts[channel][alert_name] ) > 0 )
-
-                elif "register" in message:
-                    pass
-
-                elif "unregister" in message:
-                    for i in range( 0, 8 ):
-                        for alert in list( current_alerts[i].keys() ):
-                            if alert in current_alerts[i] and \
-                               message["unregister"] in current_alerts[i][alert]:
-                                current_alerts[i][alert].remove( message["unregister"] )
-                            if len( current_alerts[i][alert] ) == 0:
-                                del current_alerts[i][alert]
-
-                elif "getCurrentAlerts" in message:
-                    message["replyQueue"].put( current_alerts.copy() )
-
-
-                result = []
-                for i in range( 0, 8 ):
-                    heap = HeapBy( lambda x: x["priority"] )
-                    for alert in current_alerts[i]:
-                        heap.push( self._alerts[alert] )
-
-                    if heap.size() > 0:
-                        result.append( heap.peek()["name"] )
-                        update_alert( heap.peek() )
+            # Drain everything that is already queued (within limits), apply it, then repaint once
+            changed = set()
+            flushes = []
+            terminate = False
+            batch_size = 0
+
+            enqueued, message = message_queue.get( block=True )
+            deadline = time.monotonic() + self._batch_max_latency
+            while True:
+                batch_size += 1
+                logging.debug( "%s", message )
+                try:
+                    opcode = message.OPCODE
+                    start = time.perf_counter()
+                    queueDepth[opcode].dec( 1 )
+                    queueWait[opcode].observe( start - enqueued )
+
+                    if opcode == Opcode.TERMINATE:
+                        terminate = True
+                        break
+
+                    if opcode == Opcode.FLUSH:
+                        # Released once the batch has been published
+                        flushes.append( message.processed )
                     else:
-                        result.append( None )
-                        clear_channel( i )
+                        changed |= self._handlers[opcode]( message )
+                        messageSeconds[opcode].observe( time.perf_counter() - start )
+
+                except Exception as e:
+                    logging.exception( e )
+
+                if batch_size >= self._batch_max_size or time.monotonic() >= deadline:
+                    break
+                try:
+                    enqueued, message = message_queue.get_nowait()
+                except queue.Empty:
+                    break
 
-                if "getVisibleAlerts" in message:
-                    message["replyQueue"].put( result )
+            batchSizeHistogram.observe( batch_size )
 
+            start = time.perf_counter()
+            try:
+                # Only repaint the channels whose visible alert changed
+                for channel in changed:
+                    alert = index.visible_alert( channel )
+                    if alert is not None:
+                        update_alert( alert )
+                    else:
+                        clear_channel( channel )
+                pool.commit()
 
             except Exception as e:
                 logging.exception( e )
 
+            self._publish()
+            if self._journal is not None and len( self._dirty_names ) > 0:
+                self._write_journal()
+            repaintSecondsHistogram.observe( time.perf_counter() - start )
+            for flush in flushes:
+                flush.set()
+
+            if terminate:
+                if self._expiry is not None:
+                    self._expiry.cancel()
+                for timer in self._reevaluations.values():
+                    timer.cancel()
+                if self._journal is not None:
+                    self._journal.close()
+                self._scanner.stop()
+                self._animator.terminate()
+                # Let the writers finish turning the leds to their final state
+                pool.close()
+                return
+
+
+    def _publish( self ):
+        snapshot = self._index.snapshot()
+        if snapshot is not self._snapshot:
+            with self._published:
+                self._snapshot = snapshot
+                self._published.notify_all()
+
+
+    def _restore( self ):
+        """ Enables the journaled alerts of each client, until the client reconnects or expires """
+        try:
+            restored = self._journal.load()
+        except Exception as e:
+            logging.error( "could not restore the alert journal: %s", e )
+            self._journal = None
+            return
+
+        for name, alerts in restored.items():
+            source = RESTORED_PREFIX + name
+            self._names[source] = name
+            for alert in alerts:
+                self._on_enable( Enable( alert, source ) )
+            logging.info( "restored %s for %s", alerts, name )
+        self._dirty_names.clear()
+        self._publish()
+
+        if len( restored ) > 0:
+            self._expiry = threading.Timer( self._grace_period, lambda: self.enqueue( EXPIRE ) )
+            self._expiry.daemon = True
+            self._expiry.start()
+
+
+    def _write_journal( self ):
+        for name in self._dirty_names:
+            alerts = set()
+            for source, source_name in self._names.items():
+                if source_name == name:
+                    alerts.update( self._index.alerts_of( source ) )
+            self._journal.record( name, sorted( alerts ) )
+        self._journal.flush()
+        self._dirty_names.clear()
+
+
+    def _touch( self, source: str ):
+        """ Notes that the journaled alerts of `source`'s client need to be rewritten """
+        name = self._names.get( source )
+        if name is not None:
+            self._dirty_names.add( name )
+
+
+    def _on_enable( self, message: Enable ) -> set[int]:
+        if not self._is_known_alert( message.alert ):
+            return set()
+        self._touch( message.source )
+        changed = self._index.enable( message.alert, message.source )
+        blinkstickAlerts.labels( message.alert ).set( 1 )
+        return changed
+
+
+    def _on_disable( self, message: Disable ) -> set[int]:
+        if not self._is_known_alert( message.alert ):
+            return set()
+        self._touch( message.source )
+        changed = self._index.disable( message.alert, message.source )
+        blinkstickAlerts.labels( message.alert ).set( self._index.is_enabled( message.alert ) )
+        return changed
+
+
+    def _on_batch( self, message: Batch ) -> set[int]:
+        changed = set()
+        for change in message.changes:
+            changed |= self._handlers[change.OPCODE]( change )
+        return changed
+
+
+    def _on_sync( self, message: Sync ) -> set[int]:
+        current = set( self._index.alerts_of( message.source ) )
+        changed = set()
+        for alert in current - message.alerts:
+            changed |= self._on_disable( Disable( alert, message.source ) )
+        for alert in message.alerts - current:
+            changed |= self._on_enable( Enable( alert, message.source ) )
+        return changed
+
+
+    def _on_register( self, message: Register ) -> set[int]: # pylint: disable=unused-argument
+        return set()
+
+
+    def _on_unregister( self, message: Unregister ) -> set[int]:
+        self._touch( message.source )
+        self._names.pop( message.source, None )
+        alerts = self._index.alerts_of( message.source )
+        changed = self._index.unregister( message.source )
+        for alert_name in alerts:
+            blinkstickAlerts.labels( alert_name ).set( self._index.is_enabled( alert_name ) )
+        return changed
+
+
+    def _on_identify( self, message: Identify ) -> set[int]:
+        # Both the name the client had, if it is renaming itself, and its new name
+        self._touch( message.source )
+        self._names[message.source] = message.name
+        self._touch( message.source )
+
+        # The client is back: it replays its own alerts, so the restored ones are dropped
+        restored = RESTORED_PREFIX + message.name
+        if restored in self._names:
+            return self._on_unregister( Unregister( restored ) )
+        return set()
+
+
+    def _on_expire( self, message: Expire ) -> set[int]: # pylint: disable=unused-argument
+        changed = set()
+        for source in [ source for source in self._names if source.startswith( RESTORED_PREFIX ) ]:
+            logging.info( "%s did not reconnect; dropping its restored alerts", self._names[source] )
+            changed |= self._on_unregister( Unregister( source ) )
+        return changed
+
+
+    def _on_reevaluate( self, message: Reevaluate ) -> set[int]:
+        return self._index.reevaluate( message.alert )
+
+
+    def _schedule_reevaluation( self, alert_name: str, when: float ):
+        """ Called by the damper, on this thread """
+        timer = self._reevaluations.get( alert_name )
+        if timer is not None:
+            timer.cancel()
+        timer = threading.Timer( max( when - time.monotonic(), 0 ),
+                                 lambda: self.enqueue( Reevaluate( alert_name ) ) )
+        timer.daemon = True
+        timer.start()
+        self._reevaluations[alert_name] = timer
+
+
+    def _on_attach( self, message: Attach ) -> set[int]:
+        # Paint the current state onto the new blinkstick. This also turns off any led that was
+        # left on by a previous invocation.
+        channels = self._pool.attach( message.stick, message.serial, message.position )
+        hasBlinkstickGauge.set( 1 )
+        return channels
+
+
+    def _on_detach( self, message: Detach ) -> set[int]:
+        self._pool.detach( message.serial )
+        hasBlinkstickGauge.set( 1 if self._pool.attached() else 0 )
+        return set()
+
+
+    def _is_known_alert( self, alert_name: str ) -> bool:
+        if alert_name in self._alerts:
+            return True
+
+        logging.debug( "unrecognized alert: %s; known alerts: %s",
+                       str( alert_name ),
+                       str( self._alerts ) )
+        # Someone is trying to set an alert that doesn't exist. Continue on like
+        # nothing has happened.
+        return False
+
 
 class BlinkstickDTO( object ):
     def __init__( self, blinkstick_thread: BlinkstickThread, client_identifier: str ):
@@ -219,18 +479,33 @@ class BlinkstickDTO( object ):
 
 
     def enable( self, alert ):
-        self._blinkstick_thread.enqueue( { "enable": alert,
-                                           "source": self._client_identifier } )
+        self._blinkstick_thread.enqueue( Enable( alert, self._client_identifier ) )
 
 
     def disable( self, alert ):
-        self._blinkstick_thread.enqueue( { "disable": alert,
-                                           "source":  self._client_identifier } )
+        self._blinkstick_thread.enqueue( Disable( alert, self._client_identifier ) )
+
+
+    def batch( self, changes: list[dict] ):
+        """ `changes` are {"enable": alert} and {"disable": alert}, applied in order """
+        self._blinkstick_thread.enqueue( Batch(
+            self._client_identifier,
+            tuple( Enable( change["enable"], self._client_identifier ) if "enable" in change
+                   else Disable( change["disable"], self._client_identifier )
+                   for change in changes ) ) )
+
+
+    def sync( self, alerts: list[str] ):
+        self._blinkstick_thread.enqueue( Sync( self._client_identifier, frozenset( alerts ) ) )
 
 
     def register( self ):
-        self._blinkstick_thread.enqueue( { "register": self._client_identifier } )
+        self._blinkstick_thread.enqueue( Register( self._client_identifier ) )
 
 
     def unregister( self ):
-        self._blinkstick_thread.enqueue( { "unregister": self._client_identifier } )
+        self._blinkstick_thread.enqueue( Unregister( self._client_identifier ) )
+
+
+    def identify( self, name: str ):
+        self._blinkstick_thread.enqueue( Identify( self._client_identifier, name ) )
@@ -0,0 +1,124 @@
+# The messages understood by the BlinkstickThread. Every message has an `OPCODE`, which the thread
+# uses to dispatch it.
+import threading
+from dataclasses import dataclass
+from enum import IntEnum
+from typing import ClassVar
+
+class Opcode( IntEnum ):
+    ENABLE     = 0
+    DISABLE    = 1
+    REGISTER   = 2
+    UNREGISTER = 3
+    FLUSH      = 4
+    TERMINATE  = 5
+    ATTACH     = 6
+    DETACH     = 7
+    IDENTIFY   = 8
+    EXPIRE     = 9
+    BATCH      = 10
+    SYNC       = 11
+    REEVALUATE = 12
+
+
+@dataclass( frozen=True, slots=True )
+class Enable:
+    """ `source` turns on `alert` """
+    OPCODE: ClassVar[Opcode] = Opcode.ENABLE
+    alert: str
+    source: str
+
+
+@dataclass( frozen=True, slots=True )
+class Disable:
+    """ `source` turns off `alert` """
+    OPCODE: ClassVar[Opcode] = Opcode.DISABLE
+    alert: str
+    source: str
+
+
+@dataclass( frozen=True, slots=True )
+class Batch:
+    """ `source`'s enables and disables, applied in order, and together """
+    OPCODE: ClassVar[Opcode] = Opcode.BATCH
+    source: str
+    changes: tuple[Enable | Disable, ...]
+
+
+@dataclass( frozen=True, slots=True )
+class Sync:
+    """ `alerts` are all the alerts `source` has on: any other alert it had on is turned off """
+    OPCODE: ClassVar[Opcode] = Opcode.SYNC
+    source: str
+    alerts: frozenset[str]
+
+
+@dataclass( frozen=True, slots=True )
+class Register:
+    """ A client connected """
+    OPCODE: ClassVar[Opcode] = Opcode.REGISTER
+    source: str
+
+
+@dataclass( frozen=True, slots=True )
+class Unregister:
+    """ A client disconnected: every alert it enabled is turned off """
+    OPCODE: ClassVar[Opcode] = Opcode.UNREGISTER
+    source: str
+
+
+@dataclass( frozen=True, slots=True )
+class Flush:
+    """ `processed` is set once every message enqueued before this one has been published """
+    OPCODE: ClassVar[Opcode] = Opcode.FLUSH
+    processed: threading.Event
+
+
+@dataclass( frozen=True, slots=True )
+class Identify:
+    """ The client `source` says it is `name`. Its alerts are journaled under that name. """
+    OPCODE: ClassVar[Opcode] = Opcode.IDENTIFY
+    source: str
+    name: str
+
+
+@dataclass( frozen=True, slots=True )
+class Expire:
+    """ The grace period is over: the alerts restored for clients that haven't reconnected are dropped """
+    OPCODE: ClassVar[Opcode] = Opcode.EXPIRE
+
+
+@dataclass( frozen=True, slots=True )
+class Reevaluate:
+    """ A transition of `alert` that was held back by its damping policy may be due """
+    OPCODE: ClassVar[Opcode] = Opcode.REEVALUATE
+    alert: str
+
+
+@dataclass( frozen=True, slots=True )
+class Attach:
+    """ A blinkstick was found. `position` is its position in the scan that found it. """
+    OPCODE: ClassVar[Opcode] = Opcode.ATTACH
+    stick: object
+    serial: str
+    position: int
+
+
+@dataclass( frozen=True, slots=True )
+class Detach:
+    """ Writing to the blinkstick `serial` failed: it was probably unplugged """
+    OPCODE: ClassVar[Opcode] = Opcode.DETACH
+    serial: str
+
+
+@dataclass( frozen=True, slots=True )
+class Terminate:
+    OPCODE: ClassVar[Opcode] = Opcode.TERMINATE
+
+
+# There is no state in Expire and Terminate messages, so the same one is always used
+EXPIRE = Expire()
+TERMINATE = Terminate()
+
+Message = ( Enable | Disable | Batch | Sync | Register | Unregister | Identify | Expire | Reevaluate
+            | Attach | Detach | Flush | Terminate )
@@ -0,0 +1,111 @@
+from dataclasses import dataclass
+
+from prometheus_client import Counter, Histogram
+
+from alert_index import CHANNELS
+
+writesIssuedCounter = Counter(
+        'blinkstick_writes_issued',
+        'The number of usb writes sent to the blinkstick' )
+writesSkippedCounter = Counter(
+        'blinkstick_writes_skipped',
+        'The number of channel updates that were dropped because the channel already had the color' )
+usbWriteSecondsHistogram = Histogram(
+        'blinkstick_usb_write_seconds',
+        'Time spent in a usb write to a blinkstick, by device and by the call used',
+        ['device', 'operation'],
+        buckets=[0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1] )
+
+@dataclass( frozen=True, slots=True )
+class Shade:
+    """ A color part way between two named colors: `start` when `mix` is 0, `end` when it is 1 """
+    start: str
+    end: str
+    mix: float
+
+
+class BlinkstickOutput:
+    """
+    The output stage for a blinkstick. Colors (names, or Shades) are staged with `set_color` and
+    written with `commit`.
+
+    The last committed color of every channel is remembered, and only channels whose color differs
+    are written. A single changed channel is written with `set_color`; several changed channels are
+    written together as one `set_led_data` frame.
+    """
+
+    def __init__( self, stick, channels: int = CHANNELS, device: str = "" ):
+        self._stick = stick
+        self._set_color_seconds = usbWriteSecondsHistogram.labels( device, "set_color" )
+        self._set_led_data_seconds = usbWriteSecondsHistogram.labels( device, "set_led_data" )
+        self._inverse = stick.get_inverse()
+        # (r, g, b) last written to each channel; None if we don't know
+        self._committed = [ None ] * channels
+        self._staged = {}
+        # color name -> (r, g, b)
+        self._rgb = {}
+
+
+    def set_color( self, channel: int, color: str | Shade ):
+        self._staged[channel] = color
+
+
+    def invalidate( self ):
+        """ Forgets what was written, e.g. after a failed write, so that every channel is rewritten """
+        self._committed = [ None ] * len( self._committed )
+
+
+    def commit( self ) -> bool:
+        """ Returns True if anything was written """
+        dirty = {}
+        for channel, color in self._staged.items():
+            rgb = self._to_rgb( color )
+            if self._committed[channel] == rgb:
+                writesSkippedCounter.inc( 1 )
+            else:
+                dirty[channel] = rgb
+        self._staged.clear()
+
+        if len( dirty ) == 0:
+            return False
+
+        if len( dirty ) == 1:
+            channel, (red, green, blue) = next( iter( dirty.items() ) )
+            with self._set_color_seconds.time():
+                self._stick.set_color( index=channel, red=red, green=green, blue=blue )
+            self._committed[channel] = (red, green, blue)
+
+        else:
+            # A frame covers every channel, so unknown channels are written as black
+            frame = [ dirty.get( channel, committed or (0, 0, 0) )
+                      for channel, committed in enumerate( self._committed ) ]
+            data = []
+            for red, green, blue in frame:
+                if self._inverse:
+                    red, green, blue = 255 - red, 255 - green, 255 - blue
+                # set_led_data takes the frame in GRB order
+                data.extend( [green, red, blue] )
+            with self._set_led_data_seconds.time():
+                self._stick.set_led_data( 0, data )
+            self._committed = frame
+
+        writesIssuedCounter.inc( 1 )
+        return True
+
+
+    def _to_rgb( self, color: str | Shade ) -> tuple:
+        if isinstance( color, Shade ):
+            start = self._name_to_rgb( color.start )
+            end = self._name_to_rgb( color.end )
+            return tuple( round( a + (b - a) * color.mix ) for a, b in zip( start, end ) )
+        return self._name_to_rgb( color )
+
+
+    def _name_to_rgb( self, name: str ) -> tuple:
+        rgb = self._rgb.get( name )
+        if rgb is None:
+            # Resolves css color names the same way `set_color( name=... )` does
+            rgb = tuple( self._stick._determine_rgb( name=name ) ) # pylint: disable=protected-access
+            if name != "random":
+                self._rgb[name] = rgb
+        return rgb
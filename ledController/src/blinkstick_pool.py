@@ -0,0 +1,247 @@
+import logging
+import threading
+from typing import Callable
+
+from prometheus_client import Counter
+
+from alert_index import CHANNELS
+from blinkstick_output import BlinkstickOutput, Shade
+
+deviceWritesCounter = Counter(
+        'blinkstick_device_writes',
+        'The number of frames written to a blinkstick',
+        ['device'] )
+deviceErrorsCounter = Counter(
+        'blinkstick_device_errors',
+        'The number of frames that could not be written to a blinkstick',
+        ['device'] )
+
+def default_channel_map( channels: int = CHANNELS ) -> list[tuple]:
+    """ Channel c is led c of the first blinkstick found """
+    return [ (0, channel) for channel in range( 0, channels ) ]
+
+
+def parse_channel_map( config: dict ) -> list[tuple]:
+    """
+    Reads the optional `channels` section of the config: one {device, index} entry per alert
+    channel. `device` is either a blinkstick serial number, or the position of the blinkstick in the
+    order the sticks are found.
+
+    Raises ValueError if an alert is on a channel that isn't in the map.
+    """
+    if "channels" not in config:
+        channel_map = default_channel_map()
+    else:
+        channel_map = [ (channel["device"], channel["index"]) for channel in config["channels"] ]
+
+    for alert in config.get( "alerts", [] ):
+        if not 0 <= alert["channel"] < len( channel_map ):
+            raise ValueError( f"Alert `{alert['name']}` is on channel {alert['channel']}: expected a "
+                              f"channel between 0 and {len( channel_map ) - 1}" )
+    return channel_map
+
+
+class DeviceWriter( threading.Thread ):
+    """
+    Writes to one blinkstick, on its own thread, so that a slow or wedged device doesn't hold up the
+    other devices or the message loop.
+
+    Only the latest color of each led is kept: colors staged while a write is in progress replace
+    each other, and are written together once the device is free.
+
+    `on_failure` is called, on the writer's thread, when a write fails.
+    """
+
+    def __init__( self,
+                  stick,
+                  name: str,
+                  leds: int = CHANNELS,
+                  on_failure: Callable[["DeviceWriter"], None] | None = None,
+                  *args, **kwargs ):
+        super().__init__( *args, daemon=True, name=f"blinkstick {name}", **kwargs )
+        self.device = name
+        self._output = BlinkstickOutput( stick, leds, name )
+        self._on_failure = on_failure
+        self._condition = threading.Condition()
+        # led index -> color name, waiting to be written
+        self._pending = {}
+        self._writing = False
+        self._stopped = False
+
+        deviceWritesCounter.labels( name ).inc( 0 )
+        deviceErrorsCounter.labels( name ).inc( 0 )
+
+
+    def write( self, colors: dict[int, str | Shade] ):
+        with self._condition:
+            self._pending.update( colors )
+            self._condition.notify_all()
+
+
+    def busy( self ) -> bool:
+        """ True if the device hasn't caught up with the colors written to it """
+        with self._condition:
+            return self._writing or len( self._pending ) > 0
+
+
+    def drain( self, timeout: float | None = None ) -> bool:
+        """ Waits for every staged color to be written. Returns False on timeout. """
+        with self._condition:
+            return self._condition.wait_for( lambda: not self._pending and not self._writing, timeout )
+
+
+    def stop( self ):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+
+
+    def run( self ):
+        while True:
+            with self._condition:
+                self._condition.wait_for( lambda: self._pending or self._stopped )
+                if self._stopped:
+                    return
+                colors = self._pending
+                self._pending = {}
+                self._writing = True
+
+            try:
+                for index, color in colors.items():
+                    self._output.set_color( index, color )
+                if self._output.commit():
+                    deviceWritesCounter.labels( self.device ).inc( 1 )
+
+            except Exception as e:
+                deviceErrorsCounter.labels( self.device ).inc( 1 )
+                logging.error( "error writing to blinkstick %s: %s", self.device, e )
+                # We don't know what the device is showing any more
+                self._output.invalidate()
+                if self._on_failure is not None:
+                    self._on_failure( self )
+
+            finally:
+                with self._condition:
+                    self._writing = False
+                    self._condition.notify_all()
+
+
+class BlinkstickPool:
+    """
+    The attached blinksticks, and the mapping of alert channels onto them: channel c is led `index`
+    of blinkstick `device`, where `device` is a serial number or the device's position in the scan
+    that found it. Channels that are mapped to a device that isn't attached are dropped.
+
+    The pool is changed and written from the blinkstick thread; the writes themselves happen on each
+    device's DeviceWriter. `attached` can be called from any thread.
+    """
+
+    def __init__( self,
+                  channel_map: list[tuple],
+                  on_failure: Callable[[str], None] | None = None ):
+        self._channel_map = channel_map
+        self._leds = max( [CHANNELS] + [ index + 1 for _, index in channel_map ] )
+        self._on_failure = on_failure
+        # Guards _writers, for readers on other threads
+        self._lock = threading.Lock()
+        # device key (serial and position) -> DeviceWriter
+        self._writers = {}
+        self._staged = {}
+
+
+    @property
+    def channels( self ) -> int:
+        return len( self._channel_map )
+
+
+    def open( self, sticks: list ):
+        for position, stick in enumerate( sticks ):
+            self.attach( stick, stick.get_serial(), position )
+
+
+    def attach( self, stick, serial: str, position: int ) -> set[int]:
+        """ Starts writing to `stick`. Returns the channels that are mapped onto it. """
+        with self._lock:
+            if serial in self._writers:
+                return set()
+            writer = DeviceWriter( stick, serial, self._leds, self._writer_failed )
+            self._writers[serial] = writer
+            self._writers[position] = writer
+        writer.start()
+        logging.info( "using blinkstick %s", serial )
+
+        return { channel for channel, (device, _) in enumerate( self._channel_map )
+                 if device in (serial, position) }
+
+
+    def detach( self, serial: str ):
+        with self._lock:
+            writer = self._writers.get( serial )
+            if writer is None:
+                return
+            self._writers = { key: value for key, value in self._writers.items() if value is not writer }
+        self._staged.pop( writer, None )
+        writer.stop()
+        logging.info( "stopped using blinkstick %s", serial )
+
+
+    def attached( self ) -> set[str]:
+        with self._lock:
+            return set( writer.device for writer in self._writers.values() )
+
+
+    def devices( self ) -> list[str]:
+        return sorted( self.attached() )
+
+
+    def set_color( self, channel: int, color: str | Shade ):
+        device, index = self._channel_map[channel]
+        writer = self._writers.get( device )
+        if writer is not None:
+            self._staged.setdefault( writer, {} )[index] = color
+
+
+    def commit( self ):
+        for writer, colors in self._staged.items():
+            writer.write( colors )
+        self._staged = {}
+
+
+    def write_frame( self, colors: dict[int, str | Shade] ) -> int:
+        """
+        Writes an animation frame straight to the writers; can be called from any thread. Devices
+        that are still busy with an earlier write skip the frame. Returns the number of devices that
+        skipped it.
+        """
+        frames = {}
+        with self._lock:
+            for channel, color in colors.items():
+                device, index = self._channel_map[channel]
+                writer = self._writers.get( device )
+                if writer is not None:
+                    frames.setdefault( writer, {} )[index] = color
+
+        skipped = 0
+        for writer, frame in frames.items():
+            if writer.busy():
+                skipped += 1
+            else:
+                writer.write( frame )
+        return skipped
+
+
+    def close( self, timeout: float = 1 ):
+        """ Gives the writers `timeout` seconds to finish writing, then stops them """
+        with self._lock:
+            writers = set( self._writers.values() )
+            self._writers = {}
+        for writer in writers:
+            writer.drain( timeout )
+            writer.stop()
+        for writer in writers:
+            writer.join( timeout )
+
+
+    def _writer_failed( self, writer: DeviceWriter ):
+        if self._on_failure is not None:
+            self._on_failure( writer.device )
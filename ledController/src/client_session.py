@@ -0,0 +1,262 @@
+import json
+import logging
+import threading
+from typing import Callable
+
+from prometheus_client import Counter, Gauge
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+from blinkstickThread import BlinkstickThread, BlinkstickDTO
+from message_validator import MessageValidator
+from snapshot_publisher import EncodedMessage, SnapshotPublisher
+
+clients_gauge = Gauge(
+        'clients',
+        'Specifies which clients are connected',
+        ['type'] )
+CLIENT_TYPES = set(['Calendar Listener',
+                    'Outlook Listener',
+                    'Webhook Listener',
+                    'Bitbucket Listener',
+                    'ManualSet',
+                    None])
+for client in CLIENT_TYPES:
+    clients_gauge.labels( client ).set( 0 )
+
+messagesReceivedCounter = Counter(
+        'websocket_messages_received',
+        'The number of websocket messages received, by encoding',
+        ['encoding'] )
+
+# The binary encodings a client can ask for in its handshake, in our order of preference. Json is
+# always understood.
+ENCODINGS = [ "msgpack" ] if msgpack is not None else []
+for encoding in ["json"] + ENCODINGS:
+    messagesReceivedCounter.labels( encoding ).inc( 0 )
+
+
+def encode( data: object, encoding: str | None ) -> bytes:
+    """ Encodes a message in a negotiated encoding, or in json if there's none """
+    if encoding == "msgpack":
+        return msgpack.packb( data )
+    return json.dumps( data ).encode( "ascii" )
+
+
+class Client:
+    name = None
+    link = None
+
+
+class ClientTypeCounter:
+    """
+    Maintains the clients{type=$NAME} prometheus metric as clients connect, rename themselves and
+    disconnect. A type that no client has any more is removed from the metric, unless it is one of
+    the well known CLIENT_TYPES.
+
+    Not thread safe: callers hold the clients lock.
+    """
+
+    def __init__( self ):
+        self._counts = {}
+
+
+    def add( self, client_type: str | None ):
+        count = self._counts.get( client_type, 0 ) + 1
+        self._counts[client_type] = count
+        clients_gauge.labels( self._label( client_type ) ).set( count )
+
+
+    def remove( self, client_type: str | None ):
+        count = self._counts.get( client_type, 0 ) - 1
+        if count > 0:
+            self._counts[client_type] = count
+            clients_gauge.labels( self._label( client_type ) ).set( count )
+            return
+
+        self._counts.pop( client_type, None )
+        if client_type in CLIENT_TYPES:
+            clients_gauge.labels( self._label( client_type ) ).set( 0 )
+        else:
+            clients_gauge.remove( self._label( client_type ) )
+
+
+    def rename( self, old_type: str | None, new_type: str | None ):
+        if old_type != new_type:
+            self.remove( old_type )
+            self.add( new_type )
+
+
+    @staticmethod
+    def _label( client_type: str | None ) -> str:
+        return client_type if client_type is not None else "None"
+
+
+# Shared by every session, like the metric it maintains
+client_type_counter = ClientTypeCounter()
+
+
+class ClientSession:
+    """
+    The led-controller's side of the websocket protocol for one connected client. It doesn't know
+    which websocket server it is running under: replies are handed to `send` as encoded bytes.
+
+    Text frames are always json. A client can ask for a binary encoding by listing the encodings it
+    understands in its handshake: {"name": ..., "encodings": ["msgpack"]}. If one is supported, the
+    handshake's reply names it, {"success": true, "encoding": "msgpack"}, and from then on the
+    client's binary frames and the replies to it use that encoding.
+    """
+
+    def __init__( self,
+                  receive_validator: MessageValidator | None,
+                  send_validator:    MessageValidator | None,
+                  blinkstick_thread: BlinkstickThread,
+                  address,
+                  clients_lock:      threading.Lock,
+                  clients:           dict,
+                  send:              Callable[[bytes], None],
+                  publisher:         SnapshotPublisher | None = None ):
+        self._blinkstick_thread = blinkstick_thread
+        self._clients = clients
+        self._clients_lock = clients_lock
+        self._receive_validator = receive_validator
+        self._send_validator = send_validator
+        self._send = send
+        self._publisher = publisher
+        # The encoding of binary frames, once negotiated
+        self._encoding = None
+
+        # The address of the client. It identifies the client to the blinkstick thread.
+        self.address = address
+        self._blinkstick_client = BlinkstickDTO( self._blinkstick_thread, str( address ) )
+
+
+    def _validate_message( self, validator: MessageValidator | None, message ):
+        if validator is not None:
+            validator.validate( message )
+
+
+    def send_message( self, data: str | object ):
+        if isinstance(data, object):
+            self._validate_message( self._send_validator, data )
+        self._send( encode( data, self._encoding ) )
+
+
+    def send_encoded( self, message: EncodedMessage ):
+        """ Sends a message that has already been validated, in this client's encoding """
+        self._send( message.payload( self._encoding, encode ) )
+
+
+    def handle( self, data ):
+        try:
+            if isinstance(data, str):
+                messagesReceivedCounter.labels( "json" ).inc( 1 )
+                data = json.loads( data )
+            elif self._encoding == "msgpack":
+                messagesReceivedCounter.labels( "msgpack" ).inc( 1 )
+                data = msgpack.unpackb( data )
+            else:
+                return
+            self._validate_message( self._receive_validator, data )
+
+            # {"ping": true} -> {"pong": true}
+            if "ping" in data and data["ping"]:
+                logging.debug( "Ping!" )
+                self.send_message( {"pong": True} )
+                return
+
+            # {"enable": "type"} -> {"success": "true|false"}
+            if "enable" in data:
+                logging.debug( "socket thread enabling %s", data["enable"] )
+                self._blinkstick_client.enable( data["enable"] )
+                self.send_message( {"success": True } )
+                return
+
+            # {"disable": "type"} -> {"success": "true|false"}
+            if "disable" in data:
+                logging.debug( "socket thread disabling %s", data["disable"] )
+                self._blinkstick_client.disable( data["disable"] )
+                self.send_message( {"success": True } )
+                return
+
+            # {"batch": [{"enable": "type"}, {"disable": "type"}, ...]} -> {"success": true}
+            if "batch" in data:
+                logging.debug( "socket thread applying a batch of %d changes", len( data["batch"] ) )
+                self._blinkstick_client.batch( data["batch"] )
+                self.send_message( {"success": True } )
+                return
+
+            # {"sync": ["type", ...]} -> {"success": true}
+            # The listed alerts are all the alerts this client has on
+            if "sync" in data:
+                logging.debug( "socket thread syncing %s", data["sync"] )
+                self._blinkstick_client.sync( data["sync"] )
+                self.send_message( {"success": True } )
+                return
+
+            # {"subscribe": true} -> {"snapshot": {...}, "sequence": N}, then diffs as the state changes
+            # {"subscribe": false} -> {"success": true}
+            if "subscribe" in data:
+                if self._publisher is None:
+                    self.send_message( {"success": False} )
+                elif data["subscribe"]:
+                    self._publisher.subscribe( self )
+                else:
+                    self._publisher.unsubscribe( self )
+                    self.send_message( {"success": True} )
+                return
+
+            if "name" in data or "link" in data:
+                with self._clients_lock:
+                    if "name" in data:
+                        client_type_counter.rename( self._clients[self.address].name, data["name"] )
+                        self._clients[self.address].name = data["name"]
+
+                    if "link" in data:
+                        self._clients[self.address].link = data["link"]
+                if "name" in data:
+                    # Lets the blinkstick thread journal the client's alerts under its name
+                    self._blinkstick_client.identify( data["name"] )
+
+                # The reply is in json: the client only switches once it has it
+                encoding = next( ( encoding for encoding in data.get( "encodings", [] )
+                                   if encoding in ENCODINGS ), None )
+                if encoding is not None:
+                    self.send_message( {"success": True, "encoding": encoding } )
+                    self._encoding = encoding
+                else:
+                    self.send_message( {"success": True } )
+
+
+        except Exception as e:
+            logging.exception( e )
+
+
+    def connected( self ):
+        try:
+            logging.debug( "adding client %s", str( self.address ) )
+            with self._clients_lock:
+                self._clients[self.address] = Client()
+                client_type_counter.add( None )
+            self._blinkstick_client.register()
+
+        except Exception as e:
+            logging.exception( e )
+
+
+    def closed( self ):
+        try:
+            with self._clients_lock:
+                logging.debug( "removing client %s", str( self.address ) )
+                if self.address in self._clients:
+                    client_type_counter.remove( self._clients[self.address].name )
+                    del self._clients[self.address]
+            if self._publisher is not None:
+                self._publisher.unsubscribe( self )
+            self._blinkstick_client.unregister()
+
+        except Exception as e:
+            logging.exception( e )
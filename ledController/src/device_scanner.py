@@ -0,0 +1,98 @@
+import logging
+import threading
+from typing import Callable
+
+from prometheus_client import Counter
+
+scansCounter = Counter(
+        'blinkstick_scans',
+        'The number of times the usb bus was scanned for blinksticks' )
+
+# Defaults for the optional `scan` section of the config
+DEFAULT_SCAN_MIN_INTERVAL = 1
+DEFAULT_SCAN_MAX_INTERVAL = 30
+
+def find_blinksticks() -> list:
+    # Imported here so that the controller still runs (without leds) when the usb libraries are missing
+    from blinkstick import blinkstick # pylint: disable=import-outside-toplevel
+    return blinkstick.find_all()
+
+
+class DeviceScanner( threading.Thread ):
+    """
+    Periodically looks for blinksticks that aren't attached yet, and hands each one to `attach`
+    along with its serial number and position in the scan. The serial of an attached blinkstick
+    that is no longer on the bus is handed to `detach`.
+
+    Scanning backs off: the interval doubles after every scan, from `min_interval` up to
+    `max_interval`, and drops back to `min_interval` whenever the set of blinksticks present on the
+    bus changes. A device that keeps failing is reattached less and less often, while one that was
+    just plugged in is noticed within `max_interval`.
+    """
+
+    def __init__( self,
+                  attached: Callable[[], set[str]],
+                  attach:   Callable[[object, str, int], None],
+                  detach:   Callable[[str], None],
+                  find:     Callable[[], list] = find_blinksticks,
+                  min_interval: float = DEFAULT_SCAN_MIN_INTERVAL,
+                  max_interval: float = DEFAULT_SCAN_MAX_INTERVAL,
+                  *args, **kwargs ):
+        super().__init__( *args, daemon=True, name="blinkstick scanner", **kwargs )
+        self._attached = attached
+        self._attach = attach
+        self._detach = detach
+        self._find = find
+        self._min_interval = min_interval
+        self._max_interval = max_interval
+        self._stopped = threading.Event()
+        self._present = None
+
+
+    def scan( self ) -> bool:
+        """
+        Attaches the new blinksticks, and detaches the ones that are gone. Returns True if the
+        blinksticks present have changed.
+        """
+        scansCounter.inc( 1 )
+        try:
+            sticks = self._find()
+            serials = [ stick.get_serial() for stick in sticks ]
+            found = True
+        except Exception as e:
+            # Most likely no usb backend, or the usb libraries aren't installed
+            logging.debug( "scanning for blinksticks failed: %s", e )
+            sticks, serials = [], []
+            found = False
+
+        present = set( serials )
+        if len( present ) == 0 and self._present != set():
+            logging.error( "no blinksticks found!" )
+        changed = present != self._present
+        self._present = present
+
+        attached = self._attached()
+        # A failed scan says nothing about the attached blinksticks: they're left alone
+        if found:
+            for serial in sorted( attached - present ):
+                logging.info( "blinkstick %s is gone", serial )
+                self._detach( serial )
+        for position, (stick, serial) in enumerate( zip( sticks, serials ) ):
+            if serial not in attached:
+                logging.info( "found blinkstick %s", serial )
+                self._attach( stick, serial, position )
+        return changed
+
+
+    def run( self ):
+        # The first scan is left to the owner, which does it before starting the thread
+        interval = self._min_interval
+        while not self._stopped.wait( interval ):
+            if self.scan():
+                interval = self._min_interval
+            else:
+                interval = min( interval * 2, self._max_interval )
+
+
+    def stop( self ):
+        self._stopped.set()
@@ -0,0 +1,153 @@
+import math
+import time
+from dataclasses import dataclass
+from typing import Callable
+
+from prometheus_client import Counter
+
+suppressedTransitionsCounter = Counter(
+        'blinkstick_suppressed_transitions',
+        'The number of times an alert turned on or off, but the led was held in its state: `min_on` '
+        'and `min_off` transitions came too soon after the last one, `penalty` transitions came '
+        'while the alert was flapping',
+        ['name', 'reason'] )
+
+# Defaults for the optional `damping` section of the config, and of each alert
+DEFAULT_HALF_LIFE = 60
+
+@dataclass( frozen=True, slots=True )
+class DampingPolicy:
+    """
+    How an alert's led is kept from strobing when the alert flaps.
+
+    Once shown, the alert stays on for at least `min_on_time` seconds; once cleared, it stays off for
+    at least `min_off_time` seconds. Each transition of the alert also adds 1 to its penalty, which
+    halves every `half_life` seconds. When the penalty reaches `suppress_above` the led is frozen,
+    until the penalty decays below `reuse_below`. A `suppress_above` of 0 turns the penalty off.
+    """
+    min_on_time: float = 0
+    min_off_time: float = 0
+    suppress_above: float = 0
+    reuse_below: float = 0
+    half_life: float = DEFAULT_HALF_LIFE
+
+    @staticmethod
+    def from_config( config: dict ) -> "DampingPolicy":
+        suppress_above = config.get( "suppressAbove", 0 )
+        return DampingPolicy( config.get( "minOnTime", 0 ),
+                              config.get( "minOffTime", 0 ),
+                              suppress_above,
+                              config.get( "reuseBelow", suppress_above / 2 ),
+                              config.get( "halfLife", DEFAULT_HALF_LIFE ) )
+
+
+def parse_damping( config: dict ) -> dict[str, DampingPolicy]:
+    """ The damping policy of each alert: its own `damping`, or the config's `damping` """
+    default = config.get( "damping" )
+    policies = {}
+    for alert in config["alerts"]:
+        damping = alert.get( "damping", default )
+        if damping is not None:
+            policies[alert["name"]] = DampingPolicy.from_config( damping )
+    return policies
+
+
+class _State:
+    __slots__ = ( "raw", "shown", "shown_at", "penalty", "penalty_at", "suppressed" )
+
+    def __init__( self ):
+        # Whether any source has the alert on, and whether the led shows it
+        self.raw = False
+        self.shown = False
+        self.shown_at = -math.inf
+        self.penalty = 0.0
+        self.penalty_at = 0.0
+        self.suppressed = False
+
+
+class FlapDamper:
+    """
+    Decides whether an alert is shown, given whether it is on, and its damping policy. Alerts
+    without a policy are shown exactly when they are on.
+
+    A transition that can't be shown yet is left pending, and `schedule( alert, when )` is called
+    with the time (on `clock`) at which the alert should be reevaluated. Nothing is polled: the
+    owner calls `reevaluate` at that time.
+    """
+
+    def __init__( self,
+                  policies: dict[str, DampingPolicy],
+                  schedule: Callable[[str, float], None],
+                  clock: Callable[[], float] = time.monotonic ):
+        self._policies = policies
+        self._schedule = schedule
+        self._clock = clock
+        # alert name -> _State, for the alerts with a policy
+        self._states = {}
+
+
+    def update( self, alert_name: str, raw: bool ) -> bool:
+        """ The alert turned on or off. Returns whether it is shown. """
+        policy = self._policies.get( alert_name )
+        if policy is None:
+            return raw
+
+        state = self._states.setdefault( alert_name, _State() )
+        if raw == state.raw:
+            return state.shown
+        state.raw = raw
+
+        now = self._clock()
+        if policy.suppress_above > 0:
+            self._decay( state, policy, now )
+            state.penalty += 1
+            if state.penalty >= policy.suppress_above:
+                state.suppressed = True
+
+        shown = self._decide( alert_name, state, policy, now )
+        if shown != raw:
+            suppressedTransitionsCounter.labels( alert_name, self._reason( state ) ).inc( 1 )
+        return shown
+
+
+    def reevaluate( self, alert_name: str ) -> bool:
+        """ Applies the alert's pending transition, if it is due. Returns whether it is shown. """
+        state = self._states.get( alert_name )
+        if state is None:
+            return False
+        return self._decide( alert_name, state, self._policies[alert_name], self._clock() )
+
+
+    def _decide( self, alert_name: str, state: _State, policy: DampingPolicy, now: float ) -> bool:
+        if state.suppressed:
+            self._decay( state, policy, now )
+            if state.penalty < policy.reuse_below:
+                state.suppressed = False
+
+        if state.raw == state.shown:
+            return state.shown
+
+        if state.suppressed:
+            # When the penalty will have decayed to the reuse threshold
+            due = now + policy.half_life * math.log2( state.penalty / policy.reuse_below )
+        else:
+            due = state.shown_at + (policy.min_on_time if state.shown else policy.min_off_time)
+
+        if now < due:
+            self._schedule( alert_name, due )
+            return state.shown
+
+        state.shown = state.raw
+        state.shown_at = now
+        return state.shown
+
+
+    def _decay( self, state: _State, policy: DampingPolicy, now: float ):
+        state.penalty *= 0.5 ** ((now - state.penalty_at) / policy.half_life)
+        state.penalty_at = now
+
+
+    def _reason( self, state: _State ) -> str:
+        if state.suppressed:
+            return "penalty"
+        return "min_on" if state.shown else "min_off"
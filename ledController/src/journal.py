@@ -0,0 +1,101 @@
+import json
+import logging
+import os
+
+from prometheus_client import Counter
+
+journalRecordsCounter = Counter(
+        'blinkstick_journal_records',
+        'The number of records appended to the alert state journal' )
+journalCompactionsCounter = Counter(
+        'blinkstick_journal_compactions',
+        'The number of times the alert state journal was rewritten to drop superseded records' )
+
+# Defaults for the optional `journal` section of the config
+DEFAULT_GRACE_PERIOD = 60
+DEFAULT_COMPACT_EVERY = 1000
+
+class Journal:
+    """
+    An append-only file of the alerts enabled by each named client, so that the led state can be
+    restored as soon as the controller restarts.
+
+    Every record is one line of json holding the whole state of one client:
+        {"name": "Calendar Listener", "alerts": ["Meeting"]}
+    A later record for the same client replaces an earlier one, and an empty list forgets the
+    client. Once `compact_every` records have been appended, the file is rewritten with only the
+    current record of each client.
+    """
+
+    def __init__( self, path: str, compact_every: int = DEFAULT_COMPACT_EVERY ):
+        self._path = path
+        self._compact_every = compact_every
+        # client name -> alert names
+        self._state = {}
+        self._appended = 0
+        self._file = None
+
+
+    def load( self ) -> dict[str, list[str]]:
+        """ Reads the journal, and opens it for appending. Returns the alerts of each client. """
+        try:
+            with open( self._path, "r", encoding="utf-8" ) as f:
+                for line in f:
+                    try:
+                        record = json.loads( line )
+                    except json.JSONDecodeError:
+                        # The last record can be cut short by a crash
+                        logging.warning( "skipping a corrupt journal record: %s", line.strip() )
+                        continue
+                    self._apply( record["name"], record["alerts"] )
+        except FileNotFoundError:
+            pass
+
+        # Start from a compact file, which also drops any corrupt records
+        self._compact()
+        return { name: list( alerts ) for name, alerts in self._state.items() }
+
+
+    def record( self, name: str, alerts: list[str] ):
+        if self._state.get( name, [] ) == alerts:
+            return
+        self._apply( name, alerts )
+        self._file.write( json.dumps( {"name": name, "alerts": alerts} ) + "\n" )
+        journalRecordsCounter.inc( 1 )
+
+        self._appended += 1
+        if self._appended >= self._compact_every:
+            self._compact()
+
+
+    def flush( self ):
+        self._file.flush()
+
+
+    def close( self ):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+    def _apply( self, name: str, alerts: list[str] ):
+        if len( alerts ) == 0:
+            self._state.pop( name, None )
+        else:
+            self._state[name] = alerts
+
+
+    def _compact( self ):
+        self.close()
+        # Written to the side and renamed over the journal, so that a crash leaves one or the other
+        temporary = self._path + ".tmp"
+        with open( temporary, "w", encoding="utf-8" ) as f:
+            for name, alerts in self._state.items():
+                f.write( json.dumps( {"name": name, "alerts": alerts} ) + "\n" )
+            f.flush()
+            os.fsync( f.fileno() )
+        os.replace( temporary, self._path )
+
+        self._file = open( self._path, "a", encoding="utf-8" ) # pylint: disable=consider-using-with
+        self._appended = 0
+        journalCompactionsCounter.inc( 1 )
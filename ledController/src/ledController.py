@@ -10,160 +10,59 @@ from functools import partial
 from typing import override
 
 import yaml
-import jsonschema
-import jsonschema.exceptions
 
-from blinkstickThread import BlinkstickThread, BlinkstickDTO
+from blinkstickThread import BlinkstickThread
+from client_session import ClientSession
+from message_validator import MessageValidator, parse_validation_mode
+from snapshot_publisher import SnapshotPublisher
 from myblinkstick.navbar import Navbar
 from myblinkstick.application import Application
 
-from prometheus_client import Gauge
-
 from simple_websocket_server import WebSocketServer, WebSocket
 
-clients_gauge = Gauge(
-        'clients',
-        'Specifies which clients are connected',
-        ['type'] )
-CLIENT_TYPES = set(['Calendar Listener',
-                    'Outlook Listener',
-                    'Webhook Listener',
-                    'Bitbucket Listener',
-                    'ManualSet',
-                    None])
-for client in CLIENT_TYPES:
-    clients_gauge.labels( client ).set( 0 )
-
-
-class Client:
-    name = None
-    link = None
-
-
 class WebSocketHandler( WebSocket ):
     def __init__( self,
-                  receive_schema:    object | None,
-                  send_schema:       object | None,
+                  receive_validator: MessageValidator | None,
+                  send_validator:    MessageValidator | None,
                   blinkstick_thread: BlinkstickThread,
                   address:           str,
                   clients_lock:      threading.Lock,
                   clients:           dict,
                   *args,
+                  publisher:         SnapshotPublisher | None = None,
                   **kwargs ):
         try:
-            self._blinkstick_thread = blinkstick_thread
-            self._clients = clients
-            self._clients_lock = clients_lock
-            self._receive_schema = receive_schema
-            self._send_schema = send_schema
-
             super().__init__( *args, *kwargs )
-            # TODO: can we remove `address`?  The parent has self.address
-            self._blinkstick_client = BlinkstickDTO( self._blinkstick_thread, address )
+            # `address` is the address the server is bound to. Clients are identified by the address
+            # of their end of the socket (self.address).
+            self._session = ClientSession( receive_validator,
+                                           send_validator,
+                                           blinkstick_thread,
+                                           self.address,
+                                           clients_lock,
+                                           clients,
+                                           partial( WebSocket.send_message, self ),
+                                           publisher )
 
         except Exception as e:
             logging.exception( e )
             raise e
 
-
-    def _validate_message( self, schema, message ):
-        try:
-            # TODO: add an environment variable or commandline parameter to
-            # disable validation (in case it becomes a performance problem)
-            if schema is not None:
-                jsonschema.validate( schema=schema, instance=message )
-        except jsonschema.exceptions.ValidationError as e:
-            logging.error( "Error validating json: %s", e )
-        except jsonschema.exceptions.SchemaError as e:
-            logging.error( "Error validating schema: %s", e )
-
     @override
     def send_message( self, data: str | object ):
-        if isinstance(data, object):
-            self._validate_message( self._send_schema, data )
-        super().send_message( json.dumps( data ).encode( "ascii" ) )
-
-    def _update_clients_gauges( self ):
-        """ Populates the clients{type=$NAME} prometheus metrics """
-
-        # This function isn't very efficient. There are much better ways to implement. Performance
-        # hasn't been a limitation yet.
-
-        total_client_types = CLIENT_TYPES \
-                           | set( map( lambda x: self._clients[x].name, self._clients ) )
-        for client in total_client_types:
-            clients_gauge.labels( client if client is not None else "None" ) \
-                        .set( len( list( filter( lambda x: self._clients[x].name == client, self._clients ) ) ) )
+        self._session.send_message( data )
 
     @override
     def handle( self ):
-        try:
-            if isinstance(self.data, str):
-                data = json.loads( self.data )
-            else:
-                return
-            self._validate_message( self._receive_schema, data )
-
-            # {"ping": true} -> {"pong": true}
-            if "ping" in data and data["ping"]:
-                logging.debug( "Ping!" )
-                self.send_message( {"pong": True} )
-                return
-
-            # {"enable": "type"} -> {"success": "true|false"}
-            if "enable" in data:
-                logging.debug( "socket thread enabling %s", data["enable"] )
-                self._blinkstick_client.enable( data["enable"] )
-                self.send_message( {"success": True } )
-                return
-
-            # {"disable": "type"} -> {"success": "true|false"}
-            if "disable" in data:
-                logging.debug( "socket thread disabling %s", data["disable"] )
-                self._blinkstick_client.disable( data["disable"] )
-                self.send_message( {"success": True } )
-                return
-
-            if "name" in data or "link" in data:
-                with self._clients_lock:
-                    if "name" in data:
-                        self._clients[self.address].name = data["name"]
-
-                    if "link" in data:
-                        self._clients[self.address].link = data["link"]
-                self.send_message( {"success": True } )
-
-
-                self._update_clients_gauges()
-
-
-        except Exception as e:
-            logging.exception( e )
+        self._session.handle( self.data )
 
     @override
     def connected( self ):
-        try:
-            logging.debug( "adding client %s", str( self.address ) )
-            with self._clients_lock:
-                self._clients[self.address] = Client()
-                self._update_clients_gauges()
-            self._blinkstick_client.register()
-
-        except Exception as e:
-            logging.exception( e )
+        self._session.connected()
 
     @override
     def handle_close( self ):
-        try:
-            with self._clients_lock:
-                logging.debug( "removing client %s", str( self.address ) )
-                if self.address in self._clients:
-                    del self._clients[self.address]
-                self._update_clients_gauges()
-            self._blinkstick_client.unregister()
-
-        except Exception as e:
-            logging.exception( e )
+        self._session.closed()
 
 
     # TODO: if the thread terminates, remove it from the list of threads in main(), otherwise
@@ -176,6 +75,7 @@ class LEDController( Application ):
     def __init__(self, args):
         super().__init__(args)
         self._blinkstick_thread = None
+        self._snapshot_publisher = None
         self._clients = {}
         self._clients_lock = threading.Lock()
 
@@ -186,9 +86,29 @@ class LEDController( Application ):
                             help='The web socket port to bind to',
                             default='9099',
                             dest='ws_port')
+        parser.add_argument('--ws-server',
+                            help='The websocket server implementation: a select loop on its own '
+                                 'thread, or an asyncio event loop',
+                            choices=['threaded', 'asyncio'],
+                            default='threaded',
+                            dest='ws_server')
+        parser.add_argument('--validation',
+                            help='How many websocket messages are validated against their schema: '
+                                 'off, strict (all of them), or a percentage, e.g. 10%%',
+                            type=self._validation_mode,
+                            default='strict',
+                            dest='validation')
         return parser
 
-    def _start_websocket_server(self, blinkstick_thread):
+    @staticmethod
+    def _validation_mode( mode: str ) -> str:
+        try:
+            parse_validation_mode( mode )
+        except ValueError as e:
+            raise argparse.ArgumentTypeError( str( e ) ) from e
+        return mode
+
+    def _start_websocket_server(self, blinkstick_thread, publisher):
         def start_websocket_server_thread():
             receive_schema = None
             try:
@@ -205,15 +125,39 @@ class LEDController( Application ):
             except Exception:
                 logging.warning("Unable to parse schema file send.schema.json")
 
+            # Compiled once, and shared by every client
+            receive_validator = MessageValidator( receive_schema, "receive", self._parsed_args.validation )
+            send_validator = MessageValidator( send_schema, "send", self._parsed_args.validation )
+
             try:
                 address = '0.0.0.0'
+                if self._parsed_args.ws_server == 'asyncio':
+                    # Only needed (and only imported) in asyncio mode
+                    from async_websocket_server import AsyncWebSocketServer # pylint: disable=import-outside-toplevel
+
+                    def session_factory( client_address, send ):
+                        return ClientSession( receive_validator,
+                                              send_validator,
+                                              blinkstick_thread,
+                                              client_address,
+                                              self._clients_lock,
+                                              self._clients,
+                                              send,
+                                              publisher )
+                    logging.info("starting asyncio websocket server...")
+                    AsyncWebSocketServer( address,
+                                          int( self._parsed_args.ws_port ),
+                                          session_factory ).serve_forever()
+                    return
+
                 handler = partial(WebSocketHandler,
-                                  receive_schema,
-                                  send_schema,
+                                  receive_validator,
+                                  send_validator,
                                   blinkstick_thread,
                                   address,
                                   self._clients_lock,
-                                  self._clients )
+                                  self._clients,
+                                  publisher=publisher )
                 logging.info("starting websocket handler...")
                 server = WebSocketServer( address, self._parsed_args.ws_port, handler )
                 server.serve_forever()
@@ -224,7 +168,9 @@ class LEDController( Application ):
 
     @override
     def _get_httpd_handler(self) -> type[http.server.SimpleHTTPRequestHandler]:
-        blinkstick_thread = self._blinkstick_thread
+        # The http server is started before the blinkstick thread is created
+        def get_blinkstick_thread():
+            return self._blinkstick_thread
         clients = self._clients
         clients_lock = self._clients_lock
         config = self._config
@@ -239,10 +185,12 @@ class LEDController( Application ):
                 try:
                     current_alerts = None
                     visible_alerts = None
+                    blinkstick_thread = get_blinkstick_thread()
                     if blinkstick_thread is not None:
-                        current_alerts = blinkstick_thread.get_current_alerts()
-                        visible_alerts = blinkstick_thread.get_visible_alerts()
-                    # TODO: add a websocket for pushing state updates to the web client
+                        # A published snapshot: reading it doesn't wait on the blinkstick thread
+                        snapshot = blinkstick_thread.get_snapshot().to_json()
+                        current_alerts = snapshot["current"]
+                        visible_alerts = snapshot["visible"]
                     response = """
                         <html>
                             <head>
@@ -262,20 +210,58 @@ class LEDController( Application ):
                                     padding: 10px;
                                     }
                                 </style>
+                                <script>
+                                    // Keeps the alerts up to date by subscribing to state changes
+                                    $( document ).ready( function() {
+                                        let state = null;
+                                        let received = Promise.resolve();
+                                        let webSocket = new WebSocket( "ws://" + location.host + "/ws/dashboard" );
+                                        webSocket.addEventListener( "open", (event) => {
+                                            webSocket.send( JSON.stringify( {"subscribe": true} ) );
+                                        } );
+                                        webSocket.addEventListener( "message", (event) => {
+                                            // The controller sends binary frames. Decoding them is
+                                            // asynchronous, so chain the promises to keep them in order.
+                                            let data = event.data;
+                                            received = received
+                                                .then( () => typeof data === "string" ? data : data.text() )
+                                                .then( (text) => {
+                                                    let message = JSON.parse( text );
+                                                    if( "snapshot" in message ) {
+                                                        state = message.snapshot;
+                                                    } else if( "diff" in message ) {
+                                                        if( state === null || message.from !== state.version ) {
+                                                            // We missed a change: start over
+                                                            state = null;
+                                                            webSocket.send( JSON.stringify( {"subscribe": true} ) );
+                                                            return;
+                                                        }
+                                                        Object.assign( state.visible, message.diff.visible );
+                                                        Object.assign( state.current, message.diff.current );
+                                                        state.version = message.sequence;
+                                                    } else {
+                                                        return;
+                                                    }
+                                                    $( "#visible-alerts" ).text( JSON.stringify( state.visible ) );
+                                                    $( "#current-alerts" ).text( JSON.stringify( state.current ) );
+                                                } );
+                                        } );
+                                    } );
+                                </script>
                             </head>
                             <body>
                             """ \
                         + Navbar().render() \
                         + """
                             <h3>Current Alert</h3>
-                            """ \
-                        + str( visible_alerts ) \
-                        + """
+                            <span id="visible-alerts">""" \
+                        + json.dumps( visible_alerts ) \
+                        + """</span>
                                 <br>
                                 <br>
                                 <h3>Alerts Fired</h3>
-                                <pre class="bg-light">""" \
-                        + str( current_alerts ) \
+                                <pre class="bg-light" id="current-alerts">""" \
+                        + json.dumps( current_alerts ) \
                         + """</pre>
                                 <h3>Clients</h3>
                                 <table class="table"><tr><th>Name</th><th>id</th></tr>"""
@@ -337,7 +323,9 @@ class LEDController( Application ):
 
         self._blinkstick_thread = BlinkstickThread( self._config )
         self._blinkstick_thread.start()
-        self._start_websocket_server( self._blinkstick_thread )
+        self._snapshot_publisher = SnapshotPublisher( self._blinkstick_thread )
+        self._snapshot_publisher.start()
+        self._start_websocket_server( self._blinkstick_thread, self._snapshot_publisher )
 
         self._up.set(1)
 
@@ -0,0 +1,73 @@
+import logging
+import random
+import time
+
+import jsonschema
+import jsonschema.exceptions
+import jsonschema.validators
+
+from prometheus_client import Counter, Histogram
+
+validationSecondsHistogram = Histogram(
+        'message_validation_seconds',
+        'Time spent validating websocket messages against their schema',
+        ['schema'],
+        buckets=[0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01] )
+validationFailuresCounter = Counter(
+        'message_validation_failures',
+        'The number of websocket messages that did not match their schema',
+        ['schema'] )
+
+def parse_validation_mode( mode: str ) -> float:
+    """
+    Converts a validation mode to the fraction of messages that are validated:
+    `off` (none), `strict` (all) or a percentage such as `10%`.
+    """
+    if mode == "off":
+        return 0.0
+    if mode == "strict":
+        return 1.0
+    if mode.endswith( "%" ):
+        rate = float( mode[:-1] ) / 100
+        if 0 <= rate <= 1:
+            return rate
+    raise ValueError( f"Invalid validation mode `{mode}`: expected off, strict, or a percentage" )
+
+
+class MessageValidator:
+    """
+    Validates messages against a json schema. The schema is checked and compiled once, when the
+    validator is created.
+
+    Invalid messages are only logged: validation never stops a message from being processed.
+    """
+
+    def __init__( self, schema: object | None, name: str, mode: str = "strict" ):
+        self._name = name
+        self._rate = parse_validation_mode( mode )
+        self._validator = None
+
+        if schema is not None:
+            try:
+                validator_class = jsonschema.validators.validator_for( schema )
+                validator_class.check_schema( schema )
+                self._validator = validator_class( schema )
+            except jsonschema.exceptions.SchemaError as e:
+                logging.error( "Error validating schema: %s", e )
+
+        validationFailuresCounter.labels( name ).inc( 0 )
+
+
+    def validate( self, message: object ):
+        if self._validator is None or self._rate == 0:
+            return
+        if self._rate < 1 and random.random() >= self._rate:
+            return
+
+        start = time.perf_counter()
+        error = jsonschema.exceptions.best_match( self._validator.iter_errors( message ) )
+        validationSecondsHistogram.labels( self._name ).observe( time.perf_counter() - start )
+
+        if error is not None:
+            validationFailuresCounter.labels( self._name ).inc( 1 )
+            logging.error( "Error validating json: %s", error )
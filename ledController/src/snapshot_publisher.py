@@ -0,0 +1,95 @@
+import logging
+import threading
+from typing import Callable
+
+from blinkstickThread import BlinkstickThread
+
+class EncodedMessage:
+    """
+    A message sent to many subscribers, encoded at most once for each encoding the subscribers
+    use. Only used on the publisher's thread.
+    """
+
+    def __init__( self, data: dict ):
+        self.data = data
+        # encoding -> payload
+        self._payloads = {}
+
+
+    def payload( self, encoding: str, encode: Callable[[object, str], bytes] ) -> bytes:
+        if encoding not in self._payloads:
+            self._payloads[encoding] = encode( self.data, encoding )
+        return self._payloads[encoding]
+
+
+class SnapshotPublisher( threading.Thread ):
+    """
+    Pushes alert state changes to subscribed clients.
+
+    A client that subscribes is sent the whole state:
+        {"snapshot": {...}, "sequence": N}
+    then a diff every time the state changes:
+        {"diff": {"visible": {...}, "current": {...}}, "from": N, "sequence": M}
+    A diff only applies to the state with sequence `from`. Changes can be coalesced, so `sequence`
+    can skip numbers; a client that sees a `from` it doesn't have has missed a diff, and should
+    subscribe again.
+
+    Diffs are computed once, on this thread, for every subscriber, and encoded once for each
+    encoding the subscribers negotiated. The blinkstick
+    thread only publishes its snapshot; it never waits on a subscriber.
+    """
+
+    def __init__( self, blinkstick_thread: BlinkstickThread, *args, **kwargs ):
+        super().__init__( *args, daemon=True, **kwargs )
+        self._blinkstick_thread = blinkstick_thread
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        # The snapshot the subscribers have most recently been brought up to
+        self._last = blinkstick_thread.get_snapshot()
+        self._interrupted = False
+
+
+    def subscribe( self, session ):
+        with self._lock:
+            self._subscribers.add( session )
+            # Sent while holding the lock, so no diff can be sent to the session before it
+            session.send_message( { "snapshot": self._last.to_json(),
+                                    "sequence": self._last.version } )
+
+
+    def unsubscribe( self, session ):
+        with self._lock:
+            self._subscribers.discard( session )
+
+
+    def run( self ):
+        while not self._interrupted:
+            try:
+                # Time out, so that stop() is noticed
+                snapshot = self._blinkstick_thread.wait_for_snapshot( self._last.version, timeout=1 )
+                if snapshot.version == self._last.version:
+                    continue
+
+                with self._lock:
+                    previous = self._last
+                    self._last = snapshot
+                    subscribers = list( self._subscribers )
+
+                if len( subscribers ) == 0:
+                    continue
+
+                message = EncodedMessage( { "diff":     snapshot.diff( previous ),
+                                            "from":     previous.version,
+                                            "sequence": snapshot.version } )
+                for subscriber in subscribers:
+                    try:
+                        subscriber.send_encoded( message )
+                    except Exception as e:
+                        logging.exception( e )
+
+            except Exception as e:
+                logging.exception( e )
+
+
+    def stop( self ):
+        self._interrupted = True
@@ -0,0 +1,244 @@
+"""
+Benchmarks the led path: BlinkstickThread driving a fake blinkstick with synthetic workloads.
+
+    PYTHONPATH=ledController/src:libblinkstick/src \
+        python ledController/test/benchmark/blinkstick_thread_benchmark.py
+
+Each workload is run twice. Sent as fast as possible, it measures the messages applied per second;
+sent at --rate messages per second, it measures the enqueue-to-paint latency percentiles and the
+usb writes issued to the stick. The results are compared with baseline.json: a workload that is
+slower (or writes more) than its baseline by more than --tolerance fails the run. The usb writes
+are only compared when the workload sent as many --messages as its baseline. The baseline is only
+meaningful on the machine it was recorded on: record one with --update-baseline before comparing
+changes to the hot loop.
+
+"Paint" is the moment the colors of a batch are handed to the device writers. It is measured with
+Flush messages used as probes: a probe is released once every message enqueued before it has been
+applied and painted.
+"""
+import argparse
+import itertools
+import json
+import logging
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+
+from blinkstickThread import BlinkstickThread
+from blinkstick_messages import Enable, Disable, Register, Unregister, Flush
+from alert_index import CHANNELS
+
+BASELINE = os.path.join( os.path.dirname( __file__ ), "baseline.json" )
+
+COLORS = [ "red", "green", "blue", "yellow", "purple", "orange", "white", "cyan" ]
+RGB = { "black":  (0, 0, 0),
+        "red":    (255, 0, 0),
+        "green":  (0, 128, 0),
+        "blue":   (0, 0, 255),
+        "yellow": (255, 255, 0),
+        "purple": (128, 0, 128),
+        "orange": (255, 165, 0),
+        "white":  (255, 255, 255),
+        "cyan":   (0, 255, 255) }
+
+
+class FakeStick:
+    """ Counts the usb writes, optionally taking `latency` seconds for each """
+
+    def __init__( self, latency: float = 0 ):
+        self.latency = latency
+        self.writes = 0
+
+    def get_serial( self ):
+        return "BENCHMARK"
+
+    def get_inverse( self ):
+        return False
+
+    def _determine_rgb( self, name=None ):
+        return RGB[name]
+
+    def set_color( self, index=0, red=0, green=0, blue=0 ):
+        self._write()
+
+    def set_led_data( self, channel, data ):
+        self._write()
+
+    def _write( self ):
+        self.writes += 1
+        if self.latency > 0:
+            time.sleep( self.latency )
+
+
+class Probe( threading.Event ):
+    """ A Flush event that remembers when it was released """
+    painted = None
+
+    def set( self ):
+        self.painted = time.perf_counter()
+        super().set()
+
+
+def make_config( alerts: int ) -> dict:
+    return { "alerts": [ { "name": f"alert{i}", "channel": i % CHANNELS, "color": COLORS[i % len( COLORS )] }
+                         for i in range( 0, alerts ) ],
+             # Only the stick found at startup is used
+             "scan": { "minInterval": 3600, "maxInterval": 3600 } }
+
+
+def churn( rng: random.Random, sources: int, alerts: int, messages: int ):
+    """ Random sources enabling random alerts, and disabling them again soon after """
+    enabled = []
+    for _ in range( 0, messages ):
+        if enabled and rng.random() < 0.6:
+            source, alert = enabled.pop( rng.randrange( len( enabled ) ) )
+            yield Disable( alert, source )
+        else:
+            source, alert = f"source{rng.randrange( sources )}", f"alert{rng.randrange( alerts )}"
+            if (source, alert) not in enabled:
+                enabled.append( (source, alert) )
+            yield Enable( alert, source )
+
+
+def storm( rng: random.Random, sources: int, alerts: int, messages: int ):
+    """ Sources connect, enable a few alerts, and disconnect, all at once """
+    return itertools.islice( storms( rng, sources, alerts ), messages )
+
+
+def storms( rng: random.Random, sources: int, alerts: int ):
+    generation = 0
+    while True:
+        names = [ f"source{generation}.{i}" for i in range( 0, sources ) ]
+        for source in names:
+            yield Register( source )
+            for _ in range( 0, 3 ):
+                yield Enable( f"alert{rng.randrange( alerts )}", source )
+        for source in names:
+            yield Unregister( source )
+        generation += 1
+
+
+WORKLOADS = { "churn": churn,
+              "storm": storm }
+
+
+def run_workload( workload: str, sources: int, alerts: int, messages: int, rate: float,
+                  probe_every: int, usb_latency: float, seed: int ) -> dict:
+    stick = FakeStick( usb_latency )
+    thread = BlinkstickThread( make_config( alerts ), find_sticks=lambda: [stick], daemon=True )
+    thread.start()
+    # The stick is attached, and cleared, by the first batch
+    thread.flush()
+    writes = stick.writes
+
+    rng = random.Random( seed )
+    probes = []
+    count = 0
+    start = time.perf_counter()
+    for message in WORKLOADS[workload]( rng, sources, alerts, messages ):
+        thread.enqueue( message )
+        count += 1
+        if rate > 0:
+            ahead = start + count / rate - time.perf_counter()
+            if ahead > 0.001:
+                time.sleep( ahead )
+        if count % probe_every == 0:
+            probe = Probe()
+            thread.enqueue( Flush( probe ) )
+            probes.append( (time.perf_counter(), probe) )
+
+    last = Probe()
+    thread.enqueue( Flush( last ) )
+    last.wait()
+    elapsed = time.perf_counter() - start
+
+    for _, probe in probes:
+        probe.wait()
+    thread.terminate()
+    thread.join()
+
+    latencies = sorted( (probe.painted - enqueued) * 1000 for enqueued, probe in probes )
+    percentiles = statistics.quantiles( latencies, n=100, method="inclusive" ) \
+        if len( latencies ) > 1 else latencies * 99
+    return { "messages":            count,
+             "messages_per_second": round( count / elapsed ),
+             "latency_ms":          { "p50": round( percentiles[49], 3 ),
+                                      "p90": round( percentiles[89], 3 ),
+                                      "p99": round( percentiles[98], 3 ) },
+             "usb_writes":          stick.writes - writes }
+
+
+def regressions( results: dict, baseline: dict, tolerance: float ) -> list[str]:
+    found = []
+    for workload, result in results.items():
+        if workload not in baseline:
+            continue
+        expected = baseline[workload]
+        if result["messages_per_second"] < expected["messages_per_second"] * (1 - tolerance):
+            found.append( f"{workload}: {result['messages_per_second']} messages/s, "
+                          f"baseline {expected['messages_per_second']}" )
+        # p99 is reported, but is too noisy to compare
+        if result["latency_ms"]["p90"] > expected["latency_ms"]["p90"] * (1 + tolerance):
+            found.append( f"{workload}: p90 latency {result['latency_ms']['p90']} ms, "
+                          f"baseline {expected['latency_ms']['p90']}" )
+        # The writes grow with the messages sent: only a baseline of the same length compares
+        if ( result["messages"] == expected["messages"]
+             and result["usb_writes"] > expected["usb_writes"] * (1 + tolerance) ):
+            found.append( f"{workload}: {result['usb_writes']} usb writes, "
+                          f"baseline {expected['usb_writes']}" )
+    return found
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser( description="Benchmarks BlinkstickThread with a fake blinkstick" )
+    parser.add_argument( "--workload", choices=list( WORKLOADS ), action="append",
+                         help="The workloads to run (default: all)" )
+    parser.add_argument( "--sources", type=int, default=50, help="The number of clients" )
+    parser.add_argument( "--alerts", type=int, default=32, help="The number of alerts, across 8 channels" )
+    parser.add_argument( "--messages", type=int, default=50000, help="The messages sent per workload" )
+    parser.add_argument( "--rate", type=float, default=20000,
+                         help="The messages sent per second while measuring latency" )
+    parser.add_argument( "--probe-every", type=int, default=100,
+                         help="Measure the latency of every n-th message" )
+    parser.add_argument( "--usb-latency", type=float, default=0,
+                         help="Seconds the fake blinkstick takes for each write" )
+    parser.add_argument( "--seed", type=int, default=0 )
+    parser.add_argument( "--tolerance", type=float, default=0.5,
+                         help="How much worse than the baseline a result can be, as a fraction" )
+    parser.add_argument( "--update-baseline", action="store_true",
+                         help="Record the results as the new baseline" )
+    args = parser.parse_args()
+
+    logging.basicConfig( level=logging.WARNING )
+
+    results = {}
+    for workload in args.workload or list( WORKLOADS ):
+        saturated, paced = [ run_workload( workload, args.sources, args.alerts, args.messages, rate,
+                                           args.probe_every, args.usb_latency, args.seed )
+                             for rate in (0, args.rate) ]
+        results[workload] = { "messages":            saturated["messages"],
+                              "messages_per_second": saturated["messages_per_second"],
+                              "latency_ms":          paced["latency_ms"],
+                              "usb_writes":          paced["usb_writes"] }
+    print( json.dumps( results, indent=4 ) )
+
+    if args.update_baseline:
+        with open( BASELINE, "w", encoding="ascii" ) as f:
+            f.write( json.dumps( results, indent=4 ) + "\n" )
+        return 0
+
+    if not os.path.exists( BASELINE ):
+        return 0
+    with open( BASELINE, "r", encoding="ascii" ) as f:
+        baseline = json.loads( f.read() )
+    found = regressions( results, baseline, args.tolerance )
+    for regression in found:
+        print( f"REGRESSION {regression}", file=sys.stderr )
+    return 1 if len( found ) > 0 else 0
+
+
+if __name__ == "__main__":
+    sys.exit( main() )
@@ -0,0 +1,274 @@
+"""
+Load tests a real ledController process through its websocket.
+
+    PYTHONPATH=ledController/src:libblinkstick/src:libblinkstick/test \
+        python ledController/test/benchmark/websocket_load.py --connections 2000
+
+Starts ledController.py (or uses the controller at --url) and opens --connections simulated sensors,
+--connect-rate connections per second. Each one does the handshake, then toggles an alert
+--toggle-rate times a second and pings --ping-rate times a second, until --duration seconds after
+the last connection was opened.
+
+Every second it prints the open connections, the acks received, and the controller's cpu and rss.
+At the end it reports the connect time and ack latency percentiles, and the connections that failed
+or were dropped. The controller acks the messages of a connection in order, so an ack is matched
+with the oldest unacknowledged message of its connection.
+
+The simulated sensors share one event loop: make sure it's the controller that's at 100% cpu, and
+not this process.
+"""
+import argparse
+import asyncio
+import collections
+import json
+import os
+import random
+import resource
+import statistics
+import sys
+import time
+
+import websockets
+
+from process_context import managed_led_controller
+
+
+class ProcessStats:
+    """ Samples the cpu and rss of a process from /proc """
+
+    def __init__( self, pid: int ):
+        self._pid = pid
+        self._ticks = os.sysconf( "SC_CLK_TCK" )
+        self._page_size = os.sysconf( "SC_PAGE_SIZE" )
+        self._last = None
+
+
+    def sample( self ) -> tuple[float, int]:
+        """ Returns the cpu used since the last sample, as a percentage of one core, and the rss in bytes """
+        with open( f"/proc/{self._pid}/stat", "r", encoding="ascii" ) as f:
+            # The command name can contain spaces: count the fields from the end of it. fields[0] is
+            # field 3 of proc(5).
+            fields = f.read().rsplit( ")", 1 )[1].split()
+        cpu = (int( fields[11] ) + int( fields[12] )) / self._ticks     # utime + stime
+        rss = int( fields[21] ) * self._page_size                       # in pages
+
+        now = time.monotonic()
+        percent = 0.0
+        if self._last is not None:
+            percent = 100 * (cpu - self._last[1]) / (now - self._last[0])
+        self._last = (now, cpu)
+        return percent, rss
+
+
+class Results:
+    def __init__( self ):
+        self.connect_seconds = []
+        self.ack_seconds = []
+        self.open = 0
+        self.failed = 0
+        self.dropped = 0
+        self.sent = 0
+        self.acks = 0
+        self.unacknowledged = 0
+        self.cpu_percent = []
+        self.rss = 0
+
+
+async def every( rate: float, action ):
+    """ Calls `action` about `rate` times a second, forever """
+    if rate <= 0:
+        await asyncio.get_running_loop().create_future()
+    interval = 1 / rate
+    # Spread the connections' messages out, rather than sending them in lockstep
+    await asyncio.sleep( random.uniform( 0, interval ) )
+    while True:
+        await action()
+        await asyncio.sleep( interval )
+
+
+async def sensor( index: int, args: argparse.Namespace, results: Results, stop: asyncio.Event ):
+    started = time.perf_counter()
+    try:
+        websocket = await websockets.connect( args.url, compression=None, open_timeout=args.timeout )
+    except (OSError, asyncio.TimeoutError, websockets.exceptions.WebSocketException):
+        results.failed += 1
+        return
+    results.connect_seconds.append( time.perf_counter() - started )
+    results.open += 1
+
+    # When each unacknowledged message was sent
+    pending = collections.deque()
+    enabled = False
+
+    async def send( message: dict ):
+        pending.append( time.perf_counter() )
+        results.sent += 1
+        await websocket.send( json.dumps( message ) )
+
+    async def receive():
+        async for _ in websocket:
+            results.ack_seconds.append( time.perf_counter() - pending.popleft() )
+            results.acks += 1
+
+    async def toggle():
+        nonlocal enabled
+        enabled = not enabled
+        await send( {"enable" if enabled else "disable": args.alert} )
+
+    async def ping():
+        await send( {"ping": True} )
+
+    receiver = asyncio.create_task( receive() )
+    handshake = asyncio.create_task( send( {"name": f"load {index}"} ) )
+    tasks = [ receiver,
+              asyncio.create_task( every( args.toggle_rate, toggle ) ),
+              asyncio.create_task( every( args.ping_rate, ping ) ) ]
+    stopped = asyncio.create_task( stop.wait() )
+    try:
+        await handshake
+        done, _ = await asyncio.wait( tasks + [stopped], return_when=asyncio.FIRST_COMPLETED )
+        if stopped in done:
+            # Give the acks of the last messages a chance to arrive
+            for task in tasks[1:]:
+                task.cancel()
+            deadline = time.monotonic() + args.timeout
+            while pending and not receiver.done() and time.monotonic() < deadline:
+                await asyncio.sleep( 0.01 )
+        else:
+            results.dropped += 1
+
+    except websockets.exceptions.ConnectionClosed:
+        results.dropped += 1
+
+    finally:
+        for task in tasks + [stopped]:
+            task.cancel()
+        await asyncio.gather( *tasks, stopped, return_exceptions=True )
+        results.unacknowledged += len( pending )
+        results.open -= 1
+        await websocket.close()
+
+
+async def report( results: Results, stats: ProcessStats | None ):
+    start = time.monotonic()
+    acks = 0
+    while True:
+        await asyncio.sleep( 1 )
+        line = f"{time.monotonic() - start:5.0f}s {results.open:6d} open {results.acks - acks:7d} acks/s"
+        acks = results.acks
+        if stats is not None:
+            try:
+                cpu, rss = stats.sample()
+                results.cpu_percent.append( cpu )
+                results.rss = max( results.rss, rss )
+                line += f"  controller cpu {cpu:5.1f}% rss {rss / 2**20:6.1f} MiB"
+            except FileNotFoundError:
+                line += "  controller exited"
+                stats = None
+        print( line, flush=True )
+
+
+async def run( args: argparse.Namespace, pid: int | None ) -> Results:
+    results = Results()
+    stats = None
+    if pid is not None:
+        stats = ProcessStats( pid )
+        stats.sample()
+    reporter = asyncio.create_task( report( results, stats ) )
+
+    stop = asyncio.Event()
+    sensors = []
+    start = time.monotonic()
+    for index in range( 0, args.connections ):
+        sensors.append( asyncio.create_task( sensor( index, args, results, stop ) ) )
+        delay = start + (index + 1) / args.connect_rate - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep( delay )
+
+    await asyncio.sleep( args.duration )
+    stop.set()
+    await asyncio.gather( *sensors )
+    reporter.cancel()
+    return results
+
+
+def milliseconds( values: list[float] ) -> dict:
+    if len( values ) == 0:
+        return {}
+    quantiles = statistics.quantiles( values, n=100, method="inclusive" ) if len( values ) > 1 else values * 99
+    return { "p50": round( quantiles[49] * 1000, 3 ),
+             "p90": round( quantiles[89] * 1000, 3 ),
+             "p99": round( quantiles[98] * 1000, 3 ),
+             "max": round( max( values ) * 1000, 3 ) }
+
+
+def summarize( args: argparse.Namespace, results: Results ) -> dict:
+    summary = { "connections":    args.connections,
+                "connected":      len( results.connect_seconds ),
+                "failed":         results.failed,
+                "dropped":        results.dropped,
+                "sent":           results.sent,
+                "acks":           results.acks,
+                "unacknowledged": results.unacknowledged,
+                "connect_ms":     milliseconds( results.connect_seconds ),
+                "ack_ms":         milliseconds( results.ack_seconds ) }
+    if len( results.cpu_percent ) > 0:
+        summary["controller"] = { "cpu_percent_mean": round( statistics.mean( results.cpu_percent ), 1 ),
+                                  "cpu_percent_max":  round( max( results.cpu_percent ), 1 ),
+                                  "rss_mib_max":      round( results.rss / 2**20, 1 ) }
+    return summary
+
+
+def report_summary( args: argparse.Namespace, results: Results ) -> int:
+    summary = summarize( args, results )
+    print( json.dumps( summary, indent=4 ) )
+    if args.output is not None:
+        with open( args.output, "w", encoding="ascii" ) as f:
+            f.write( json.dumps( summary, indent=4 ) + "\n" )
+    return 1 if results.failed > 0 or results.dropped > 0 else 0
+
+
+def raise_file_limit():
+    # Every connection is a file descriptor, here and in the controller, which inherits the limit
+    _, hard = resource.getrlimit( resource.RLIMIT_NOFILE )
+    resource.setrlimit( resource.RLIMIT_NOFILE, (hard, hard) )
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser( description="Opens many sensor connections to a ledController" )
+    parser.add_argument( "--url", help="The websocket of a running ledController, instead of starting one" )
+    parser.add_argument( "--pid", type=int,
+                         help="The process of the ledController at --url, to sample its cpu and rss" )
+    parser.add_argument( "--config", default="ledController/test/config.yml",
+                         help="The config of the ledController that is started" )
+    parser.add_argument( "--ws-server", choices=["threaded", "asyncio"], default="threaded",
+                         help="The websocket server of the ledController that is started" )
+    parser.add_argument( "--validation", default="strict",
+                         help="The message validation of the ledController that is started" )
+    parser.add_argument( "--alert", default="AlertManagerAlert", help="The alert the sensors toggle" )
+    parser.add_argument( "--connections", type=int, default=1000 )
+    parser.add_argument( "--connect-rate", type=float, default=200, help="New connections per second" )
+    parser.add_argument( "--toggle-rate", type=float, default=0.2,
+                         help="Enables or disables per second, for each connection" )
+    parser.add_argument( "--ping-rate", type=float, default=0.1, help="Pings per second, for each connection" )
+    parser.add_argument( "--duration", type=float, default=30,
+                         help="Seconds to keep going once every connection has been opened" )
+    parser.add_argument( "--timeout", type=float, default=10,
+                         help="Seconds to wait for a connection, or for the last acks" )
+    parser.add_argument( "--output", help="Also write the summary, as json, to this file" )
+    args = parser.parse_args()
+
+    raise_file_limit()
+
+    if args.url is not None:
+        return report_summary( args, asyncio.run( run( args, args.pid ) ) )
+
+    with managed_led_controller( args.config,
+                                 ["--ws-server", args.ws_server, "--validation", args.validation] ) as controller:
+        args.url = f"ws://127.0.0.1:{controller.ws_port}/"
+        # Reported before the controller is stopped, which fails if the controller logged errors
+        return report_summary( args, asyncio.run( run( args, controller.process.process.pid ) ) )
+
+
+if __name__ == "__main__":
+    sys.exit( main() )
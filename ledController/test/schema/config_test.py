@@ -0,0 +1,26 @@
+import os
+from unittest import TestCase
+
+import jsonschema
+import yaml
+
+from .schema_test import get_schema_file
+
+class ConfigSchemaTest(TestCase):
+    def setUp(self) -> None:
+        self.schema = get_schema_file("config.schema.json")
+
+    def test_schema_is_valid(self) -> None:
+        jsonschema.validators.validator_for(self.schema).check_schema(self.schema)
+
+    def test_test_config(self) -> None:
+        with open(os.path.join(os.path.dirname(__file__), '..', 'config.yml'), 'r', encoding='ascii') as f:
+            jsonschema.validate(schema=self.schema, instance=yaml.safe_load(f))
+
+    def test_alert_properties_are_validated(self) -> None:
+        alert = {"name": "build", "channel": 0, "color": "red"}
+        jsonschema.validate(schema=self.schema, instance={"alerts": [alert]})
+
+        for invalid in [{"color": 5}, {"pattern": "strobe"}, {"period": 0}, {"colors": ["red"]}]:
+            with self.assertRaises(jsonschema.exceptions.ValidationError):
+                jsonschema.validate(schema=self.schema, instance={"alerts": [alert | invalid]})
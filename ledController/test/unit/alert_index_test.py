@@ -0,0 +1,136 @@
+import unittest
+
+from alert_index import AlertIndex
+
+def make_alerts( *alerts ):
+    """ (name, channel) pairs -> alert configurations, prioritized by their order """
+    return { name: { "name": name, "channel": channel, "priority": priority }
+             for priority, (name, channel) in enumerate( alerts ) }
+
+class AlertIndexTest( unittest.TestCase ):
+    def test_empty( self ):
+        index = AlertIndex( make_alerts() )
+
+        self.assertEqual( [None] * 8, index.visible_alerts() )
+        self.assertEqual( [{}] * 8,   index.current_alerts() )
+
+
+    def test_enable_reports_only_the_touched_channel( self ):
+        index = AlertIndex( make_alerts( ("a", 0), ("b", 3) ) )
+
+        self.assertEqual( {3}, index.enable( "b", "me" ) )
+        self.assertEqual( {0}, index.enable( "a", "me" ) )
+        self.assertEqual( ["a", None, None, "b", None, None, None, None], index.visible_alerts() )
+
+
+    def test_unchanged_winner_reports_nothing( self ):
+        index = AlertIndex( make_alerts( ("high", 0), ("low", 0) ) )
+
+        self.assertEqual( {0},   index.enable( "high", "me" ) )
+        # A lower priority alert is hidden behind the visible one
+        self.assertEqual( set(), index.enable( "low", "me" ) )
+        # A second source for the same alert doesn't change what's visible
+        self.assertEqual( set(), index.enable( "high", "you" ) )
+        self.assertEqual( set(), index.disable( "high", "you" ) )
+        self.assertEqual( set(), index.disable( "low", "me" ) )
+        self.assertEqual( "high", index.visible_alert( 0 )["name"] )
+
+
+    def test_disable_falls_back_to_lower_priority( self ):
+        index = AlertIndex( make_alerts( ("high", 0), ("low", 0) ) )
+
+        index.enable( "low",  "me" )
+        index.enable( "high", "me" )
+        self.assertEqual( "high", index.visible_alert( 0 )["name"] )
+
+        self.assertEqual( {0}, index.disable( "high", "me" ) )
+        self.assertEqual( "low", index.visible_alert( 0 )["name"] )
+
+        self.assertEqual( {0}, index.disable( "low", "me" ) )
+        self.assertIsNone( index.visible_alert( 0 ) )
+
+
+    def test_reenable_after_lazy_removal( self ):
+        """ An alert that was disabled while hidden is still found when re-enabled """
+        index = AlertIndex( make_alerts( ("high", 0), ("low", 0) ) )
+
+        index.enable( "high", "me" )
+        index.enable( "low",  "me" )
+        index.disable( "low", "me" )
+        index.enable( "low",  "me" )
+
+        self.assertEqual( {0}, index.disable( "high", "me" ) )
+        self.assertEqual( "low", index.visible_alert( 0 )["name"] )
+
+
+    def test_unregister( self ):
+        index = AlertIndex( make_alerts( ("a", 0), ("b", 1), ("c", 2) ) )
+
+        index.enable( "a", "me" )
+        index.enable( "b", "me" )
+        index.enable( "b", "you" )
+        index.enable( "c", "you" )
+
+        self.assertEqual( {0}, index.unregister( "me" ) )
+        self.assertEqual( [{}, {"b": {"you"}}, {"c": {"you"}}, {}, {}, {}, {}, {}],
+                          index.current_alerts() )
+        self.assertFalse( index.is_enabled( "a" ) )
+        self.assertTrue(  index.is_enabled( "b" ) )
+
+
+    def test_snapshot( self ):
+        index = AlertIndex( make_alerts( ("a", 0), ("b", 1) ) )
+        empty = index.snapshot()
+
+        index.enable( "a", "me" )
+        first = index.snapshot()
+        self.assertEqual( empty.version + 1, first.version )
+        self.assertIs( first, index.snapshot() )
+        self.assertEqual( ("a",) + (None,) * 7, first.visible )
+        self.assertEqual( [{"a": {"me"}}] + [{}] * 7, list( first.current ) )
+
+        # Snapshots are not affected by later changes, and unchanged channels are shared
+        index.enable( "b", "me" )
+        second = index.snapshot()
+        self.assertEqual( ("a",) + (None,) * 7, first.visible )
+        self.assertEqual( {}, first.current[1] )
+        self.assertIs( first.current[0], second.current[0] )
+
+        # Re-enabling an alert for the same source isn't a change
+        index.enable( "b", "me" )
+        self.assertIs( second, index.snapshot() )
+
+
+    def test_alerts_of( self ):
+        index = AlertIndex( make_alerts( ("a", 0), ("b", 1) ) )
+
+        index.enable( "a", "me" )
+        index.enable( "b", "me" )
+        index.enable( "b", "you" )
+        self.assertEqual( {"a", "b"}, set( index.alerts_of( "me" ) ) )
+        self.assertEqual( ["b"],      index.alerts_of( "you" ) )
+
+        index.disable( "a", "me" )
+        self.assertEqual( ["b"], index.alerts_of( "me" ) )
+
+        index.unregister( "me" )
+        self.assertEqual( [], index.alerts_of( "me" ) )
+        self.assertEqual( ["b"], index.alerts_of( "you" ) )
+
+        # Unregistering a source that never enabled anything is harmless
+        self.assertEqual( set(), index.unregister( "nobody" ) )
+
+
+    def test_snapshot_diff( self ):
+        index = AlertIndex( make_alerts( ("a", 0), ("b", 1) ) )
+        index.enable( "b", "me" )
+        before = index.snapshot()
+
+        index.enable( "a", "me" )
+        index.enable( "b", "you" )
+        after = index.snapshot()
+
+        self.assertEqual( { "visible": {"0": "a"},
+                            "current": {"0": {"a": ["me"]}, "1": {"b": ["me", "you"]}} },
+                          after.diff( before ) )
+        self.assertEqual( {"visible": {}, "current": {}}, after.diff( after ) )
@@ -0,0 +1,122 @@
+import threading
+import time
+import unittest
+
+from prometheus_client import REGISTRY
+
+from animation import Animator, Animation, blink, pulse, fade, morph
+from blinkstick_output import Shade
+
+COLORS = ["red", "black"]
+
+class FakePool:
+    """ Records the frames written, and reports `skipped` devices as busy """
+
+    def __init__( self, skipped=0 ):
+        self.frames = []
+        self.skipped = skipped
+        self.written = threading.Condition()
+
+    def write_frame( self, colors ):
+        with self.written:
+            self.frames.append( colors )
+            self.written.notify_all()
+        return self.skipped
+
+    def wait_for_frames( self, count ):
+        with self.written:
+            return self.written.wait_for( lambda: len( self.frames ) >= count, timeout=5 )
+
+def get_dropped( reason ):
+    return REGISTRY.get_sample_value( "blinkstick_frames_dropped_total", {"reason": reason} )
+
+class PatternTest( unittest.TestCase ):
+    def test_blink( self ):
+        self.assertEqual( Shade( "red", "black", 0 ), blink( COLORS, 0.25 ) )
+        self.assertEqual( Shade( "red", "black", 1 ), blink( COLORS, 0.75 ) )
+
+
+    def test_pulse( self ):
+        self.assertAlmostEqual( 0,   pulse( COLORS, 0 ).mix )
+        self.assertAlmostEqual( 0.5, pulse( COLORS, 0.25 ).mix )
+        self.assertAlmostEqual( 1,   pulse( COLORS, 0.5 ).mix )
+
+
+    def test_fade( self ):
+        self.assertAlmostEqual( 0,   fade( COLORS, 0 ).mix )
+        self.assertAlmostEqual( 0.5, fade( COLORS, 0.25 ).mix )
+        self.assertAlmostEqual( 1,   fade( COLORS, 0.5 ).mix )
+        self.assertAlmostEqual( 0.5, fade( COLORS, 0.75 ).mix )
+
+
+    def test_morph( self ):
+        colors = ["red", "green", "blue"]
+        self.assertEqual( Shade( "red", "green", 0 ),  morph( colors, 0 ) )
+        self.assertEqual( Shade( "green", "blue", 0 ), morph( colors, 1 / 3 ) )
+        shade = morph( colors, 5 / 6 )
+        self.assertEqual( ("blue", "red"), (shade.start, shade.end) )
+        self.assertAlmostEqual( 0.5, shade.mix )
+
+
+    def test_animation_period( self ):
+        animation = Animation( {"color": "red", "pattern": "blink", "period": 2}, start=10 )
+        self.assertEqual( 0, animation.render( 10.5 ).mix )
+        self.assertEqual( 1, animation.render( 11.5 ).mix )
+        # The next cycle
+        self.assertEqual( 0, animation.render( 12.5 ).mix )
+
+
+class AnimatorTest( unittest.TestCase ):
+    def test_frames_stop_with_the_animation( self ):
+        pool = FakePool()
+        animator = Animator( pool, frame_rate=200 )
+        animator.start()
+        try:
+            animator.animate( 3, {"color": "red", "pattern": "pulse"} )
+            self.assertTrue( pool.wait_for_frames( 5 ) )
+            self.assertEqual( {3}, set( pool.frames[-1].keys() ) )
+
+            # Once stop() returns, no more frames are written
+            animator.stop( 3 )
+            count = len( pool.frames )
+            time.sleep( 0.05 )
+            self.assertEqual( count, len( pool.frames ) )
+
+        finally:
+            animator.terminate()
+            animator.join()
+
+
+    def test_busy_devices_drop_frames( self ):
+        pool = FakePool( skipped=1 )
+        animator = Animator( pool, frame_rate=200 )
+        dropped = get_dropped( "busy" )
+        animator.start()
+        try:
+            animator.animate( 0, {"color": "red", "pattern": "blink"} )
+            self.assertTrue( pool.wait_for_frames( 3 ) )
+        finally:
+            animator.terminate()
+            animator.join()
+        self.assertGreaterEqual( get_dropped( "busy" ) - dropped, 3 )
+
+
+    def test_late_frames_are_dropped( self ):
+        class SlowPool( FakePool ):
+            def write_frame( self, colors ):
+                # Takes five frames
+                time.sleep( 0.05 )
+                return super().write_frame( colors )
+
+        pool = SlowPool()
+        animator = Animator( pool, frame_rate=100 )
+        dropped = get_dropped( "late" )
+        animator.start()
+        try:
+            animator.animate( 0, {"color": "red", "pattern": "blink"} )
+            self.assertTrue( pool.wait_for_frames( 3 ) )
+        finally:
+            animator.terminate()
+            animator.join()
+        # The missed frames are skipped, not written late
+        self.assertGreaterEqual( get_dropped( "late" ) - dropped, 3 )
@@ -0,0 +1,93 @@
+import json
+import threading
+import time
+import unittest
+
+import websocket
+
+from async_websocket_server import AsyncWebSocketServer
+from blinkstickThread import BlinkstickThread
+from client_session import ClientSession
+from process_context import find_free_port
+
+ALERT = "Foo"
+
+class AsyncWebSocketServerTest( unittest.TestCase ):
+    def setUp( self ):
+        self.blinkstick_thread = BlinkstickThread(
+            config={"alerts": [{"name": ALERT, "channel": 0, "color": "blue"}]},
+            daemon=True )
+        self.blinkstick_thread.start()
+
+        self.clients = {}
+        clients_lock = threading.Lock()
+        def session_factory( address, send ):
+            return ClientSession( None, None, self.blinkstick_thread, address, clients_lock, self.clients, send )
+
+        self.port = find_free_port()
+        self.server = AsyncWebSocketServer( "127.0.0.1", self.port, session_factory )
+        self.server_thread = threading.Thread( target=self.server.serve_forever, daemon=True )
+        self.server_thread.start()
+
+
+    def tearDown( self ):
+        self.server.stop()
+        self.server_thread.join( timeout=5 )
+        self.blinkstick_thread.terminate()
+        self.blinkstick_thread.join()
+
+
+    def connect( self ) -> websocket.WebSocket:
+        # The server thread may not be listening yet
+        deadline = time.monotonic() + 5
+        while True:
+            try:
+                return websocket.create_connection( f"ws://127.0.0.1:{self.port}/", timeout=5 )
+            except ConnectionRefusedError:
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep( 0.05 )
+
+
+    def test_ping( self ):
+        ws = self.connect()
+        try:
+            ws.send( json.dumps( {"ping": True} ) )
+            self.assertEqual( {"pong": True}, json.loads( ws.recv() ) )
+        finally:
+            ws.close()
+
+
+    def test_enable_and_disconnect( self ):
+        ws = self.connect()
+        ws.send( json.dumps( {"name": "Test"} ) )
+        self.assertEqual( {"success": True}, json.loads( ws.recv() ) )
+        ws.send( json.dumps( {"enable": ALERT} ) )
+        self.assertEqual( {"success": True}, json.loads( ws.recv() ) )
+
+        self.blinkstick_thread.flush()
+        self.assertEqual( [ALERT] + [None] * 7, self.blinkstick_thread.get_visible_alerts() )
+        self.assertEqual( ["Test"], [ client.name for client in self.clients.values() ] )
+
+        # Closing the connection removes the client's alerts
+        ws.close()
+        deadline = time.monotonic() + 5
+        while len( self.clients ) > 0 and time.monotonic() < deadline:
+            time.sleep( 0.05 )
+        self.blinkstick_thread.flush()
+        self.assertEqual( {}, self.clients )
+        self.assertEqual( [None] * 8, self.blinkstick_thread.get_visible_alerts() )
+
+
+    def test_sync_is_acked_once( self ):
+        ws = self.connect()
+        try:
+            ws.send( json.dumps( {"sync": [ALERT]} ) )
+            self.assertEqual( {"success": True}, json.loads( ws.recv() ) )
+            ws.send( json.dumps( {"batch": [{"disable": ALERT}, {"enable": ALERT}]} ) )
+            self.assertEqual( {"success": True}, json.loads( ws.recv() ) )
+
+            self.blinkstick_thread.flush()
+            self.assertEqual( [ALERT] + [None] * 7, self.blinkstick_thread.get_visible_alerts() )
+        finally:
+            ws.close()
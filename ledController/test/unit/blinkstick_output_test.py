@@ -0,0 +1,125 @@
+import unittest
+
+from prometheus_client import REGISTRY
+
+from blinkstick_output import BlinkstickOutput, Shade
+
+COLORS = { "black": (0, 0, 0),
+           "red":   (255, 0, 0),
+           "blue":  (0, 0, 255) }
+
+class FakeStick:
+    def __init__( self, inverse=False ):
+        self.inverse = inverse
+        self.calls = []
+
+    def get_inverse( self ):
+        return self.inverse
+
+    def _determine_rgb( self, name=None ):
+        return COLORS[name]
+
+    def set_color( self, index=0, red=0, green=0, blue=0 ):
+        self.calls.append( ("set_color", index, (red, green, blue)) )
+
+    def set_led_data( self, channel, data ):
+        self.calls.append( ("set_led_data", channel, data) )
+
+def get_counter( name ):
+    return REGISTRY.get_sample_value( name + "_total" )
+
+class BlinkstickOutputTest( unittest.TestCase ):
+    def test_single_channel_uses_set_color( self ):
+        stick = FakeStick()
+        output = BlinkstickOutput( stick )
+
+        output.set_color( 3, "red" )
+        output.commit()
+
+        self.assertEqual( [("set_color", 3, (255, 0, 0))], stick.calls )
+
+
+    def test_unchanged_channel_is_skipped( self ):
+        stick = FakeStick()
+        output = BlinkstickOutput( stick )
+
+        output.set_color( 3, "red" )
+        output.commit()
+
+        issued = get_counter( "blinkstick_writes_issued" )
+        skipped = get_counter( "blinkstick_writes_skipped" )
+        output.set_color( 3, "red" )
+        output.commit()
+
+        self.assertEqual( 1, len( stick.calls ) )
+        self.assertEqual( issued,      get_counter( "blinkstick_writes_issued" ) )
+        self.assertEqual( skipped + 1, get_counter( "blinkstick_writes_skipped" ) )
+
+
+    def test_several_channels_are_one_frame( self ):
+        stick = FakeStick()
+        output = BlinkstickOutput( stick )
+        for channel in range( 0, 8 ):
+            output.set_color( channel, "black" )
+        output.commit()
+
+        issued = get_counter( "blinkstick_writes_issued" )
+        output.set_color( 0, "red" )
+        output.set_color( 7, "blue" )
+        output.commit()
+
+        self.assertEqual( ("set_led_data", 0, [0, 255, 0] + [0, 0, 0] * 6 + [0, 0, 255]),
+                          stick.calls[-1] )
+        self.assertEqual( issued + 1, get_counter( "blinkstick_writes_issued" ) )
+
+
+    def test_frame_is_inverted( self ):
+        stick = FakeStick( inverse=True )
+        output = BlinkstickOutput( stick, channels=2 )
+
+        output.set_color( 0, "red" )
+        output.set_color( 1, "black" )
+        output.commit()
+
+        self.assertEqual( [("set_led_data", 0, [255, 0, 255, 255, 255, 255])], stick.calls )
+
+
+    def test_last_staged_color_wins( self ):
+        stick = FakeStick()
+        output = BlinkstickOutput( stick )
+
+        output.set_color( 2, "red" )
+        output.set_color( 2, "blue" )
+        output.commit()
+
+        self.assertEqual( [("set_color", 2, (0, 0, 255))], stick.calls )
+
+
+    def test_shade_is_mixed( self ):
+        stick = FakeStick()
+        output = BlinkstickOutput( stick )
+
+        output.set_color( 1, Shade( "red", "blue", 0.25 ) )
+        output.commit()
+        # The same color, from a different mix, isn't written again
+        output.set_color( 1, Shade( "blue", "red", 0.75 ) )
+        output.commit()
+
+        self.assertEqual( [("set_color", 1, (191, 0, 64))], stick.calls )
+
+
+    def test_usb_write_time_is_recorded( self ):
+        stick = FakeStick()
+        output = BlinkstickOutput( stick, device="BS1" )
+        def get_count( operation ):
+            return REGISTRY.get_sample_value( "blinkstick_usb_write_seconds_count",
+                                              {"device": "BS1", "operation": operation} )
+
+        output.set_color( 0, "red" )
+        output.commit()
+        output.set_color( 0, "blue" )
+        output.set_color( 1, "red" )
+        output.commit()
+
+        self.assertEqual( 1, get_count( "set_color" ) )
+        self.assertEqual( 1, get_count( "set_led_data" ) )
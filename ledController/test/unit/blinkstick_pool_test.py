@@ -0,0 +1,133 @@
+import threading
+import unittest
+
+from prometheus_client import REGISTRY
+
+from blinkstick_pool import BlinkstickPool, default_channel_map, parse_channel_map
+
+COLORS = { "black": (0, 0, 0),
+           "red":   (255, 0, 0),
+           "blue":  (0, 0, 255) }
+
+class FakeStick:
+    def __init__( self, serial, blocked=None, fail=False ):
+        self.serial = serial
+        self.calls = []
+        # Writes wait for this event, to simulate a wedged device
+        self.blocked = blocked
+        self.fail = fail
+        self.writing = threading.Event()
+
+    def get_serial( self ):
+        return self.serial
+
+    def get_inverse( self ):
+        return False
+
+    def _determine_rgb( self, name=None ):
+        return COLORS[name]
+
+    def set_color( self, index=0, red=0, green=0, blue=0 ):
+        self._write()
+        self.calls.append( (index, (red, green, blue)) )
+
+    def set_led_data( self, channel, data ):
+        self._write()
+        self.calls.append( ("set_led_data", data) )
+
+    def _write( self ):
+        self.writing.set()
+        if self.blocked is not None:
+            self.blocked.wait()
+        if self.fail:
+            raise IOError( "device went away" )
+
+def get_counter( name, device ):
+    return REGISTRY.get_sample_value( name + "_total", {"device": device} )
+
+class BlinkstickPoolTest( unittest.TestCase ):
+    def setUp( self ):
+        self.pool = None
+
+
+    def tearDown( self ):
+        if self.pool is not None:
+            self.pool.close()
+
+
+    def test_parse_channel_map( self ):
+        self.assertEqual( default_channel_map(), parse_channel_map( {"alerts": []} ) )
+        self.assertEqual( [(0, i) for i in range( 0, 8 )], default_channel_map() )
+        self.assertEqual( [("BS1", 0), (1, 3)],
+                          parse_channel_map( {"channels": [ {"device": "BS1", "index": 0},
+                                                            {"device": 1,     "index": 3} ]} ) )
+
+
+    def test_parse_channel_map_rejects_unmapped_channels( self ):
+        config = {"channels": [ {"device": 0, "index": 0} ],
+                  "alerts": [ {"name": "build", "channel": 0},
+                              {"name": "meeting", "channel": 5} ]}
+        with self.assertRaisesRegex( ValueError, "meeting" ):
+            parse_channel_map( config )
+        with self.assertRaises( ValueError ):
+            parse_channel_map( {"alerts": [ {"name": "build", "channel": 8} ]} )
+
+
+    def test_channels_are_routed_to_their_device( self ):
+        first, second = FakeStick( "BS1" ), FakeStick( "BS2" )
+        # Devices can be named by serial number or by position
+        self.pool = BlinkstickPool( [("BS1", 0), ("BS2", 0), (1, 5), ("missing", 0)] )
+        self.pool.open( [first, second] )
+        self.assertEqual( ["BS1", "BS2"], self.pool.devices() )
+
+        self.pool.set_color( 0, "red" )
+        self.pool.set_color( 2, "blue" )
+        # Dropped: the device isn't connected
+        self.pool.set_color( 3, "red" )
+        self.pool.commit()
+        self.pool.close()
+
+        self.assertEqual( [(0, (255, 0, 0))], first.calls )
+        self.assertEqual( [(5, (0, 0, 255))], second.calls )
+        self.assertEqual( 1, get_counter( "blinkstick_device_writes", "BS1" ) )
+
+
+    def test_wedged_device_does_not_hold_up_others( self ):
+        blocked = threading.Event()
+        wedged, healthy = FakeStick( "wedged", blocked ), FakeStick( "healthy" )
+        self.pool = BlinkstickPool( [("wedged", 0), ("healthy", 0)] )
+        self.pool.open( [wedged, healthy] )
+
+        self.pool.set_color( 0, "red" )
+        self.pool.set_color( 1, "red" )
+        self.pool.commit()
+        self.assertTrue( wedged.writing.wait( timeout=5 ) )
+        # Returns immediately, even though one device is stuck
+        self.pool.set_color( 0, "blue" )
+        self.pool.set_color( 1, "blue" )
+        self.pool.commit()
+        self.pool.set_color( 0, "black" )
+        self.pool.commit()
+
+        writers = { writer.device: writer for writer in self.pool._writers.values() }
+        self.assertTrue( writers["healthy"].drain( timeout=5 ) )
+        self.assertEqual( (0, (0, 0, 255)), healthy.calls[-1] )
+        self.assertEqual( [], wedged.calls )
+
+        blocked.set()
+        self.assertTrue( writers["wedged"].drain( timeout=5 ) )
+        # The writes queued behind the stuck one collapse into the latest color
+        self.assertEqual( [(0, (255, 0, 0)), (0, (0, 0, 0))], wedged.calls )
+
+
+    def test_errors_are_counted( self ):
+        stick = FakeStick( "broken", fail=True )
+        self.pool = BlinkstickPool( [("broken", 0)] )
+        self.pool.open( [stick] )
+
+        with self.assertLogs( level="ERROR" ):
+            self.pool.set_color( 0, "red" )
+            self.pool.commit()
+            self.pool.close()
+        self.assertEqual( 1, get_counter( "blinkstick_device_errors", "broken" ) )
+        self.assertEqual( 0, get_counter( "blinkstick_device_writes", "broken" ) )
@@ -1,16 +1,62 @@
+import json
+import os
+import tempfile
+import threading
+import time
 import unittest
 import logging
 
+from prometheus_client import REGISTRY
+
 from blinkstickThread import BlinkstickThread, BlinkstickDTO
+from blinkstick_messages import Enable, Unregister
 
 logging.basicConfig( level=logging.DEBUG )
 
+class FakeStick:
+    def __init__( self, serial ):
+        self.serial = serial
+        self.leds = {}
+        self.fail = False
+        self.written = threading.Event()
+
+    def get_serial( self ):
+        return self.serial
+
+    def get_inverse( self ):
+        return False
+
+    def _determine_rgb( self, name=None ):
+        return { "black": (0, 0, 0), "blue": (0, 0, 255), "red": (255, 0, 0) }[name]
+
+    def set_color( self, index=0, red=0, green=0, blue=0 ):
+        if self.fail:
+            raise IOError( "unplugged" )
+        self.leds[index] = (red, green, blue)
+        self.written.set()
+
+    def set_led_data( self, channel, data ):
+        if self.fail:
+            raise IOError( "unplugged" )
+        for index in range( 0, len( data ) // 3 ):
+            green, red, blue = data[index * 3:index * 3 + 3]
+            self.leds[index] = (red, green, blue)
+        self.written.set()
+
+def wait_for( condition, timeout=5 ):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError( "timed out" )
+        time.sleep( 0.01 )
+
 class BlinkstickThreadTest( unittest.TestCase ):
     def test_empty( self ):
         """ Create and terminate the thread """
         thread = BlinkstickThread( config={"alerts": {}}, daemon=True )
         thread.start()
 
+        thread.flush()
         self.assertEqual( [None, None, None, None, None, None, None, None], thread.get_visible_alerts() )
         self.assertEqual( [{},   {},   {},   {},   {},   {},   {},   {}  ], thread.get_current_alerts() )
 
@@ -30,10 +76,12 @@ class BlinkstickThreadTest( unittest.TestCase ):
         blinkstick_api = BlinkstickDTO( thread, str(client_identifier) )
 
         blinkstick_api.enable( alert )
+        thread.flush()
         self.assertEqual( [ { alert: {client_identifier} }, {}, {}, {}, {}, {}, {}, {} ],
                           thread.get_current_alerts() )
 
         blinkstick_api.disable( alert )
+        thread.flush()
         alerts = thread.get_current_alerts()
         self.assertTrue( alert not in alerts or len( alerts[alert]) == 0 )
 
@@ -52,10 +100,12 @@ class BlinkstickThreadTest( unittest.TestCase ):
         blinkstick_api = BlinkstickDTO( thread, client_identifier )
 
         blinkstick_api.enable( alert )
+        thread.flush()
         self.assertEqual( [ { alert: {client_identifier} }, {}, {}, {}, {}, {}, {}, {}],
                           thread.get_current_alerts() )
         blinkstick_api.unregister()
 
+        thread.flush()
         self.assertEqual( [{}, {}, {}, {}, {}, {}, {}, {}], thread.get_current_alerts() )
 
         thread.terminate()
@@ -77,12 +127,14 @@ class BlinkstickThreadTest( unittest.TestCase ):
         blinkstick_api = BlinkstickDTO( thread, client_identifier )
 
         blinkstick_api.enable( alert2 )
+        thread.flush()
         self.assertEqual( [alert2,                                 None, None, None, None, None, None, None],
                           thread.get_visible_alerts() )
         self.assertEqual( [{alert2: set( (client_identifier,) ) }, {},   {},   {},   {},   {},   {},   {}],
                           thread.get_current_alerts() )
 
         blinkstick_api.enable( alert1 )
+        thread.flush()
         self.assertEqual( [{alert1: {client_identifier}, alert2: {client_identifier} },
                            {},
                            {},
@@ -114,6 +166,7 @@ class BlinkstickThreadTest( unittest.TestCase ):
         blinkstick_api.enable( alert1 )
         blinkstick_api.enable( alert2 )
 
+        thread.flush()
         self.assertEqual( [{alert1: {client_identifier}},
                            {alert2: {client_identifier}},
                            {},
@@ -173,3 +226,276 @@ class BlinkstickThreadTest( unittest.TestCase ):
 
         thread.terminate()
         thread.join()
+
+
+    def test_snapshot_is_published( self ):
+        """ Each change publishes a new snapshot; readers keep the snapshot they were given """
+        alert = "Foo"
+        thread = BlinkstickThread( config={"alerts": [{"name": alert, "channel": 0, "color": "blue"}]},
+                                   daemon=True )
+        thread.start()
+
+        blinkstick_api = BlinkstickDTO( thread, "me" )
+
+        before = thread.get_snapshot()
+        blinkstick_api.enable( alert )
+        thread.flush()
+        after = thread.get_snapshot()
+
+        self.assertEqual( before.version + 1, after.version )
+        self.assertEqual( [None] * 8,           list( before.visible ) )
+        self.assertEqual( [alert] + [None] * 7, list( after.visible ) )
+
+        # An unknown alert doesn't change the state
+        blinkstick_api.enable( "Bar" )
+        thread.flush()
+        self.assertIs( after, thread.get_snapshot() )
+
+        thread.terminate()
+        thread.join()
+
+
+    def test_burst_is_one_batch( self ):
+        """ Messages that are already queued are applied together, and painted once """
+        alerts = [ { "name": f"alert{i}", "channel": i % 8, "color": "blue" } for i in range( 0, 30 ) ]
+        thread = BlinkstickThread( config={"alerts": alerts}, daemon=True )
+
+        blinkstick_api = BlinkstickDTO( thread, "me" )
+        for alert in alerts:
+            blinkstick_api.enable( alert["name"] )
+
+        count = REGISTRY.get_sample_value( "blinkstick_batch_size_count" )
+        total = REGISTRY.get_sample_value( "blinkstick_batch_size_sum" )
+
+        thread.start()
+        thread.flush()
+
+        # The 30 enables and the flush
+        self.assertEqual( count + 1,  REGISTRY.get_sample_value( "blinkstick_batch_size_count" ) )
+        self.assertEqual( total + 31, REGISTRY.get_sample_value( "blinkstick_batch_size_sum" ) )
+        self.assertEqual( [f"alert{i}" for i in range( 0, 8 )], thread.get_visible_alerts() )
+
+        thread.terminate()
+        thread.join()
+
+
+    def test_batch_max_size( self ):
+        alert = "Foo"
+        thread = BlinkstickThread( config={"alerts": [{"name": alert, "channel": 0, "color": "blue"}],
+                                           "batch": {"maxSize": 2}},
+                                   daemon=True )
+
+        blinkstick_api = BlinkstickDTO( thread, "me" )
+        for _ in range( 0, 5 ):
+            blinkstick_api.enable( alert )
+            blinkstick_api.disable( alert )
+
+        count = REGISTRY.get_sample_value( "blinkstick_batch_size_count" )
+
+        thread.start()
+        thread.flush()
+
+        # Ten messages and the flush, at most two at a time
+        self.assertEqual( count + 6, REGISTRY.get_sample_value( "blinkstick_batch_size_count" ) )
+        self.assertEqual( [None] * 8, thread.get_visible_alerts() )
+
+        thread.terminate()
+        thread.join()
+
+
+    def test_enqueue_messages( self ):
+        """ Messages can be enqueued without a BlinkstickDTO """
+        alert = "Foo"
+        thread = BlinkstickThread( config={"alerts": [{"name": alert, "channel": 2, "color": "blue"}]},
+                                   daemon=True )
+        thread.start()
+
+        thread.enqueue( Enable( alert, "me" ) )
+        thread.enqueue( Enable( alert, "you" ) )
+        thread.enqueue( Unregister( "me" ) )
+        thread.flush()
+
+        self.assertEqual( [{}, {}, {alert: {"you"}}, {}, {}, {}, {}, {}], thread.get_current_alerts() )
+
+        thread.terminate()
+        thread.join()
+
+
+    def test_hot_plug( self ):
+        """ A blinkstick plugged in after startup is painted with the current state """
+        alert = "Foo"
+        sticks = []
+        thread = BlinkstickThread( config={"alerts": [{"name": alert, "channel": 1, "color": "blue"}],
+                                           "scan": {"minInterval": 0.01, "maxInterval": 0.01}},
+                                   find_sticks=lambda: list( sticks ),
+                                   daemon=True )
+        thread.start()
+        BlinkstickDTO( thread, "me" ).enable( alert )
+        thread.flush()
+        self.assertEqual( 0, REGISTRY.get_sample_value( "hasBlinkstick" ) )
+
+        stick = FakeStick( "BS1" )
+        sticks.append( stick )
+        wait_for( lambda: stick.leds.get( 1 ) == (0, 0, 255) )
+        self.assertEqual( (0, 0, 0), stick.leds[0] )
+        self.assertEqual( 1, REGISTRY.get_sample_value( "hasBlinkstick" ) )
+
+        # A failed write detaches the stick
+        sticks.clear()
+        stick.fail = True
+        BlinkstickDTO( thread, "me" ).disable( alert )
+        wait_for( lambda: REGISTRY.get_sample_value( "hasBlinkstick" ) == 0 )
+
+        # Plugging it back in repaints it
+        stick.fail = False
+        stick.written.clear()
+        sticks.append( stick )
+        wait_for( stick.written.is_set )
+        thread.flush()
+        wait_for( lambda: stick.leds.get( 1 ) == (0, 0, 0) )
+        self.assertEqual( 1, REGISTRY.get_sample_value( "hasBlinkstick" ) )
+
+        # Unplugging an idle stick detaches it too
+        sticks.clear()
+        wait_for( lambda: REGISTRY.get_sample_value( "hasBlinkstick" ) == 0 )
+
+        thread.terminate()
+        thread.join()
+
+
+    def test_pattern_is_animated( self ):
+        alert = "Foo"
+        stick = FakeStick( "BS1" )
+        thread = BlinkstickThread( config={"alerts": [{"name": alert, "channel": 0, "color": "blue",
+                                                       "pattern": "morph", "colors": ["red", "blue"],
+                                                       "period": 0.2}],
+                                           "animation": {"frameRate": 100}},
+                                   find_sticks=lambda: [stick],
+                                   daemon=True )
+        thread.start()
+        BlinkstickDTO( thread, "me" ).enable( alert )
+
+        # Moves through shades between the two colors
+        seen = set()
+        wait_for( lambda: seen.add( stick.leds.get( 0 ) ) or len( seen ) > 5 )
+
+        BlinkstickDTO( thread, "me" ).disable( alert )
+        thread.flush()
+        wait_for( lambda: stick.leds.get( 0 ) == (0, 0, 0) )
+        time.sleep( 0.05 )
+        self.assertEqual( (0, 0, 0), stick.leds[0] )
+
+        thread.terminate()
+        thread.join()
+
+
+    def test_message_metrics( self ):
+        """ Queue depth, queue wait and processing time are exported by message type """
+        alert = "Foo"
+        thread = BlinkstickThread( config={"alerts": [{"name": alert, "channel": 0, "color": "blue"}]},
+                                   daemon=True )
+        def get( name, message_type ):
+            return REGISTRY.get_sample_value( name, {"type": message_type} )
+
+        depth = get( "blinkstick_queue_depth", "enable" )
+        waits = get( "blinkstick_queue_wait_seconds_count", "enable" )
+        processed = get( "blinkstick_message_seconds_count", "enable" )
+        disables = get( "blinkstick_message_seconds_count", "disable" )
+
+        blinkstick_api = BlinkstickDTO( thread, "me" )
+        for _ in range( 0, 3 ):
+            blinkstick_api.enable( alert )
+        self.assertEqual( depth + 3, get( "blinkstick_queue_depth", "enable" ) )
+
+        thread.start()
+        thread.flush()
+
+        self.assertEqual( depth,         get( "blinkstick_queue_depth", "enable" ) )
+        self.assertEqual( waits + 3,     get( "blinkstick_queue_wait_seconds_count", "enable" ) )
+        self.assertEqual( processed + 3, get( "blinkstick_message_seconds_count", "enable" ) )
+        self.assertEqual( disables,      get( "blinkstick_message_seconds_count", "disable" ) )
+
+        thread.terminate()
+        thread.join()
+
+
+    def test_journal_restore( self ):
+        """ Journaled alerts are shown at startup, until their client reconnects or expires """
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join( directory, "journal.jsonl" )
+            with open( path, "w", encoding="utf-8" ) as f:
+                f.write( json.dumps( {"name": "Calendar", "alerts": ["Meeting"]} ) + "\n" )
+                f.write( json.dumps( {"name": "Webhook", "alerts": ["Build"]} ) + "\n" )
+
+            thread = BlinkstickThread( config={"alerts": [{"name": "Meeting", "channel": 0, "color": "blue"},
+                                                          {"name": "Build",   "channel": 1, "color": "blue"}],
+                                               "journal": {"path": path, "gracePeriod": 0.2}},
+                                       daemon=True )
+            thread.start()
+            thread.flush()
+            self.assertEqual( ["Meeting", "Build"] + [None] * 6, thread.get_visible_alerts() )
+
+            # The calendar client reconnects, and replays its state
+            calendar = BlinkstickDTO( thread, "calendar-connection" )
+            calendar.identify( "Calendar" )
+            calendar.enable( "Meeting" )
+            thread.flush()
+            self.assertEqual( {"Meeting": {"calendar-connection"}}, thread.get_current_alerts()[0] )
+
+            # The webhook client never comes back
+            wait_for( lambda: thread.get_visible_alerts()[1] is None )
+            self.assertEqual( "Meeting", thread.get_visible_alerts()[0] )
+
+            thread.terminate()
+            thread.join()
+
+            with open( path, "r", encoding="utf-8" ) as f:
+                records = [ json.loads( line ) for line in f ]
+            self.assertEqual( {"name": "Calendar", "alerts": ["Meeting"]},
+                              [ record for record in records if record["name"] == "Calendar" ][-1] )
+            self.assertEqual( {"name": "Webhook", "alerts": []}, records[-1] )
+
+
+    def test_batch_and_sync( self ):
+        """ Batches and syncs are applied as one message, and repainted once """
+        thread = BlinkstickThread( config={"alerts": [{"name": "a", "channel": 0, "color": "blue"},
+                                                      {"name": "b", "channel": 1, "color": "blue"},
+                                                      {"name": "c", "channel": 2, "color": "blue"}]},
+                                   daemon=True )
+        thread.start()
+        blinkstick_api = BlinkstickDTO( thread, "me" )
+
+        blinkstick_api.batch( [{"enable": "a"}, {"enable": "b"}, {"disable": "a"}] )
+        thread.flush()
+        self.assertEqual( [None, "b", None] + [None] * 5, thread.get_visible_alerts() )
+
+        blinkstick_api.sync( ["a", "c"] )
+        thread.flush()
+        self.assertEqual( ["a", None, "c"] + [None] * 5, thread.get_visible_alerts() )
+
+        blinkstick_api.sync( [] )
+        thread.flush()
+        self.assertEqual( [None] * 8, thread.get_visible_alerts() )
+
+        thread.terminate()
+        thread.join()
+
+
+    def test_damped_alert_is_cleared_by_its_timer( self ):
+        thread = BlinkstickThread( config={"alerts": [{"name": "a", "channel": 0, "color": "blue",
+                                                       "damping": {"minOnTime": 0.2}}]},
+                                   daemon=True )
+        thread.start()
+        blinkstick_api = BlinkstickDTO( thread, "me" )
+
+        blinkstick_api.enable( "a" )
+        blinkstick_api.disable( "a" )
+        thread.flush()
+        # Held on for its minimum on time
+        self.assertEqual( "a", thread.get_visible_alerts()[0] )
+        self.assertEqual( {}, thread.get_snapshot().current[0] )
+
+        wait_for( lambda: thread.get_visible_alerts()[0] is None )
+
+        thread.terminate()
+        thread.join()
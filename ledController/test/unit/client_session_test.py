@@ -0,0 +1,80 @@
+import json
+import threading
+import unittest
+from unittest.mock import Mock
+
+from prometheus_client import REGISTRY
+
+from blinkstick_messages import Enable
+from client_session import ClientSession, ClientTypeCounter, msgpack
+
+def get_clients( client_type ):
+    return REGISTRY.get_sample_value( "clients", {"type": client_type} )
+
+class ClientTypeCounterTest( unittest.TestCase ):
+    def test_rename( self ):
+        counter = ClientTypeCounter()
+
+        counter.add( None )
+        counter.add( None )
+        counter.rename( None, "Test Rename" )
+        self.assertEqual( 1, get_clients( "Test Rename" ) )
+
+        counter.rename( None, "Test Rename" )
+        self.assertEqual( 2, get_clients( "Test Rename" ) )
+
+        counter.remove( "Test Rename" )
+        self.assertEqual( 1, get_clients( "Test Rename" ) )
+
+
+    def test_unknown_type_is_retired( self ):
+        """ When the last client of a type leaves, the type is removed from the metric """
+        counter = ClientTypeCounter()
+
+        counter.add( "Test Retired" )
+        self.assertEqual( 1, get_clients( "Test Retired" ) )
+
+        counter.remove( "Test Retired" )
+        self.assertIsNone( get_clients( "Test Retired" ) )
+
+
+    def test_well_known_type_is_kept( self ):
+        counter = ClientTypeCounter()
+
+        counter.add( "ManualSet" )
+        counter.remove( "ManualSet" )
+        self.assertEqual( 0, get_clients( "ManualSet" ) )
+
+
+@unittest.skipIf( msgpack is None, "msgpack isn't installed" )
+class EncodingNegotiationTest( unittest.TestCase ):
+    def setUp( self ):
+        self.blinkstick_thread = Mock()
+        self.sent = []
+        self.session = ClientSession( None, None, self.blinkstick_thread, "address", threading.Lock(), {},
+                                      self.sent.append )
+        self.session.connected()
+
+
+    def test_msgpack( self ):
+        self.session.handle( json.dumps( {"name": "Test", "encodings": ["cbor", "msgpack"]} ) )
+        # The reply to the handshake is still json
+        self.assertEqual( {"success": True, "encoding": "msgpack"}, json.loads( self.sent[-1] ) )
+
+        self.session.handle( msgpack.packb( {"enable": "Foo"} ) )
+        self.blinkstick_thread.enqueue.assert_called_with( Enable( "Foo", "address" ) )
+        self.assertEqual( {"success": True}, msgpack.unpackb( self.sent[-1] ) )
+
+        # Text frames are still json
+        self.session.handle( json.dumps( {"ping": True} ) )
+        self.assertEqual( {"pong": True}, msgpack.unpackb( self.sent[-1] ) )
+
+
+    def test_no_common_encoding( self ):
+        self.session.handle( json.dumps( {"name": "Test", "encodings": ["cbor"]} ) )
+        self.assertEqual( {"success": True}, json.loads( self.sent[-1] ) )
+
+        # Binary frames are ignored until an encoding is agreed on
+        count = self.blinkstick_thread.enqueue.call_count
+        self.session.handle( msgpack.packb( {"enable": "Foo"} ) )
+        self.assertEqual( count, self.blinkstick_thread.enqueue.call_count )
@@ -0,0 +1,89 @@
+import unittest
+
+from device_scanner import DeviceScanner
+
+class FakeStick:
+    def __init__( self, serial ):
+        self.serial = serial
+
+    def get_serial( self ):
+        return self.serial
+
+
+class DeviceScannerTest( unittest.TestCase ):
+    def setUp( self ):
+        self.present = []
+        self.attached = set()
+        self.attaches = []
+        self.detaches = []
+        def attach( stick, serial, position ):
+            self.attaches.append( (serial, position) )
+            self.attached.add( serial )
+        def detach( serial ):
+            self.detaches.append( serial )
+            self.attached.discard( serial )
+        self.scanner = DeviceScanner( lambda: set( self.attached ), attach, detach, lambda: list( self.present ) )
+
+
+    def test_attaches_new_sticks_only( self ):
+        self.present = [FakeStick( "BS1" )]
+        self.assertTrue( self.scanner.scan() )
+        self.assertEqual( [("BS1", 0)], self.attaches )
+
+        self.present = [FakeStick( "BS1" ), FakeStick( "BS2" )]
+        self.assertTrue( self.scanner.scan() )
+        self.assertEqual( [("BS1", 0), ("BS2", 1)], self.attaches )
+
+        # Nothing changed on the bus
+        self.assertFalse( self.scanner.scan() )
+        self.assertEqual( 2, len( self.attaches ) )
+
+
+    def test_reattaches_detached_sticks( self ):
+        self.present = [FakeStick( "BS1" )]
+        self.scanner.scan()
+        self.attached.clear()
+
+        # Still present, but no longer attached (e.g. after a failed write)
+        self.assertFalse( self.scanner.scan() )
+        self.assertEqual( [("BS1", 0), ("BS1", 0)], self.attaches )
+
+
+    def test_detaches_sticks_that_are_gone( self ):
+        self.present = [FakeStick( "BS1" ), FakeStick( "BS2" )]
+        self.scanner.scan()
+
+        # Unplugged
+        self.present = [FakeStick( "BS2" )]
+        self.assertTrue( self.scanner.scan() )
+        self.assertEqual( ["BS1"], self.detaches )
+        self.assertEqual( {"BS2"}, self.attached )
+
+        self.assertFalse( self.scanner.scan() )
+        self.assertEqual( ["BS1"], self.detaches )
+
+
+    def test_failed_scan_detaches_nothing( self ):
+        self.present = [FakeStick( "BS1" )]
+        self.scanner.scan()
+        def fail():
+            raise ModuleNotFoundError( "usb" )
+        self.scanner._find = fail # pylint: disable=protected-access
+
+        with self.assertLogs( level="ERROR" ):
+            self.scanner.scan()
+        self.assertEqual( [], self.detaches )
+
+
+    def test_scan_failure( self ):
+        def fail():
+            raise ModuleNotFoundError( "usb" )
+        scanner = DeviceScanner( set, lambda *args: None, lambda serial: None, fail )
+
+        with self.assertLogs( level="ERROR" ) as logs:
+            self.assertTrue( scanner.scan() )
+        self.assertRegex( logs.output[0], "no blinksticks found!" )
+
+        # Only logged when the blinksticks go away, not on every scan
+        with self.assertNoLogs( level="ERROR" ):
+            self.assertFalse( scanner.scan() )
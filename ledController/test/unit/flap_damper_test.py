@@ -0,0 +1,122 @@
+import unittest
+
+from prometheus_client import REGISTRY
+
+from alert_index import AlertIndex
+from flap_damper import DampingPolicy, FlapDamper, parse_damping
+
+class Clock:
+    def __init__( self ):
+        self.now = 1000.0
+
+    def __call__( self ):
+        return self.now
+
+
+def suppressed( name, reason ):
+    return REGISTRY.get_sample_value( 'blinkstick_suppressed_transitions_total',
+                                      {"name": name, "reason": reason} ) or 0
+
+
+class FlapDamperTest( unittest.TestCase ):
+    def setUp( self ):
+        self.clock = Clock()
+        # alert name -> when it should be reevaluated
+        self.scheduled = {}
+
+
+    def make_damper( self, **policies ):
+        return FlapDamper( policies,
+                           lambda alert, when: self.scheduled.__setitem__( alert, when ),
+                           self.clock )
+
+
+    def test_undamped_alerts_follow_their_state( self ):
+        damper = self.make_damper()
+        self.assertTrue( damper.update( "a", True ) )
+        self.assertFalse( damper.update( "a", False ) )
+        self.assertEqual( {}, self.scheduled )
+
+
+    def test_min_on_time( self ):
+        damper = self.make_damper( a=DampingPolicy( min_on_time=5 ) )
+        before = suppressed( "a", "min_on" )
+
+        self.assertTrue( damper.update( "a", True ) )
+        self.clock.now += 1
+        self.assertTrue( damper.update( "a", False ) )
+        self.assertEqual( 1005, self.scheduled["a"] )
+        self.assertEqual( before + 1, suppressed( "a", "min_on" ) )
+
+        # Too early: still shown
+        self.clock.now += 1
+        self.assertTrue( damper.reevaluate( "a" ) )
+        self.clock.now = 1005
+        self.assertFalse( damper.reevaluate( "a" ) )
+
+
+    def test_flap_within_min_on_time_is_never_shown( self ):
+        damper = self.make_damper( a=DampingPolicy( min_on_time=5 ) )
+
+        self.assertTrue( damper.update( "a", True ) )
+        self.assertTrue( damper.update( "a", False ) )
+        self.assertTrue( damper.update( "a", True ) )
+        self.clock.now += 10
+        self.assertTrue( damper.reevaluate( "a" ) )
+
+
+    def test_min_off_time( self ):
+        damper = self.make_damper( a=DampingPolicy( min_off_time=2 ) )
+
+        self.assertTrue( damper.update( "a", True ) )
+        self.assertFalse( damper.update( "a", False ) )
+        self.assertFalse( damper.update( "a", True ) )
+        self.assertEqual( 1002, self.scheduled["a"] )
+        self.clock.now = 1002
+        self.assertTrue( damper.reevaluate( "a" ) )
+
+
+    def test_penalty_freezes_a_flapping_alert( self ):
+        damper = self.make_damper( a=DampingPolicy( suppress_above=3, reuse_below=1, half_life=10 ) )
+        before = suppressed( "a", "penalty" )
+
+        self.assertTrue( damper.update( "a", True ) )
+        self.assertFalse( damper.update( "a", False ) )
+        # The third transition reaches the threshold: the led stays off
+        self.assertFalse( damper.update( "a", True ) )
+        self.assertEqual( before + 1, suppressed( "a", "penalty" ) )
+        # Reevaluated once the penalty of 3 has decayed below 1: log2( 3 ) half lives
+        self.assertAlmostEqual( 1000 + 10 * 1.585, self.scheduled["a"], places=2 )
+
+        self.clock.now += 10
+        self.assertFalse( damper.reevaluate( "a" ) )
+        self.clock.now = self.scheduled["a"]
+        self.assertTrue( damper.reevaluate( "a" ) )
+
+
+    def test_parse_damping( self ):
+        policies = parse_damping( { "alerts": [ { "name": "a", "damping": { "minOnTime": 5 } },
+                                                { "name": "b" } ],
+                                    "damping": { "suppressAbove": 4 } } )
+        self.assertEqual( DampingPolicy( min_on_time=5 ), policies["a"] )
+        self.assertEqual( DampingPolicy( suppress_above=4, reuse_below=2 ), policies["b"] )
+
+        self.assertEqual( {}, parse_damping( { "alerts": [ { "name": "a" } ] } ) )
+
+
+    def test_alert_index_holds_the_visible_alert( self ):
+        damper = self.make_damper( a=DampingPolicy( min_on_time=5 ) )
+        index = AlertIndex( { "a": { "name": "a", "channel": 0, "priority": 0 } }, damper=damper )
+
+        self.assertEqual( {0}, index.enable( "a", "me" ) )
+        version = index.snapshot().version
+        self.assertEqual( set(), index.disable( "a", "me" ) )
+        self.assertEqual( "a", index.visible_alert( 0 )["name"] )
+        # The sources are current, even while the led is held
+        self.assertEqual( {}, index.current_alerts()[0] )
+
+        self.clock.now = self.scheduled["a"]
+        self.assertEqual( {0}, index.reevaluate( "a" ) )
+        self.assertIsNone( index.visible_alert( 0 ) )
+        self.assertEqual( (None,) * 8, index.snapshot().visible )
+        self.assertGreater( index.snapshot().version, version )
@@ -0,0 +1,76 @@
+import json
+import os
+import tempfile
+import unittest
+
+from journal import Journal
+
+class JournalTest( unittest.TestCase ):
+    def setUp( self ):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join( self.directory.name, "journal.jsonl" )
+
+
+    def tearDown( self ):
+        self.directory.cleanup()
+
+
+    def read_records( self ):
+        with open( self.path, "r", encoding="utf-8" ) as f:
+            return [ json.loads( line ) for line in f ]
+
+
+    def test_missing_journal( self ):
+        journal = Journal( self.path )
+        self.assertEqual( {}, journal.load() )
+        journal.close()
+
+
+    def test_records_are_restored( self ):
+        journal = Journal( self.path )
+        journal.load()
+        journal.record( "Calendar Listener", ["Meeting"] )
+        journal.record( "Webhook Listener", ["Build Failed"] )
+        journal.record( "Calendar Listener", ["Meeting", "Reminder"] )
+        journal.record( "Webhook Listener", [] )
+        journal.close()
+
+        journal = Journal( self.path )
+        self.assertEqual( {"Calendar Listener": ["Meeting", "Reminder"]}, journal.load() )
+        journal.close()
+
+
+    def test_unchanged_state_is_not_appended( self ):
+        journal = Journal( self.path )
+        journal.load()
+        journal.record( "Calendar Listener", ["Meeting"] )
+        journal.record( "Calendar Listener", ["Meeting"] )
+        journal.close()
+
+        self.assertEqual( 1, len( self.read_records() ) )
+
+
+    def test_compaction( self ):
+        journal = Journal( self.path, compact_every=3 )
+        journal.load()
+        for i in range( 0, 3 ):
+            journal.record( "Calendar Listener", [f"alert{i}"] )
+        journal.flush()
+
+        # Only the latest record survives
+        self.assertEqual( [{"name": "Calendar Listener", "alerts": ["alert2"]}], self.read_records() )
+
+        journal.record( "Calendar Listener", ["alert3"] )
+        journal.close()
+        self.assertEqual( 2, len( self.read_records() ) )
+
+
+    def test_corrupt_record_is_skipped( self ):
+        with open( self.path, "w", encoding="utf-8" ) as f:
+            f.write( json.dumps( {"name": "Calendar Listener", "alerts": ["Meeting"]} ) + "\n" )
+            f.write( '{"name": "Webhook Lis' )
+
+        journal = Journal( self.path )
+        with self.assertLogs( level="WARNING" ):
+            self.assertEqual( {"Calendar Listener": ["Meeting"]}, journal.load() )
+        journal.close()
@@ -6,6 +6,7 @@ from unittest import mock
 from unittest.mock import Mock
 
 from ledController.src.ledController import WebSocketHandler
+from message_validator import MessageValidator
 
 def get_schema_file(file) -> object:
     return get_json_file(os.path.join(os.path.dirname(__file__), '..', '..', 'src', file))
@@ -23,8 +24,8 @@ class LedControllerTest(unittest.TestCase):
         clients = {}
 
         with mock.patch('socket.socket') as mock_socket:
-            handler = WebSocketHandler(get_schema_file("receive.schema.json"),
-                                       get_schema_file("send.schema.json"),
+            handler = WebSocketHandler(MessageValidator(get_schema_file("receive.schema.json"), "receive"),
+                                       MessageValidator(get_schema_file("send.schema.json"), "send"),
                                        mock_blinkstick_thread,
                                        address,
                                        lock,
@@ -0,0 +1,62 @@
+import unittest
+
+from prometheus_client import REGISTRY
+
+from message_validator import MessageValidator, parse_validation_mode
+
+SCHEMA = { "type": "object",
+           "properties": { "ping": { "type": "boolean" } },
+           "required": ["ping"] }
+
+def get_failures( name ):
+    return REGISTRY.get_sample_value( "message_validation_failures_total", {"schema": name} )
+
+class MessageValidatorTest( unittest.TestCase ):
+    def test_parse_validation_mode( self ):
+        self.assertEqual( 0.0,  parse_validation_mode( "off" ) )
+        self.assertEqual( 1.0,  parse_validation_mode( "strict" ) )
+        self.assertEqual( 0.25, parse_validation_mode( "25%" ) )
+        self.assertRaises( ValueError, parse_validation_mode, "sometimes" )
+        self.assertRaises( ValueError, parse_validation_mode, "150%" )
+
+
+    def test_strict( self ):
+        validator = MessageValidator( SCHEMA, "test_strict" )
+
+        with self.assertNoLogs():
+            validator.validate( {"ping": True} )
+        self.assertEqual( 0, get_failures( "test_strict" ) )
+
+        with self.assertLogs() as logs:
+            validator.validate( {"ping": "yes"} )
+        self.assertRegex( logs.output[0], "ERROR:root:Error validating json: 'yes' is not of type 'boolean'" )
+        self.assertEqual( 1, get_failures( "test_strict" ) )
+
+
+    def test_off( self ):
+        validator = MessageValidator( SCHEMA, "test_off", "off" )
+
+        with self.assertNoLogs():
+            validator.validate( {"ping": "yes"} )
+        self.assertEqual( 0, get_failures( "test_off" ) )
+
+
+    def test_sampled( self ):
+        validator = MessageValidator( SCHEMA, "test_sampled", "50%" )
+
+        with self.assertLogs():
+            for _ in range( 0, 200 ):
+                validator.validate( {"ping": "yes"} )
+        # Each message is validated with a probability of 50%
+        self.assertGreater( get_failures( "test_sampled" ), 0 )
+        self.assertLess(    get_failures( "test_sampled" ), 200 )
+
+
+    def test_invalid_schema( self ):
+        with self.assertLogs() as logs:
+            validator = MessageValidator( {"type": 5}, "test_invalid_schema" )
+        self.assertRegex( logs.output[0], "ERROR:root:Error validating schema: .*" )
+
+        # Nothing to validate against
+        with self.assertNoLogs():
+            validator.validate( {"ping": "yes"} )
@@ -0,0 +1,95 @@
+import json
+import queue
+import threading
+import unittest
+
+from blinkstickThread import BlinkstickThread, BlinkstickDTO
+from client_session import ClientSession, encode, msgpack
+from snapshot_publisher import SnapshotPublisher
+
+ALERT = "Foo"
+
+class FakeSession:
+    """ Records what the publisher sends, decoded """
+
+    def __init__( self ):
+        self.messages = queue.Queue()
+
+    def send_message( self, data ):
+        self.messages.put( data )
+
+    def send_encoded( self, message ):
+        self.messages.put( json.loads( message.payload( None, encode ) ) )
+
+    def next( self ):
+        return self.messages.get( timeout=5 )
+
+
+class SnapshotPublisherTest( unittest.TestCase ):
+    def setUp( self ):
+        self.blinkstick_thread = BlinkstickThread(
+            config={"alerts": [{"name": ALERT, "channel": 0, "color": "blue"}]},
+            daemon=True )
+        self.blinkstick_thread.start()
+        self.publisher = SnapshotPublisher( self.blinkstick_thread )
+        self.publisher.start()
+
+
+    def tearDown( self ):
+        self.publisher.stop()
+        self.publisher.join()
+        self.blinkstick_thread.terminate()
+        self.blinkstick_thread.join()
+
+
+    def test_snapshot_then_diffs( self ):
+        session = FakeSession()
+        self.publisher.subscribe( session )
+
+        snapshot = session.next()
+        self.assertEqual( [None] * 8, snapshot["snapshot"]["visible"] )
+        self.assertEqual( snapshot["snapshot"]["version"], snapshot["sequence"] )
+
+        client = BlinkstickDTO( self.blinkstick_thread, "me" )
+        client.enable( ALERT )
+        diff = session.next()
+        self.assertEqual( snapshot["sequence"], diff["from"] )
+        self.assertGreater( diff["sequence"], diff["from"] )
+        self.assertEqual( { "visible": {"0": ALERT}, "current": {"0": {ALERT: ["me"]}} }, diff["diff"] )
+
+        client.disable( ALERT )
+        second = session.next()
+        self.assertEqual( diff["sequence"], second["from"] )
+        self.assertEqual( { "visible": {"0": None}, "current": {"0": {}} }, second["diff"] )
+
+
+    def test_unsubscribe( self ):
+        session = FakeSession()
+        self.publisher.subscribe( session )
+        session.next()
+        self.publisher.unsubscribe( session )
+
+        BlinkstickDTO( self.blinkstick_thread, "me" ).enable( ALERT )
+        self.blinkstick_thread.flush()
+        self.assertRaises( queue.Empty, session.messages.get, timeout=0.5 )
+
+
+    @unittest.skipIf( msgpack is None, "msgpack isn't installed" )
+    def test_diffs_use_each_subscribers_encoding( self ):
+        sent = { "json": queue.Queue(), "msgpack": queue.Queue() }
+        for encodings in [ [], ["msgpack"] ]:
+            name = "msgpack" if encodings else "json"
+            session = ClientSession( None, None, self.blinkstick_thread, name, threading.Lock(), {},
+                                     sent[name].put, self.publisher )
+            session.connected()
+            session.handle( json.dumps( {"name": "Test", "encodings": encodings} ) )
+            session.handle( json.dumps( {"subscribe": True} ) )
+        decode = { "json": json.loads, "msgpack": msgpack.unpackb }
+        for name, messages in sent.items():
+            messages.get( timeout=5 )
+            self.assertIn( "snapshot", decode[name]( messages.get( timeout=5 ) ) )
+
+        BlinkstickDTO( self.blinkstick_thread, "me" ).enable( ALERT )
+        for name, messages in sent.items():
+            diff = decode[name]( messages.get( timeout=5 ) )
+            self.assertEqual( { "visible": {"0": ALERT}, "current": {"0": {ALERT: ["me"]}} }, diff["diff"] )
@@ -16,8 +16,9 @@ import jsonschema
 import jsonschema.exceptions
 import yaml
 
+from myblinkstick.async_workqueue import AsyncWorkQueue
 from myblinkstick.websocket_client import WebsocketClient
-from myblinkstick.workqueue import WorkQueue, install_workunits_collector
+from myblinkstick.workqueue import WorkQueue, install_workunits_collector, DEFAULT_WORKERS
 
 from prometheus_client.registry import Collector
 from prometheus_client.core import GaugeMetricFamily, REGISTRY
@@ -29,7 +30,7 @@ from prometheus_client import start_http_server, Gauge
 class Application:
     def __init__( self, args ):
         self._args = args
-        self._parsed_args = self.get_arg_parser().parse_args(self._args[1:])
+        self._parsed_args = self.parse_args(self._args[1:])
         self.setup_logging()
 
         config_schema = \
@@ -47,6 +48,9 @@ class Application:
     def start_prometheus( self ):
         start_http_server( int( self._parsed_args.prometheus_port ) )
 
+    def parse_args( self, args: list[str] ) -> argparse.Namespace:
+        return self.get_arg_parser().parse_args(args)
+
     def get_arg_parser( self ) -> argparse.ArgumentParser:
         parser = argparse.ArgumentParser(
             prog="Webhook Listener",
@@ -230,6 +234,14 @@ class Sensor( Application ):
     def _get_httpd_handler(self) -> type[http.server.SimpleHTTPRequestHandler]:
         pass
 
+    @override
+    def parse_args(self, args: list[str]) -> argparse.Namespace:
+        parser = self.get_arg_parser()
+        parsed_args = parser.parse_args(args)
+        if parsed_args.work_queue == 'asyncio' and parsed_args.scheduler is not None:
+            parser.error('--scheduler only applies to --work-queue threaded')
+        return parsed_args
+
     @override
     def get_arg_parser(self) -> argparse.ArgumentParser:
         parser = super().get_arg_parser()
@@ -237,6 +249,24 @@ class Sensor( Application ):
                             help='The url of the led-controller',
                             default='ws://led-controller:9099/', # TODO: use a url object
                             dest='led_controller_url')
+        parser.add_argument('--workers',
+                            help='The number of work units that can run at the same time',
+                            type=int,
+                            default=DEFAULT_WORKERS,
+                            dest='workers')
+        parser.add_argument('--work-queue',
+                            help='How work units are run: on a pool of threads, or as tasks on an '
+                                 'asyncio event loop',
+                            choices=['threaded', 'asyncio'],
+                            default='threaded',
+                            dest='work_queue')
+        parser.add_argument('--scheduler',
+                            help='How the threaded work queue keeps time: a heap on the wall clock '
+                                 '(the default), or a timing wheel on the monotonic clock. The asyncio '
+                                 'work queue keeps time on its event loop, and takes no --scheduler.',
+                            choices=['heap', 'wheel'],
+                            default=None,
+                            dest='scheduler')
         return parser
 
     def get_http_path_prefix( self ):
@@ -251,7 +281,11 @@ class Sensor( Application ):
         return self._ws
 
     def start_work_queue(self):
-        self._workqueue = WorkQueue()
+        if self._parsed_args.work_queue == 'asyncio':
+            self._workqueue = AsyncWorkQueue( workers=self._parsed_args.workers )
+        else:
+            self._workqueue = WorkQueue( workers=self._parsed_args.workers,
+                                         scheduler=self._parsed_args.scheduler or 'heap' )
         install_workunits_collector( self._workqueue )
         self._workqueue.start()
 
@@ -0,0 +1,295 @@
+from abc import abstractmethod
+import asyncio
+import collections
+import datetime
+import inspect
+import itertools
+import logging
+import threading
+import time
+
+from myblinkstick.workqueue import ( Workunit, Recurrence, DEFAULT_WORKERS, reschedule, start_recurring,
+                                     workunitWaitHistogram, workersBusySecondsCounter )
+
+class AsyncWorkunit( Workunit ):
+    """ A work unit whose work is a coroutine """
+
+    # Overrides the blocking work() with a coroutine: AsyncWorkQueue awaits it rather than calling
+    # it, and WorkQueue can't run an AsyncWorkunit
+    @abstractmethod
+    async def work( self ): # pylint: disable=invalid-overridden-method
+        pass
+
+
+# A running work unit that wasn't cancelled or rescheduled: it's scheduled again if it recurs
+_KEEP = object()
+
+class AsyncWorkQueue( threading.Thread ):
+    """
+    A WorkQueue that runs its work units on an asyncio event loop, on this thread.
+
+    Each work unit is scheduled with `call_at`, and runs as a task once it is due, so one thread
+    can keep many slow polls in flight. As with WorkQueue, at most `workers` work units run at once,
+    work units that share a key run one at a time, recurring work units are scheduled again once
+    they finish, and work units with a key can be cancelled or rescheduled by their key. Blocking
+    work units (a plain Workunit) are run on the loop's default executor.
+
+    Each time a work unit is enqueued it gets an id, and its timer is keyed by that id. Cancelling
+    or rescheduling a work unit forgets its id, from any thread; its timer is left to fire, and
+    does nothing.
+
+    `stop` cancels the timers and the running work units, and waits for the work units to finish
+    cancelling before the thread exits.
+    """
+
+    def __init__( self, *args, workers: int = DEFAULT_WORKERS, **kwargs ):
+        super().__init__( *args, daemon=True, **kwargs )
+        self._workers = workers
+        # Guards the state that is shared with other threads, down to _after_run
+        self._lock = threading.Lock()
+        self._loop = None
+        self._interrupted = False
+        # The ids of the work units enqueued before the loop started
+        self._pending = []
+        # id -> the enqueued work unit, until it is due, cancelled or rescheduled
+        self._enqueued = {}
+        self._ids = itertools.count()
+        # key -> the ids of the enqueued work units with that key
+        self._queued = {}
+        # key -> the work units waiting for the running work unit with that key. A key is present
+        # while a work unit with that key is running.
+        self._waiting = {}
+        # key -> what becomes of the running work unit with that key once it finishes: the `dt` it
+        # was rescheduled to, or None if it was cancelled
+        self._after_run = {}
+
+        # The rest is only touched on the loop
+        self._group = None
+        self._stopped = None
+        self._slots = None
+        # id -> the timer that starts the work unit
+        self._timers = {}
+        self._tasks = set()
+        self._busy = 0
+
+
+    def run( self ):
+        asyncio.run( self._main() )
+
+
+    async def _main( self ):
+        self._stopped = asyncio.Event()
+        self._slots = asyncio.Semaphore( self._workers )
+        async with asyncio.TaskGroup() as group:
+            self._group = group
+            with self._lock:
+                if self._interrupted:
+                    return
+                self._loop = asyncio.get_running_loop()
+                pending, self._pending = self._pending, []
+            for workunit_id in pending:
+                self._schedule( workunit_id )
+
+            await self._stopped.wait()
+
+            for timer in self._timers.values():
+                timer.cancel()
+            self._timers.clear()
+            for task in self._tasks:
+                task.cancel()
+            # Leaving the group waits for the cancelled work units
+
+
+    def enqueue( self, workunit ):
+        if workunit.dt is None:
+            return
+
+        with self._lock:
+            self._add( workunit )
+
+
+    def enqueue_recurring( self, workunit, recurrence: Recurrence ):
+        """ Runs `workunit` from its `dt` on, as often as `recurrence` says """
+        start_recurring( workunit, recurrence )
+        self.enqueue( workunit )
+
+
+    def enqueue_or_reschedule( self, workunit ) -> bool:
+        """ As WorkQueue.enqueue_or_reschedule """
+        assert workunit.key is not None
+        if workunit.dt is None:
+            return False
+
+        with self._lock:
+            enqueued = not self._move( workunit.key, workunit.dt )
+            if enqueued:
+                self._add( workunit )
+        return enqueued
+
+
+    def reschedule( self, key, dt: datetime.datetime ) -> bool:
+        """ As WorkQueue.reschedule """
+        with self._lock:
+            return self._move( key, dt )
+
+
+    def cancel( self, key ) -> int:
+        """ As WorkQueue.cancel """
+        with self._lock:
+            ids = self._queued.pop( key, [] )
+            for workunit_id in ids:
+                del self._enqueued[workunit_id]
+            cancelled = len( ids )
+
+            if key in self._waiting:
+                cancelled += 1 + len( self._waiting[key] )
+                self._waiting[key].clear()
+                self._after_run[key] = None
+        return cancelled
+
+
+    def stop( self ):
+        with self._lock:
+            self._interrupted = True
+            loop = self._loop
+        if loop is not None:
+            try:
+                loop.call_soon_threadsafe( self._stopped.set )
+            except RuntimeError:
+                # The loop has already finished
+                pass
+
+
+    def size( self ):
+        return len( self._enqueued )
+
+
+    def workers( self ) -> int:
+        return self._workers
+
+
+    def busy( self ) -> int:
+        return self._busy
+
+
+    def _add( self, workunit ):
+        """ Enqueues a work unit under a new id. Called with the lock held. """
+        workunit_id = next( self._ids )
+        self._enqueued[workunit_id] = workunit
+        if workunit.key is not None:
+            self._queued.setdefault( workunit.key, [] ).append( workunit_id )
+
+        if self._loop is None:
+            self._pending.append( workunit_id )
+            return
+        try:
+            self._loop.call_soon_threadsafe( self._schedule, workunit_id )
+        except RuntimeError:
+            # The queue was stopped, and the loop has finished
+            pass
+
+
+    def _move( self, key, dt: datetime.datetime ) -> bool:
+        """ Moves the next work unit with `key`, enqueued or else running, to `dt`. Called with the lock held. """
+        if key not in self._queued:
+            if key not in self._waiting:
+                return False
+            self._after_run[key] = dt
+            return True
+
+        workunit_id = min( self._queued[key], key=lambda i: self._enqueued[i].dt )
+        workunit = self._forget( workunit_id )
+        workunit.dt = dt
+        self._add( workunit )
+        return True
+
+
+    def _forget( self, workunit_id ):
+        """ Takes a work unit off the queue. Called with the lock held. """
+        workunit = self._enqueued.pop( workunit_id, None )
+        if workunit is not None and workunit.key is not None:
+            ids = self._queued[workunit.key]
+            ids.remove( workunit_id )
+            if len( ids ) == 0:
+                del self._queued[workunit.key]
+        return workunit
+
+
+    def _schedule( self, workunit_id ):
+        with self._lock:
+            workunit = self._enqueued.get( workunit_id )
+        if workunit is None or self._stopped.is_set():
+            return
+        delay = ( workunit.dt - datetime.datetime.now() ).total_seconds()
+        self._timers[workunit_id] = self._loop.call_at( self._loop.time() + delay, self._due, workunit_id )
+
+
+    def _due( self, workunit_id ):
+        del self._timers[workunit_id]
+        with self._lock:
+            workunit = self._forget( workunit_id )
+            # Cancelled or rescheduled
+            if workunit is None:
+                return
+            if workunit.key is not None:
+                if workunit.key in self._waiting:
+                    self._waiting[workunit.key].append( workunit )
+                    return
+                self._waiting[workunit.key] = collections.deque()
+        self._start( workunit )
+
+
+    def _start( self, workunit ):
+        task = self._group.create_task( self._run( workunit ) )
+        self._tasks.add( task )
+        task.add_done_callback( self._tasks.discard )
+
+
+    async def _run( self, workunit ):
+        try:
+            async with self._slots:
+                with self._lock:
+                    # Cancelled while it waited for a slot
+                    if workunit.key in self._after_run and self._after_run[workunit.key] is None:
+                        return
+                workunitWaitHistogram.observe( max( ( datetime.datetime.now() - workunit.dt ).total_seconds(), 0 ) )
+                self._busy += 1
+                start = time.monotonic()
+                try:
+                    if inspect.iscoroutinefunction( workunit.work ):
+                        await workunit.work()
+                    else:
+                        await self._loop.run_in_executor( None, workunit.work )
+                except Exception as e:
+                    logging.exception( e )
+
+                finally:
+                    workersBusySecondsCounter.inc( time.monotonic() - start )
+                    self._busy -= 1
+
+        finally:
+            self._finish( workunit )
+
+
+    def _finish( self, workunit ):
+        """ As WorkQueue._finish """
+        following = None
+        with self._lock:
+            after_run = _KEEP
+            if workunit.key is not None:
+                after_run = self._after_run.pop( workunit.key, _KEEP )
+                waiting = self._waiting[workunit.key]
+                if len( waiting ) > 0 and not self._interrupted:
+                    following = waiting.popleft()
+                else:
+                    del self._waiting[workunit.key]
+
+            if not self._interrupted and after_run is not None:
+                if after_run is not _KEEP:
+                    workunit.dt = after_run
+                    self._add( workunit )
+                elif reschedule( workunit, datetime.datetime.now() ):
+                    self._add( workunit )
+
+        if following is not None:
+            self._start( following )
@@ -27,15 +27,17 @@ class Heap:
 
 
 class HeapBy( Heap ):
-    # Item only uses the key function to sort elements,
-    # just in case the values are not comparable
+    # Item only uses the key to sort elements, just in case the values are not comparable. The key
+    # is computed once, when the value is pushed, rather than on every comparison.
     class Item:
+        __slots__ = ( "key", "value" )
+
         def __init__( self, value, key ):
-            self.key = key
+            self.key = key( value )
             self.value = value
 
         def __lt__( self, other ):
-            return self.key( self.value ) < other.key( other.value )
+            return self.key < other.key
 
     def __init__( self, key, array=None, heapify=True ):
         super().__init__( array, heapify )
@@ -46,3 +48,90 @@ class HeapBy( Heap ):
 
     def pop( self ):
         return super().pop().value
+
+
+class IndexedHeap:
+    """
+    A heap of values ordered by `key`, where each value knows its place in the heap: `push` returns
+    a handle, and the handle's value can be removed, or moved after its key changed, in O(log n).
+    """
+    class Item:
+        __slots__ = ( "key", "value", "index" )
+
+        def __init__( self, value, key ):
+            self.key = key( value )
+            self.value = value
+            # The position in the heap, or None once the value has left it
+            self.index = None
+
+        def __lt__( self, other ):
+            return self.key < other.key
+
+    def __init__( self, key ):
+        self.heap = []
+        self.key = key
+
+    def push( self, x ) -> Item:
+        item = self.Item( x, self.key )
+        self.heap.append( item )
+        self._sift_up( len( self.heap ) - 1 )
+        return item
+
+    def pop( self ):
+        item = self.heap[0]
+        self.remove( item )
+        return item.value
+
+    def size( self ):
+        return len( self.heap )
+
+    def peek( self ):
+        return self.heap[0].value
+
+    def remove( self, item: Item ):
+        i = item.index
+        item.index = None
+        last = self.heap.pop()
+        if last is not item:
+            self.heap[i] = last
+            self._restore( i )
+
+    def update( self, item: Item ):
+        """ Moves the item's value to its place, after its key changed """
+        item.key = self.key( item.value )
+        self._restore( item.index )
+
+    def _restore( self, i ):
+        if i > 0 and self.heap[i] < self.heap[(i - 1) // 2]:
+            self._sift_up( i )
+        else:
+            self._sift_down( i )
+
+    def _sift_up( self, i ):
+        item = self.heap[i]
+        while i > 0:
+            parent = (i - 1) // 2
+            if not item < self.heap[parent]:
+                break
+            self.heap[i] = self.heap[parent]
+            self.heap[i].index = i
+            i = parent
+        self.heap[i] = item
+        item.index = i
+
+    def _sift_down( self, i ):
+        item = self.heap[i]
+        size = len( self.heap )
+        while True:
+            child = 2 * i + 1
+            if child >= size:
+                break
+            if child + 1 < size and self.heap[child + 1] < self.heap[child]:
+                child += 1
+            if not self.heap[child] < item:
+                break
+            self.heap[i] = self.heap[child]
+            self.heap[i].index = i
+            i = child
+        self.heap[i] = item
+        item.index = i
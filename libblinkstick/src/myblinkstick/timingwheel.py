@@ -0,0 +1,158 @@
+import math
+import time
+
+# Defaults: 10ms ticks, and 4 levels of 256 slots, which reach about 16 months ahead
+DEFAULT_TICK = 0.01
+DEFAULT_SLOTS = 256
+DEFAULT_LEVELS = 4
+
+class Timer:
+    """ A value scheduled on a TimingWheel, at `when` on the monotonic clock """
+    __slots__ = ( "when", "value", "_due", "_bucket", "_wheel" )
+
+    def __init__( self, when: float, value, due: int, wheel: "TimingWheel" ):
+        self.when = when
+        self.value = value
+        # The tick at which the timer fires
+        self._due = due
+        self._bucket = None
+        self._wheel = wheel
+
+    def cancel( self ) -> bool:
+        """ Returns False if the timer has already fired, or was already cancelled """
+        if self._bucket is None:
+            return False
+        self._bucket.discard( self )
+        self._bucket = None
+        self._wheel._size -= 1 # pylint: disable=protected-access
+        return True
+
+
+class TimingWheel:
+    """
+    A hierarchical timing wheel: timers on the monotonic clock, with O(1) insert and cancel.
+
+    Time is cut into ticks of `tick` seconds. Level 0 has a slot for each of the next `slots` ticks;
+    each slot of level l covers `slots` slots of level l - 1. A timer is put in the lowest level
+    that reaches its tick, and moves down a level (cascades) when the wheel gets to its slot. A
+    timer fires on the first tick at or after its `when`, so it can be up to one tick late.
+
+    Not thread safe.
+    """
+
+    def __init__( self,
+                  tick: float = DEFAULT_TICK,
+                  slots: int = DEFAULT_SLOTS,
+                  levels: int = DEFAULT_LEVELS,
+                  start: float | None = None ):
+        self._tick = tick
+        self._slots = slots
+        self._levels = levels
+        self._origin = time.monotonic() if start is None else start
+        # The next tick to fire: every timer due before it has fired
+        self._current = 0
+        self._wheels = [ [ set() for _ in range( slots ) ] for _ in range( levels ) ]
+        # The number of ticks each level covers
+        self._spans = [ slots ** (level + 1) for level in range( levels ) ]
+        # Timers that were already due, before the current tick, when they were scheduled
+        self._expired = set()
+        self._size = 0
+
+
+    def __len__( self ) -> int:
+        return self._size
+
+
+    def schedule( self, when: float, value ) -> Timer:
+        due = math.ceil( (when - self._origin) / self._tick )
+        timer = Timer( when, value, max( due, self._current ), self )
+        if due < self._current:
+            self._expired.add( timer )
+            timer._bucket = self._expired # pylint: disable=protected-access
+        else:
+            self._place( timer )
+        self._size += 1
+        return timer
+
+
+    def advance( self, now: float ) -> list:
+        """ Moves the wheel to `now`. Returns the values of the timers that fired, in order. """
+        target = math.floor( (now - self._origin) / self._tick )
+        fired = []
+        self._fire( self._expired, fired )
+        while self._current <= target and self._size > 0:
+            self._cascade()
+            self._fire( self._wheels[0][self._current % self._slots], fired )
+            self._current += 1
+        # Nothing is left to fire: skip the empty ticks
+        self._current = max( self._current, target + 1 )
+
+        fired.sort( key=lambda timer: timer.when )
+        return [ timer.value for timer in fired ]
+
+
+    def next_deadline( self ) -> float | None:
+        """
+        When `advance` next needs to be called: the time of the next timer on level 0, or of the
+        next cascade, whichever is sooner. None if there are no timers.
+        """
+        if self._size == 0:
+            return None
+        if len( self._expired ) > 0:
+            return self._origin + (self._current - 1) * self._tick
+        if self._cascading():
+            # Timers cascade on the current tick, which hasn't been advanced to yet
+            return self._origin + self._current * self._tick
+        boundary = (self._current // self._slots + 1) * self._slots
+        for tick in range( self._current, boundary ):
+            if len( self._wheels[0][tick % self._slots] ) > 0:
+                return self._origin + tick * self._tick
+        return self._origin + boundary * self._tick
+
+
+    def _fire( self, bucket: set, fired: list ):
+        if len( bucket ) == 0:
+            return
+        fired.extend( bucket )
+        for timer in bucket:
+            timer._bucket = None # pylint: disable=protected-access
+        self._size -= len( bucket )
+        bucket.clear()
+
+
+    def _place( self, timer: Timer ):
+        # A timer beyond the top level waits in the top level's furthest slot, and is placed again
+        # when that slot cascades
+        due = min( timer._due, self._current + self._spans[-1] - 1 ) # pylint: disable=protected-access
+        delta = due - self._current
+        level = 0
+        while delta >= self._spans[level]:
+            level += 1
+        bucket = self._wheels[level][(due // self._spans[level - 1] if level > 0 else due) % self._slots]
+        bucket.add( timer )
+        timer._bucket = bucket # pylint: disable=protected-access
+
+
+    def _cascading( self ) -> bool:
+        """ Whether a higher level slot that starts at the current tick holds timers """
+        for level in range( 1, self._levels ):
+            span = self._spans[level - 1]
+            if self._current % span != 0:
+                break
+            if len( self._wheels[level][(self._current // span) % self._slots] ) > 0:
+                return True
+        return False
+
+
+    def _cascade( self ):
+        """ Moves the timers of the higher level slots that start at the current tick down """
+        # From the top down, so that timers can cascade more than one level in one tick
+        for level in range( self._levels - 1, 0, -1 ):
+            span = self._spans[level - 1]
+            if self._current % span != 0:
+                continue
+            bucket = self._wheels[level][(self._current // span) % self._slots]
+            timers = list( bucket )
+            bucket.clear()
+            for timer in timers:
+                self._place( timer )
@@ -8,6 +8,11 @@ import websocket
 
 from prometheus_client import Counter
 
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
 websocketsOpenCounter = Counter(
         'websocketsOpen',
         'The number of times we attempted to establish a websocket connection to the controller' )
@@ -38,8 +43,18 @@ websocketOnClose = Counter(
         'The number of times an on_close was called for the websocket' )
 
 
+# The binary encodings we can offer the controller, in our order of preference
+ENCODINGS = [ "msgpack" ] if msgpack is not None else []
+
 class WebsocketClient( threading.Thread ):
-    def __init__( self, url, *args, name=None, httpPathPrefix=None, **kwargs ):
+    """
+    Keeps the controller up to date with the alerts that are enabled.
+
+    Messages are json until the controller agrees, in its reply to the handshake, to one of the
+    binary `encodings` we offer. The negotiation is redone on every connection.
+    """
+
+    def __init__( self, url, *args, name=None, httpPathPrefix=None, encodings=None, **kwargs ):
         threading.Thread.__init__( self, daemon=True )
         self._websocket_thread = None
 
@@ -49,6 +64,9 @@ class WebsocketClient( threading.Thread ):
         self._has_event = Semaphore( 0 )
         self._name = name
         self._http_path_prefix = httpPathPrefix
+        self._encodings = ENCODINGS if encodings is None else [ e for e in encodings if e in ENCODINGS ]
+        # The encoding of the current connection
+        self._encoding = "json"
 
         self._websocket = None
 
@@ -74,6 +92,12 @@ class WebsocketClient( threading.Thread ):
         if self._websocket is not None:
             self._websocket.close()
 
+    def _send( self, ws, message ):
+        if self._encoding == "msgpack":
+            ws.send( msgpack.packb( message ), websocket.ABNF.OPCODE_BINARY )
+        else:
+            ws.send( json.dumps( message ).encode( "ascii" ) )
+
     def run( self ):
         try:
             logger = logging.getLogger( __class__.__name__ )
@@ -82,16 +106,19 @@ class WebsocketClient( threading.Thread ):
                 open_sem = threading.Semaphore( 0 )
                 def on_open( ws ):
                     try:
+                        # A new connection starts in json
+                        self._encoding = "json"
                         if self._name is not None:
                             m = { "name": self._name }
                             if self._http_path_prefix is not None:
                                 m["link"] = self._http_path_prefix
-                            ws.send( json.dumps( m ).encode( "ascii" ) )
+                            if len( self._encodings ) > 0:
+                                m["encodings"] = self._encodings
+                            self._send( ws, m )
                         with self._state_mutex:
-                            for alert in self._state:
-                                # TODO: use the same sendMessage as below. Logging in the one below
-                                # isn't necessary duplicated here
-                                ws.send( json.dumps( { "enable": alert } ).encode( "ascii" ) )
+                            if len( self._state ) > 0:
+                                # The whole state, in one message
+                                self._send( ws, { "sync": sorted( self._state ) } )
 
                         open_sem.release()
 
@@ -102,6 +129,16 @@ class WebsocketClient( threading.Thread ):
                     # This websocket will only receive responses. We can ignore them for the most part
                     websocketMessageReceived.inc( 1 )
 
+                    # ... except for the reply to the handshake, which can switch the encoding
+                    if self._encoding == "json":
+                        try:
+                            reply = json.loads( message )
+                        except ValueError:
+                            return
+                        if isinstance( reply, dict ) and reply.get( "encoding" ) in self._encodings:
+                            logger.info( "using the %s encoding", reply["encoding"] )
+                            self._encoding = reply["encoding"]
+
                 def on_error( ws, error ):
                     websocketOnError.inc( 1 )
 
@@ -149,15 +186,17 @@ class WebsocketClient( threading.Thread ):
 
                 def send_message( message ):
                     # TODO: validate message against schema
-                    s = json.dumps( message )
                     assert self._websocket is not None
-                    self._websocket.send( s.encode( "ascii" ) )
+                    self._send( self._websocket, message )
 
                 try:
-                    for alert in removed_alerts:
-                        send_message( {"disable": alert} )
-                    for alert in added_alerts:
-                        send_message( {"enable": alert} )
+                    changes = [ {"disable": alert} for alert in removed_alerts ] \
+                            + [ {"enable": alert} for alert in added_alerts ]
+                    if len( changes ) == 1:
+                        send_message( changes[0] )
+                    elif len( changes ) > 1:
+                        # Applied together by the controller, with a single ack
+                        send_message( {"batch": changes} )
 
                     last_state = current_state
 
@@ -1,15 +1,41 @@
 from abc import abstractmethod
+import collections
+from dataclasses import dataclass
 import datetime
 import logging
+import math
+import queue
+import random
 import threading
+import time
 
 from typing import Iterable, override
 
+from prometheus_client import Counter, Histogram
 from prometheus_client.core import REGISTRY, GaugeMetricFamily
 from prometheus_client.metrics_core import Metric
 from prometheus_client.registry import Collector
 
-from myblinkstick.heap import HeapBy
+from myblinkstick.heap import IndexedHeap
+from myblinkstick.timingwheel import TimingWheel
+
+workunitWaitHistogram = Histogram(
+        'workunit_wait_seconds',
+        'Time from when a work unit was due until a worker started it',
+        buckets=[0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60] )
+workersBusySecondsCounter = Counter(
+        'workqueue_busy_seconds',
+        'Time the workers spent running work units. Its rate, divided by workqueue_workers, is the '
+        'utilization of the pool.' )
+
+DEFAULT_WORKERS = 4
+
+# A running work unit that wasn't cancelled or rescheduled: it's enqueued again if it recurs
+_KEEP = object()
+
+# Recurrence policies
+FIXED_DELAY = "fixed_delay"
+FIXED_RATE = "fixed_rate"
 
 def install_workunits_collector( workqueue ):
     class WorkunitsCollector(Collector):
@@ -23,80 +49,268 @@ def install_workunits_collector( workqueue ):
                 GaugeMetricFamily(
                     'workunit_count',
                     'The number of queued work units',
-                    value=self._workqueue.size() ) ]
+                    value=self._workqueue.size() ),
+                GaugeMetricFamily(
+                    'workqueue_workers',
+                    'The number of threads that run work units',
+                    value=self._workqueue.workers() ),
+                GaugeMetricFamily(
+                    'workqueue_busy_workers',
+                    'The number of threads that are running a work unit',
+                    value=self._workqueue.busy() ) ]
 
     REGISTRY.register( WorkunitsCollector( workqueue ) )
     # TODO: add count of successfull and unsuccessful work units executed
 
 
 class Workunit( object ):
-    def __init__( self, dt ):
+    def __init__( self, dt, key=None ):
         self.dt = dt
+        # Work units with the same key (e.g. the same calendar) never run at the same time, and can
+        # be cancelled or rescheduled by their key while they're queued
+        self.key = key
+        # Set by enqueue_recurring
+        self.recurrence = None
+        # When a recurring work unit is due, before jitter
+        self.scheduled = None
 
     @abstractmethod
     def work( self ):
         pass
 
 
+@dataclass( frozen=True )
+class Recurrence:
+    """
+    How often a recurring work unit runs.
+
+    With FIXED_DELAY, each run is due `interval` seconds after the previous run finished. With
+    FIXED_RATE, runs are due every `interval` seconds from the first, however long they take; runs
+    that were missed altogether are skipped rather than run back to back.
+
+    Each run is moved by a random amount of up to `jitter` seconds either way, and the first run is
+    delayed by a random amount of up to `spread` seconds, so that work units enqueued together
+    (e.g. one per repository, at startup) drift apart instead of polling in bursts.
+    """
+    interval: float
+    policy: str = FIXED_DELAY
+    jitter: float = 0
+    spread: float = 0
+
+    def __post_init__( self ):
+        if self.interval <= 0:
+            raise ValueError( f"Invalid interval `{self.interval}`: expected a positive number of seconds" )
+        if self.policy not in ( FIXED_DELAY, FIXED_RATE ):
+            raise ValueError( f"Invalid policy `{self.policy}`: expected {FIXED_DELAY} or {FIXED_RATE}" )
+
+
+# How the sensors poll: every minute. The first polls are spread over 15 seconds, and each poll
+# moves by up to 5 seconds, so that the calendars or repositories of a sensor aren't all polled at
+# once.
+DEFAULT_POLL_RECURRENCE = Recurrence( 60, jitter=5, spread=15 )
+
+
+def start_recurring( workunit: Workunit, recurrence: Recurrence ):
+    """ Makes `workunit` recur, and moves its first run by the startup spread """
+    workunit.recurrence = recurrence
+    workunit.scheduled = workunit.dt + datetime.timedelta( seconds=random.uniform( 0, recurrence.spread ) )
+    workunit.dt = workunit.scheduled
+
+
+def reschedule( workunit: Workunit, finished: datetime.datetime ) -> bool:
+    """ Moves the `dt` of a recurring work unit that finished running to its next run """
+    recurrence = workunit.recurrence
+    if recurrence is None:
+        return False
+
+    interval = datetime.timedelta( seconds=recurrence.interval )
+    if recurrence.policy == FIXED_RATE:
+        scheduled = workunit.scheduled + interval
+        if scheduled < finished:
+            scheduled += interval * math.ceil( ( finished - scheduled ) / interval )
+    else:
+        scheduled = finished + interval
+
+    # The jitter isn't carried over to the next run, so a fixed rate doesn't drift
+    workunit.scheduled = scheduled
+    workunit.dt = scheduled + datetime.timedelta( seconds=random.uniform( -recurrence.jitter, recurrence.jitter ) )
+    return True
+
+
 class WorkQueue( threading.Thread ):
-    def __init__( self, *args, **kwargs ):
-        self._heap = HeapBy( key=lambda x: x.dt )
+    """
+    Runs each work unit once its `dt` has passed.
+
+    This thread only keeps time: it waits for the next work unit to be due, and hands it to a pool
+    of `workers` threads, so that one slow work unit doesn't hold up the others. A work unit whose
+    key is already running waits for it: work units that share a key run one at a time, in the
+    order they became due. A work unit enqueued with `enqueue_recurring` is enqueued again each time
+    it finishes, until the queue stops.
+
+    Queued or running work units with a key can be cancelled or rescheduled by their key, e.g. to
+    poll a calendar now when we're told it changed.
+
+    The `heap` scheduler compares `dt` with the wall clock. The `wheel` scheduler converts `dt` to
+    the monotonic clock when the work unit is enqueued, and keeps it on a timing wheel: a jump of
+    the wall clock doesn't stall or burst the queue, and there's no heap to rebalance.
+    """
+
+    def __init__( self, *args, workers: int = DEFAULT_WORKERS, scheduler: str = "heap", **kwargs ):
+        self._heap = IndexedHeap( key=lambda x: x.dt )
+        self._wheel = TimingWheel() if scheduler == "wheel" else None
+        # key -> the handles (heap items or wheel timers) of the queued work units with that key
+        self._queued = {}
         self._lock = threading.Lock()
         self._interrupted = False
         self._event = threading.Event()
+        # Due work units, for the workers
+        self._ready = queue.Queue()
+        self._workers = workers
+        self._busy = 0
+        # key -> the work units waiting for the running work unit with that key. A key is present
+        # while a work unit with that key is running.
+        self._waiting = {}
+        # key -> what becomes of the running work unit with that key once it finishes: the `dt` it
+        # was rescheduled to, or None if it was cancelled
+        self._after_run = {}
         super().__init__( *args, daemon=True, **kwargs )
 
-    def _wait_for_event( self ):
-        with self._lock:
-            size = self._heap.size()
-        if size == 0:
-            self._event.clear()
-            # Wait for the heap to be non-empty
-            if self._interrupted:
-                return
+    def _wait_for_heap( self ) -> list:
+        while not self._interrupted:
+            with self._lock:
+                wait_time = None
+                if self._heap.size() > 0:
+                    # The work unit could be in the past or future. If it's in the future, we must wait!
+                    wait_time = ( self._heap.peek().dt - datetime.datetime.now() ).total_seconds()
+                    if wait_time <= 0:
+                        workunit = self._heap.pop()
+                        self._unindex( workunit )
+                        return [ workunit ]
+                # Cleared while holding the lock: a work unit enqueued, rescheduled or cancelled
+                # from here on sets it again
+                self._event.clear()
+
+            self._event.wait( timeout=wait_time )
+        return []
+
+
+    def run( self ):
+        workers = [ threading.Thread( target=self._work, daemon=True, name=f"{self.name} worker {i}" )
+                    for i in range( 0, self._workers ) ]
+        for worker in workers:
+            worker.start()
+
+        try:
+            while not self._interrupted:
+                try:
+                    for workunit in self._next_due():
+                        self._dispatch( workunit )
 
-            self._event.wait()
-            self._event.clear()
+                except Exception as e:
+                    logging.exception( e )
 
+        finally:
+            # The workers finish the work units they are running, then stop
+            for _ in workers:
+                self._ready.put( None )
+
+
+    def _next_due( self ) -> list:
+        """ Waits for the next work units to be due, and takes them off the queue """
+        if self._wheel is not None:
+            return self._wait_for_timers()
+
+        return self._wait_for_heap()
+
+
+    def _wait_for_timers( self ) -> list:
+        while not self._interrupted:
             with self._lock:
-                assert self._heap.size() > 0 or self._interrupted
-                if self._interrupted:
+                due = self._wheel.advance( time.monotonic() )
+                if len( due ) > 0:
+                    for workunit in due:
+                        self._unindex( workunit )
+                    return due
+                deadline = self._wheel.next_deadline()
+                # Cleared while holding the lock: a work unit enqueued from here on sets it again
+                self._event.clear()
+
+            self._event.wait( timeout=None if deadline is None else max( deadline - time.monotonic(), 0 ) )
+        return []
+
+
+    def _dispatch( self, workunit ):
+        with self._lock:
+            if workunit.key is not None:
+                if workunit.key in self._waiting:
+                    self._waiting[workunit.key].append( workunit )
                     return
+                self._waiting[workunit.key] = collections.deque()
+        self._ready.put( workunit )
 
-        wait_time = 0
+
+    def _work( self ):
         while True:
+            workunit = self._ready.get()
+            if workunit is None:
+                return
+
             with self._lock:
-                assert self._heap.size() > 0
-                workunit = self._heap.peek()
+                # Cancelled after it was dispatched, before a worker got to it
+                cancelled = workunit.key in self._after_run and self._after_run[workunit.key] is None
+                if not cancelled:
+                    self._busy += 1
+            if not cancelled:
+                self._run( workunit )
+            self._finish( workunit )
 
-                # The work unit could be in the past or future. If it's in the future, we must wait!
-                delta = workunit.dt - datetime.datetime.now()
-                wait_time = delta.total_seconds()
 
-            if wait_time > 0:
-                self._event.clear()
-                self._event.wait( timeout=wait_time )
-                # If we're interrupted, we already going to exit. No need to check
-                # for _interrupted here
-                self._event.clear()
-            else:
-                # Our wait may have been interruped by a preemting workunit that is in the future
-                return
+    def _run( self, workunit ):
+        workunitWaitHistogram.observe( max( ( datetime.datetime.now() - workunit.dt ).total_seconds(), 0 ) )
+        start = time.monotonic()
+        try:
+            workunit.work()
+        except Exception as e:
+            logging.exception( e )
 
+        finally:
+            workersBusySecondsCounter.inc( time.monotonic() - start )
+            with self._lock:
+                self._busy -= 1
 
-    def run( self ):
-        while not self._interrupted:
-            try:
-                self._wait_for_event()
-                if self._interrupted:
-                    return
 
-                with self._lock:
-                    workunit = self._heap.pop()
-                workunit.work()
+    def _finish( self, workunit ):
+        """
+        Hands the key of a work unit that finished to the next work unit waiting for it, and
+        enqueues the work unit again: at the `dt` it was rescheduled to while it ran, if it was, or
+        at its next run if it recurs. A work unit cancelled while it ran isn't enqueued again.
+        """
+        following = None
+        enqueued = False
+        with self._lock:
+            after_run = _KEEP
+            if workunit.key is not None:
+                after_run = self._after_run.pop( workunit.key, _KEEP )
+                waiting = self._waiting[workunit.key]
+                if len( waiting ) > 0:
+                    following = waiting.popleft()
+                else:
+                    del self._waiting[workunit.key]
+
+            # Enqueued while holding the lock, so that a cancel never misses it
+            if not self._interrupted and after_run is not None:
+                if after_run is not _KEEP:
+                    workunit.dt = after_run
+                    enqueued = True
+                else:
+                    enqueued = reschedule( workunit, datetime.datetime.now() )
+                if enqueued:
+                    self._push( workunit )
 
-            except Exception as e:
-                logging.exception( e )
+        if following is not None:
+            self._ready.put( following )
+        if enqueued:
+            self._event.set()
 
 
     def enqueue( self, workunit ):
@@ -104,9 +318,115 @@ class WorkQueue( threading.Thread ):
             return
 
         with self._lock:
-            self._heap.push( workunit )
+            self._push( workunit )
+
+        self._event.set()
+
+
+    def enqueue_or_reschedule( self, workunit ) -> bool:
+        """
+        Moves the work unit with the same key to `workunit.dt`, or enqueues `workunit` if there's
+        none: e.g. to poll a calendar now, without adding a second poll for it. Returns True if
+        `workunit` was enqueued.
+        """
+        assert workunit.key is not None
+        if workunit.dt is None:
+            return False
+
+        with self._lock:
+            enqueued = not self._move( workunit.key, workunit.dt )
+            if enqueued:
+                self._push( workunit )
+
+        self._event.set()
+        return enqueued
+
+
+    def reschedule( self, key, dt: datetime.datetime ) -> bool:
+        """
+        Moves the next queued work unit with `key` to `dt`, sooner or later. If none is queued, but
+        one is running, it is enqueued at `dt` once it finishes. Returns False if there's no work
+        unit with `key`.
+        """
+        with self._lock:
+            moved = self._move( key, dt )
 
         self._event.set()
+        return moved
+
+
+    def cancel( self, key ) -> int:
+        """
+        Takes the queued work units with `key` off the queue, drops the ones waiting for the running
+        work unit with `key`, and keeps the running one from being enqueued again. Returns how many
+        work units were cancelled.
+        """
+        with self._lock:
+            handles = self._queued.pop( key, [] )
+            for handle in handles:
+                if self._wheel is not None:
+                    handle.cancel()
+                else:
+                    self._heap.remove( handle )
+            cancelled = len( handles )
+
+            if key in self._waiting:
+                cancelled += 1 + len( self._waiting[key] )
+                self._waiting[key].clear()
+                self._after_run[key] = None
+        return cancelled
+
+
+    def _push( self, workunit ):
+        if self._wheel is not None:
+            handle = self._wheel.schedule( self._monotonic( workunit.dt ), workunit )
+        else:
+            handle = self._heap.push( workunit )
+        if workunit.key is not None:
+            self._queued.setdefault( workunit.key, [] ).append( handle )
+
+
+    def _move( self, key, dt: datetime.datetime ) -> bool:
+        """ Moves the next work unit with `key`, queued or else running, to `dt` """
+        if key not in self._queued:
+            if key not in self._waiting:
+                return False
+            self._after_run[key] = dt
+            return True
+
+        handles = self._queued[key]
+        handle = min( handles, key=lambda h: h.value.dt )
+        handle.value.dt = dt
+        if self._wheel is not None:
+            # A timer can't move: replace it
+            handle.cancel()
+            handles.remove( handle )
+            handles.append( self._wheel.schedule( self._monotonic( dt ), handle.value ) )
+        else:
+            self._heap.update( handle )
+        return True
+
+
+    def _unindex( self, workunit ):
+        """ Forgets the handle of a work unit that left the queue """
+        if workunit.key is None:
+            return
+        handles = [ h for h in self._queued[workunit.key] if h.value is not workunit ]
+        if len( handles ) > 0:
+            self._queued[workunit.key] = handles
+        else:
+            del self._queued[workunit.key]
+
+
+    @staticmethod
+    def _monotonic( dt: datetime.datetime ) -> float:
+        return time.monotonic() + ( dt - datetime.datetime.now() ).total_seconds()
+
+
+    def enqueue_recurring( self, workunit, recurrence: Recurrence ):
+        """ Runs `workunit` from its `dt` on, as often as `recurrence` says """
+        start_recurring( workunit, recurrence )
+        self.enqueue( workunit )
 
 
     def stop( self ):
@@ -115,4 +435,14 @@ class WorkQueue( threading.Thread ):
 
 
     def size( self ):
+        if self._wheel is not None:
+            return len( self._wheel )
         return self._heap.size()
+
+
+    def workers( self ) -> int:
+        return self._workers
+
+
+    def busy( self ) -> int:
+        return self._busy
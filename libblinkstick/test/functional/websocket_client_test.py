@@ -6,10 +6,11 @@ import time
 import unittest
 
 from contextlib import closing
+from queue import Queue
 
 from simple_websocket_server import WebSocketServer, WebSocket
 
-from myblinkstick.websocket_client import WebsocketClient
+from myblinkstick.websocket_client import WebsocketClient, msgpack
 
 logging.basicConfig( level=logging.DEBUG )
 logging.getLogger( 'websocket' ).setLevel( logging.WARNING )
@@ -41,7 +42,10 @@ class WebsocketClientTest( unittest.TestCase ):
                 def handle( self ):
                     try:
                         if callable( handle_fn ):
-                            handle_fn( self.data )
+                            # handle_fn can return a reply
+                            reply = handle_fn( self.data )
+                            if reply is not None:
+                                self.send_message( reply )
                     except Exception as e:
                         logging.exception( e )
 
@@ -89,12 +93,53 @@ class WebsocketClientTest( unittest.TestCase ):
 
         name = "foo"
         with self.WebsocketServer( port, handle ), \
-                WebsocketClient( f"ws://localhost:{port}", name=name ):
+                WebsocketClient( f"ws://localhost:{port}", name=name, encodings=[] ):
 
             sem.acquire(timeout=5)
             self.assertEqual( o, { 'name': name } )
 
 
+    @unittest.skipIf( msgpack is None, "msgpack isn't installed" )
+    def test_negotiated_encoding( self ):
+        """ Once the controller agrees to msgpack, messages are sent as msgpack """
+        port = self.get_port()
+
+        received = Queue()
+        def handle( data ):
+            if isinstance( data, str ):
+                message = json.loads( data )
+                received.put( ("json", message) )
+                if "encodings" in message:
+                    return json.dumps( {"success": True, "encoding": "msgpack"} ).encode( "ascii" )
+            else:
+                received.put( ("msgpack", msgpack.unpackb( data )) )
+            return None
+
+        with self.WebsocketServer( port, handle ), \
+             WebsocketClient( f"ws://localhost:{port}", name="foo" ) as websocket_client:
+            self.assertEqual( ("json", {"name": "foo", "encodings": ["msgpack"]}),
+                              received.get( timeout=5 ) )
+
+            # The client can merge changes into one batch
+            def changes( message ):
+                return message["batch"] if "batch" in message else [ message ]
+
+            # The reply to the handshake may not have arrived yet: keep changing the state, one
+            # change at a time, until a change arrives as msgpack
+            for i in range( 0, 50 ):
+                alert = f"alert{i}"
+                websocket_client.enable( alert )
+                while True:
+                    encoding, message = received.get( timeout=5 )
+                    if {"enable": alert} in changes( message ):
+                        break
+                if encoding == "msgpack":
+                    break
+            self.assertEqual( "msgpack", encoding )
+
+            time.sleep( 1 )
+
+
     def test_enable_disable( self ):
         port = self.get_port()
 
@@ -142,13 +187,13 @@ class WebsocketClientTest( unittest.TestCase ):
                 nonlocal o
                 nonlocal sem
 
-                o = json.loads( data )
-                if "enable" in data:
+                if "sync" in data:
+                    o = json.loads( data )
                     sem.release()
 
             with self.WebsocketServer( port, handle ):
                 sem.acquire(timeout=5)
-                self.assertEqual( { 'enable': alert_name }, o )
+                self.assertEqual( { 'sync': [alert_name] }, o )
 
 
     def test_server_hiccup( self ):
@@ -162,7 +207,7 @@ class WebsocketClientTest( unittest.TestCase ):
             nonlocal sem
 
             o = json.loads( data )
-            if "enable" in data:
+            if "enable" in data or "sync" in data:
                 sem.release()
 
 
@@ -179,7 +224,8 @@ class WebsocketClientTest( unittest.TestCase ):
 
             sem.acquire(timeout=5) # python: disable=consider-using-with
 
-            self.assertEqual( { 'enable': alert_name }, o )
+            # The state is sent again when the client reconnects
+            self.assertEqual( { 'sync': [alert_name] }, o )
 
         time.sleep( 1 )
 
@@ -199,8 +245,7 @@ class WebsocketClientTest( unittest.TestCase ):
             ready_sem.acquire()
 
             o = json.loads( data )
-            if "enable" in data:
-                sem.release()
+            sem.release()
 
 
         with WebsocketClient( f"ws://localhost:{port}" ) as websocket_client:
@@ -220,9 +265,9 @@ class WebsocketClientTest( unittest.TestCase ):
                 o = {}
                 ready_sem.release()
                 sem.acquire(timeout=2)
-                self.assertEqual( { 'enable': sacrificial_name }, o )
+                self.assertEqual( { 'sync': [sacrificial_name] }, o )
 
-                # TODO:  { 'enable': sacrificialname } is sent twice. Once when the connection is
+                # TODO:  sacrificial_name is sent twice. Once in the sync when the connection is
                 # established. Once when for when _hasEvent is processed.
                 o = {}
                 ready_sem.release()
@@ -237,6 +282,39 @@ class WebsocketClientTest( unittest.TestCase ):
         time.sleep( 1 )
 
 
+    def test_several_changes_are_one_batch( self ):
+        port = self.get_port()
+
+        received = []
+        sem = threading.Semaphore( 0 )
+
+        def handle( data ):
+            received.append( json.loads( data ) )
+            sem.release()
+
+        with self.WebsocketServer( port, handle ), \
+             WebsocketClient( f"ws://localhost:{port}" ) as websocket_client:
+            # Wait for the connection, so that the state isn't sent as a sync
+            deadline = time.monotonic() + 5
+            while websocket_client._websocket is None and time.monotonic() < deadline:
+                time.sleep( 0.05 )
+
+            websocket_client.enable( "foo" )
+            sem.acquire(timeout=5)
+            self.assertEqual( [{ 'enable': 'foo' }], received )
+
+            # Two changes that the client's loop picks up together
+            with websocket_client._state_mutex:
+                websocket_client._state.remove( "foo" )
+                websocket_client._state.add( "bar" )
+            websocket_client._has_event.release()
+
+            sem.acquire(timeout=5)
+            self.assertEqual( { 'batch': [{ 'disable': 'foo' }, { 'enable': 'bar' }] }, received[-1] )
+
+            time.sleep( 1 )
+
+
     def test_disable_without_enable( self ):
         port = self.get_port()
 
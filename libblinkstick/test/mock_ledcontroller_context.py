@@ -20,7 +20,17 @@ class WebSocketHandler( WebSocket ):
         try:
             if isinstance(self.data, str):
                 data = json.loads(self.data)
-                if self._callback is not None and "enable" in data:
+                if self._callback is None:
+                    return
+                # Batches and syncs are reported as the enables they carry
+                if "batch" in data:
+                    for change in data["batch"]:
+                        if "enable" in change:
+                            self._callback(change)
+                if "sync" in data:
+                    for alert in data["sync"]:
+                        self._callback({"enable": alert})
+                if "enable" in data:
                     self._callback(data)
         except Exception as e:
             logging.exception(e)
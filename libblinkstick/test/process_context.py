@@ -110,7 +110,8 @@ class ManagedLEDController(ManagedApplication):
         self.ws_port = ws_port
 
 @contextmanager
-def managed_led_controller(config_file: str) -> Generator[ManagedLEDController, Any, None]:
+def managed_led_controller(config_file: str,
+                           extra_args: List[str] | None = None) -> Generator[ManagedLEDController, Any, None]:
     prometheus_port: int = find_free_port()
     http_port: int = find_free_port()
     ws_port: int = find_free_port()
@@ -120,7 +121,7 @@ def managed_led_controller(config_file: str) -> Generator[ManagedLEDController,
          "--config",          config_file,
          "--prometheus-port", str(prometheus_port),
          "--ws-port",         str(ws_port),
-         "--http-port",       str(http_port)],
+         "--http-port",       str(http_port)] + (extra_args or []),
         allowed_log_lines=[re.compile(".*no blinksticks found!")]) as p:
         yield ManagedLEDController(p.process, p.prometheus_port, http_port, ws_port=ws_port)
 
@@ -1,7 +1,9 @@
+import contextlib
 from http.server import SimpleHTTPRequestHandler
+import io
 import unittest
 
-from myblinkstick.application import Application
+from myblinkstick.application import Application, Sensor
 
 class MyApplication(Application):
     def __init__( self ): # pylint: disable=super-init-not-called
@@ -14,3 +16,19 @@ class ApplicationTest(unittest.TestCase):
         application = MyApplication()
         with open(__file__, encoding='ascii') as f:
             self.assertEqual(f.read(), application._get_resource_file_contents(__file__)) # pylint: disable=protected-access
+
+
+class MySensor(Sensor):
+    def __init__( self ): # pylint: disable=super-init-not-called
+        pass
+    def _get_httpd_handler(self) -> type[SimpleHTTPRequestHandler]:
+        raise Exception()
+
+class SensorTest(unittest.TestCase):
+    def test_scheduler_is_rejected_with_the_asyncio_work_queue(self):
+        sensor = MySensor()
+        with self.assertRaises(SystemExit), contextlib.redirect_stderr(io.StringIO()):
+            sensor.parse_args(["--work-queue", "asyncio", "--scheduler", "wheel"])
+
+        self.assertIsNone(sensor.parse_args(["--work-queue", "asyncio"]).scheduler)
+        self.assertEqual("wheel", sensor.parse_args(["--scheduler", "wheel"]).scheduler)
@@ -0,0 +1,218 @@
+import asyncio
+import datetime
+import threading
+import unittest
+
+from myblinkstick import workqueue
+from myblinkstick.async_workqueue import AsyncWorkQueue, AsyncWorkunit
+
+class CoroutineWorkunit( AsyncWorkunit ):
+    """ Sleeps for `seconds`, keeping track of how many of its kind run at once """
+    running = 0
+    most_running = 0
+
+    def __init__( self, dt, seconds=0, key=None ):
+        super().__init__( dt, key )
+        self.seconds = seconds
+        self.fail = False
+        self.cancelled = False
+        self.started = threading.Event()
+        self.done = threading.Event()
+        self.runs = threading.Semaphore( 0 )
+
+    async def work( self ):
+        CoroutineWorkunit.running += 1
+        CoroutineWorkunit.most_running = max( CoroutineWorkunit.most_running, CoroutineWorkunit.running )
+        self.started.set()
+        if datetime.datetime.now() < self.dt:
+            self.fail = True
+        try:
+            await asyncio.sleep( self.seconds )
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+        finally:
+            CoroutineWorkunit.running -= 1
+        self.done.set()
+        self.runs.release()
+
+class BlockingWorkunit( workqueue.Workunit ):
+    def __init__( self, dt ):
+        super().__init__( dt )
+        self.thread = None
+        self.done = threading.Event()
+
+    def work( self ):
+        self.thread = threading.current_thread()
+        self.done.set()
+
+class AsyncWorkQueueTest( unittest.TestCase ):
+    def setUp( self ):
+        self.queue = AsyncWorkQueue( workers=8 )
+        CoroutineWorkunit.most_running = 0
+
+
+    def tearDown( self ):
+        if self.queue.is_alive():
+            self.queue.stop()
+        self.queue.join( timeout=5 )
+        self.assertFalse( self.queue.is_alive() )
+
+
+    def test_work_units_run_when_due( self ):
+        now = datetime.datetime.now()
+        later = CoroutineWorkunit( now + datetime.timedelta( seconds=0.5 ) )
+        sooner = CoroutineWorkunit( now + datetime.timedelta( seconds=0.1 ) )
+        # Enqueued both before and after the loop started
+        self.queue.enqueue( later )
+        self.queue.start()
+        self.queue.enqueue( sooner )
+
+        self.assertTrue( sooner.done.wait( timeout=5 ) )
+        self.assertFalse( later.started.is_set() )
+        self.assertTrue( later.done.wait( timeout=5 ) )
+        self.assertFalse( sooner.fail )
+        self.assertFalse( later.fail )
+
+
+    def test_many_work_units_in_flight( self ):
+        self.queue.start()
+        work = [ CoroutineWorkunit( datetime.datetime.now(), seconds=0.5 ) for _ in range( 0, 8 ) ]
+        for w in work:
+            self.queue.enqueue( w )
+
+        for w in work:
+            self.assertTrue( w.done.wait( timeout=5 ) )
+        self.assertEqual( 8, CoroutineWorkunit.most_running )
+
+
+    def test_work_units_with_the_same_key_run_one_at_a_time( self ):
+        self.queue.start()
+        now = datetime.datetime.now()
+        first = CoroutineWorkunit( now, seconds=0.3, key="calendar" )
+        second = CoroutineWorkunit( now + datetime.timedelta( milliseconds=1 ), key="calendar" )
+        self.queue.enqueue( first )
+        self.queue.enqueue( second )
+
+        self.assertTrue( second.done.wait( timeout=5 ) )
+        self.assertTrue( first.done.is_set() )
+        self.assertEqual( 1, CoroutineWorkunit.most_running )
+
+
+    def test_blocking_work_unit_runs_on_an_executor( self ):
+        self.queue.start()
+        work = BlockingWorkunit( datetime.datetime.now() )
+        self.queue.enqueue( work )
+
+        self.assertTrue( work.done.wait( timeout=5 ) )
+        self.assertIsNot( self.queue, work.thread )
+
+
+    def test_stop_cancels_running_work_units( self ):
+        self.queue.start()
+        running = CoroutineWorkunit( datetime.datetime.now(), seconds=60 )
+        future = CoroutineWorkunit( datetime.datetime.now() + datetime.timedelta( seconds=60 ) )
+        self.queue.enqueue( running )
+        self.queue.enqueue( future )
+        self.assertTrue( running.started.wait( timeout=5 ) )
+
+        self.queue.stop()
+        self.queue.join( timeout=5 )
+
+        self.assertTrue( running.cancelled )
+        self.assertFalse( future.started.is_set() )
+
+
+    def test_same_work_unit_enqueued_twice( self ):
+        self.queue.start()
+        work = CoroutineWorkunit( datetime.datetime.now() + datetime.timedelta( seconds=0.1 ) )
+        self.queue.enqueue( work )
+        self.queue.enqueue( work )
+
+        for _ in range( 0, 2 ):
+            self.assertTrue( work.runs.acquire( timeout=5 ) ) # pylint: disable=consider-using-with
+        self.assertEqual( 0, self.queue.size() )
+
+
+    def test_recurring_work_unit( self ):
+        self.queue.start()
+        work = CoroutineWorkunit( datetime.datetime.now() )
+        self.queue.enqueue_recurring( work, workqueue.Recurrence( 0.1, workqueue.FIXED_RATE ) )
+
+        # The same work unit runs again and again
+        for _ in range( 0, 3 ):
+            self.assertTrue( work.runs.acquire( timeout=5 ) ) # pylint: disable=consider-using-with
+        self.assertFalse( work.fail )
+
+
+    def test_reschedule_pulls_a_work_unit_forward( self ):
+        work = CoroutineWorkunit( datetime.datetime.now() + datetime.timedelta( seconds=60 ), key="calendar" )
+        # Enqueued before the loop started
+        self.queue.enqueue( work )
+        self.queue.start()
+
+        self.assertTrue( self.queue.reschedule( "calendar", datetime.datetime.now() ) )
+        self.assertTrue( work.done.wait( timeout=5 ) )
+        self.assertFalse( work.fail )
+        self.assertEqual( 0, self.queue.size() )
+        self.assertFalse( self.queue.reschedule( "calendar", datetime.datetime.now() ) )
+
+
+    def test_enqueue_or_reschedule_does_not_duplicate( self ):
+        self.queue.start()
+        work = CoroutineWorkunit( datetime.datetime.now() + datetime.timedelta( seconds=60 ), key="calendar" )
+        self.assertTrue( self.queue.enqueue_or_reschedule( work ) )
+
+        poll = CoroutineWorkunit( datetime.datetime.now(), key="calendar" )
+        self.assertFalse( self.queue.enqueue_or_reschedule( poll ) )
+        self.assertTrue( work.done.wait( timeout=5 ) )
+        self.assertFalse( poll.started.is_set() )
+
+
+    def test_cancel( self ):
+        self.queue.start()
+        soon = datetime.datetime.now() + datetime.timedelta( seconds=0.2 )
+        cancelled = [ CoroutineWorkunit( soon, key="calendar" ) for _ in range( 0, 2 ) ]
+        other = CoroutineWorkunit( soon, key="repository" )
+        for work in cancelled + [other]:
+            self.queue.enqueue( work )
+
+        self.assertEqual( 2, self.queue.cancel( "calendar" ) )
+        self.assertEqual( 0, self.queue.cancel( "calendar" ) )
+        self.assertTrue( other.done.wait( timeout=5 ) )
+        for work in cancelled:
+            self.assertFalse( work.started.wait( timeout=0.1 ) )
+
+
+    def test_cancel_a_running_recurring_work_unit( self ):
+        self.queue.start()
+        work = CoroutineWorkunit( datetime.datetime.now(), seconds=0.3, key="calendar" )
+        self.queue.enqueue_recurring( work, workqueue.Recurrence( 0.05 ) )
+        self.assertTrue( work.started.wait( timeout=5 ) )
+
+        self.assertEqual( 1, self.queue.cancel( "calendar" ) )
+        self.assertTrue( work.done.wait( timeout=5 ) )
+        work.started.clear()
+
+        # It isn't scheduled again
+        self.assertFalse( work.started.wait( timeout=0.3 ) )
+        self.assertEqual( 0, self.queue.size() )
+
+
+    def test_reschedule_a_running_work_unit( self ):
+        self.queue.start()
+        work = CoroutineWorkunit( datetime.datetime.now(), seconds=0.2, key="calendar" )
+        self.queue.enqueue_recurring( work, workqueue.Recurrence( 60 ) )
+        self.assertTrue( work.started.wait( timeout=5 ) )
+
+        # Runs again now, rather than in a minute
+        self.assertTrue( self.queue.reschedule( "calendar", datetime.datetime.now() ) )
+        self.assertTrue( work.done.wait( timeout=5 ) )
+        work.started.clear()
+        self.assertTrue( work.started.wait( timeout=5 ) )
+
+
+    def test_stop_before_start( self ):
+        self.queue.enqueue( CoroutineWorkunit( datetime.datetime.now() ) )
+        self.queue.stop()
+        self.queue.start()
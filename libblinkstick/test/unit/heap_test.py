@@ -0,0 +1,54 @@
+import random
+import unittest
+
+from myblinkstick.heap import IndexedHeap
+
+class IndexedHeapTest( unittest.TestCase ):
+    def test_pop_in_order( self ):
+        heap = IndexedHeap( key=lambda x: x )
+        for x in [5, 3, 8, 1, 3]:
+            heap.push( x )
+        self.assertEqual( 1, heap.peek() )
+        self.assertEqual( [1, 3, 3, 5, 8], [ heap.pop() for _ in range( 0, 5 ) ] )
+        self.assertEqual( 0, heap.size() )
+
+
+    def test_remove_and_update( self ):
+        heap = IndexedHeap( key=lambda x: x["when"] )
+        items = { name: heap.push( { "name": name, "when": when } )
+                  for name, when in [ ("a", 5), ("b", 3), ("c", 8), ("d", 1) ] }
+
+        heap.remove( items["d"] )
+        self.assertIsNone( items["d"].index )
+        # Pulled forward, then pushed back
+        items["c"].value["when"] = 0
+        heap.update( items["c"] )
+        items["b"].value["when"] = 10
+        heap.update( items["b"] )
+
+        self.assertEqual( ["c", "a", "b"], [ heap.pop()["name"] for _ in range( 0, 3 ) ] )
+
+
+    def test_random_operations( self ):
+        rng = random.Random( 4 )
+        heap = IndexedHeap( key=lambda x: x[0] )
+        items = []
+        for _ in range( 0, 2000 ):
+            operation = rng.random()
+            if operation < 0.5 or len( items ) == 0:
+                items.append( heap.push( [ rng.randint( 0, 100 ) ] ) )
+            elif operation < 0.7:
+                item = items.pop( rng.randrange( len( items ) ) )
+                heap.remove( item )
+            elif operation < 0.9:
+                item = rng.choice( items )
+                item.value[0] = rng.randint( 0, 100 )
+                heap.update( item )
+            else:
+                value = heap.pop()
+                self.assertEqual( min( item.value[0] for item in items ), value[0] )
+                items = [ item for item in items if item.value is not value ]
+            self.assertEqual( len( items ), heap.size() )
+
+        self.assertEqual( sorted( item.value[0] for item in items ),
+                          [ heap.pop()[0] for _ in range( 0, len( items ) ) ] )
@@ -0,0 +1,139 @@
+import random
+import unittest
+
+from myblinkstick.heap import HeapBy
+from myblinkstick.timingwheel import TimingWheel
+
+class TimingWheelTest( unittest.TestCase ):
+    def make_wheel( self ):
+        # 1 second ticks, and levels covering 4, 16 and 64 seconds
+        return TimingWheel( tick=1, slots=4, levels=3, start=0 )
+
+
+    def test_timers_fire_in_order( self ):
+        wheel = self.make_wheel()
+        for when in [5, 1.5, 3]:
+            wheel.schedule( when, when )
+
+        self.assertEqual( [],         wheel.advance( 1 ) )
+        self.assertEqual( [1.5, 3],   wheel.advance( 3 ) )
+        self.assertEqual( [5],        wheel.advance( 10 ) )
+        self.assertEqual( 0, len( wheel ) )
+
+
+    def test_timers_cascade_from_the_higher_levels( self ):
+        wheel = self.make_wheel()
+        wheel.schedule( 40, "far" )
+        wheel.schedule( 17, "near" )
+
+        fired = []
+        for now in range( 0, 50 ):
+            fired.extend( (now, value) for value in wheel.advance( now ) )
+        self.assertEqual( [(17, "near"), (40, "far")], fired )
+
+
+    def test_timers_beyond_the_top_level( self ):
+        wheel = self.make_wheel()
+        wheel.schedule( 200, "later" )
+
+        self.assertEqual( [], wheel.advance( 199 ) )
+        self.assertEqual( ["later"], wheel.advance( 200 ) )
+
+
+    def test_cancel( self ):
+        wheel = self.make_wheel()
+        timer = wheel.schedule( 20, "cancelled" )
+        wheel.schedule( 21, "kept" )
+
+        self.assertTrue( timer.cancel() )
+        self.assertFalse( timer.cancel() )
+        self.assertEqual( 1, len( wheel ) )
+        self.assertEqual( ["kept"], wheel.advance( 30 ) )
+
+
+    def test_timer_in_the_past_fires_on_the_next_advance( self ):
+        wheel = self.make_wheel()
+        wheel.advance( 10.5 )
+        wheel.schedule( 3, "late" )
+
+        self.assertLessEqual( wheel.next_deadline(), 10.5 )
+        self.assertEqual( ["late"], wheel.advance( 10.6 ) )
+
+
+    def test_next_deadline( self ):
+        wheel = self.make_wheel()
+        self.assertIsNone( wheel.next_deadline() )
+
+        wheel.schedule( 2.5, "soon" )
+        self.assertEqual( 3, wheel.next_deadline() )
+
+        # Further away than level 0: the wheel wakes up for the next cascade, at the end of level 0
+        wheel.advance( 4 )
+        wheel.schedule( 30, "later" )
+        self.assertEqual( 8, wheel.next_deadline() )
+
+
+    def test_next_deadline_on_a_cascade_boundary( self ):
+        wheel = self.make_wheel()
+        # Both start on level 1, in the slot that cascades at 4
+        wheel.schedule( 4, "boundary" )
+        wheel.schedule( 5, "cascaded" )
+
+        self.assertEqual( [], wheel.advance( 3.9 ) )
+        self.assertEqual( 4, wheel.next_deadline() )
+        self.assertEqual( ["boundary"], wheel.advance( 4 ) )
+        self.assertEqual( 5, wheel.next_deadline() )
+        self.assertEqual( ["cascaded"], wheel.advance( 5 ) )
+
+
+    def test_advancing_to_the_next_deadline( self ):
+        """ Advanced only when next_deadline says, every timer still fires within a tick """
+        rng = random.Random( 1 )
+        wheel = self.make_wheel()
+        for _ in range( 0, 200 ):
+            when = rng.uniform( 0, 100 )
+            wheel.schedule( when, when )
+
+        while len( wheel ) > 0:
+            now = wheel.next_deadline()
+            for when in wheel.advance( now ):
+                self.assertLessEqual( when, now )
+                self.assertGreater( when, now - 1 )
+
+
+    def test_random_timers( self ):
+        """ Every timer fires at most one tick after it is due, and never before """
+        rng = random.Random( 0 )
+        wheel = self.make_wheel()
+        pending = {}
+        now = 0
+        for _ in range( 0, 2000 ):
+            if rng.random() < 0.4:
+                when = now + rng.uniform( -2, 100 )
+                pending[wheel.schedule( when, when )] = when
+            elif rng.random() < 0.2 and len( pending ) > 0:
+                timer = rng.choice( list( pending ) )
+                timer.cancel()
+                del pending[timer]
+            else:
+                now += rng.uniform( 0, 5 )
+                for when in wheel.advance( now ):
+                    self.assertLessEqual( when, now )
+                pending = { timer: when for timer, when in pending.items() if timer._bucket is not None }
+                for when in pending.values():
+                    self.assertGreater( when, now - 1 )
+        self.assertEqual( len( pending ), len( wheel ) )
+
+
+class HeapByTest( unittest.TestCase ):
+    def test_key_is_computed_once( self ):
+        calls = []
+        def key( x ):
+            calls.append( x )
+            return x
+
+        heap = HeapBy( key )
+        for x in [5, 3, 8, 1]:
+            heap.push( x )
+        self.assertEqual( [1, 3, 5, 8], [ heap.pop() for _ in range( 0, 4 ) ] )
+        self.assertEqual( [5, 3, 8, 1], calls )
@@ -19,6 +19,28 @@ class LambdaWorkunit( workqueue.Workunit ):
             self.fail = True
         self.sem.release()
 
+class BlockingWorkunit( workqueue.Workunit ):
+    """ Runs until `release` is set, keeping track of how many of its kind run at once """
+    running = 0
+    most_running = 0
+    lock = threading.Lock()
+
+    def __init__( self, dt, key=None ):
+        super().__init__( dt, key )
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.done = threading.Event()
+
+    def work( self ):
+        with BlockingWorkunit.lock:
+            BlockingWorkunit.running += 1
+            BlockingWorkunit.most_running = max( BlockingWorkunit.most_running, BlockingWorkunit.running )
+        self.started.set()
+        self.release.wait( timeout=5 )
+        with BlockingWorkunit.lock:
+            BlockingWorkunit.running -= 1
+        self.done.set()
+
 class WorkQueueTest( unittest.TestCase ):
     # When one work unit preempts another, the work queue wakes up and processes the preemtive work
     # unit
@@ -189,3 +211,276 @@ class WorkQueueTest( unittest.TestCase ):
                     queue.stop()
 
                 queue.join( timeout=5 )
+
+
+    def test_slow_work_unit_does_not_hold_up_the_others( self ):
+        queue = None
+        try:
+            queue = workqueue.WorkQueue( workers=2 )
+            queue.start()
+
+            slow = BlockingWorkunit( datetime.datetime.now() )
+            queue.enqueue( slow )
+            self.assertTrue( slow.started.wait( timeout=5 ) )
+
+            work = LambdaWorkunit( datetime.datetime.now() )
+            queue.enqueue( work )
+            self.assertTrue( work.sem.acquire( timeout=5 ) ) # pylint: disable=consider-using-with
+            self.assertEqual( 1, queue.busy() )
+
+            slow.release.set()
+
+        finally:
+            if queue is not None:
+                if queue.is_alive():
+                    queue.stop()
+
+                queue.join( timeout=5 )
+
+
+    def test_work_units_with_the_same_key_run_one_at_a_time( self ):
+        queue = None
+        try:
+            queue = workqueue.WorkQueue( workers=4 )
+            queue.start()
+            BlockingWorkunit.most_running = 0
+
+            now = datetime.datetime.now()
+            first = BlockingWorkunit( now, key="calendar" )
+            second = BlockingWorkunit( now + datetime.timedelta( milliseconds=1 ), key="calendar" )
+            other = BlockingWorkunit( now, key="repository" )
+            for work in [first, second, other]:
+                queue.enqueue( work )
+
+            self.assertTrue( first.started.wait( timeout=5 ) )
+            self.assertTrue( other.started.wait( timeout=5 ) )
+            # The second work unit waits for the first, even though workers are free
+            self.assertFalse( second.started.wait( timeout=0.2 ) )
+
+            first.release.set()
+            self.assertTrue( second.started.wait( timeout=5 ) )
+            self.assertTrue( first.done.is_set() )
+            second.release.set()
+            other.release.set()
+            self.assertTrue( second.done.wait( timeout=5 ) )
+            self.assertEqual( 2, BlockingWorkunit.most_running )
+
+        finally:
+            if queue is not None:
+                if queue.is_alive():
+                    queue.stop()
+
+                queue.join( timeout=5 )
+
+
+    def test_wheel_scheduler( self ):
+        queue = None
+        try:
+            queue = workqueue.WorkQueue( scheduler="wheel" )
+            queue.start()
+
+            now = datetime.datetime.now()
+            later = LambdaWorkunit( now + datetime.timedelta( seconds=1 ) )
+            sooner = LambdaWorkunit( now + datetime.timedelta( seconds=0.5 ) )
+            past = LambdaWorkunit( now - datetime.timedelta( seconds=1 ) )
+            for work in [later, sooner, past]:
+                queue.enqueue( work )
+
+            self.assertTrue( past.sem.acquire( timeout=5 ) ) # pylint: disable=consider-using-with
+            self.assertTrue( sooner.sem.acquire( timeout=5 ) ) # pylint: disable=consider-using-with
+            self.assertFalse( later.fired )
+            self.assertTrue( later.sem.acquire( timeout=5 ) ) # pylint: disable=consider-using-with
+
+            for work in [later, sooner, past]:
+                self.assertFalse( work.fail )
+            self.assertEqual( 0, queue.size() )
+
+        finally:
+            if queue is not None:
+                if queue.is_alive():
+                    queue.stop()
+
+                queue.join( timeout=5 )
+
+
+    def test_recurring_work_unit( self ):
+        for scheduler in ["heap", "wheel"]:
+            queue = None
+            try:
+                queue = workqueue.WorkQueue( scheduler=scheduler )
+                queue.start()
+
+                work = LambdaWorkunit( datetime.datetime.now() )
+                queue.enqueue_recurring( work, workqueue.Recurrence( 0.1 ) )
+
+                # The same work unit runs again and again
+                for _ in range( 0, 3 ):
+                    self.assertTrue( work.sem.acquire( timeout=5 ) ) # pylint: disable=consider-using-with
+                self.assertFalse( work.fail )
+
+                queue.stop()
+                queue.join( timeout=5 )
+                self.assertFalse( queue.is_alive() )
+
+            finally:
+                if queue is not None:
+                    if queue.is_alive():
+                        queue.stop()
+
+                    queue.join( timeout=5 )
+
+
+class RecurrenceTest( unittest.TestCase ):
+    def setUp( self ):
+        self.start = datetime.datetime( 2024, 1, 1, 12, 0, 0 )
+        self.work = LambdaWorkunit( self.start )
+
+
+    def test_fixed_delay( self ):
+        workqueue.start_recurring( self.work, workqueue.Recurrence( 60 ) )
+        self.assertEqual( self.start, self.work.dt )
+
+        finished = self.start + datetime.timedelta( seconds=25 )
+        self.assertTrue( workqueue.reschedule( self.work, finished ) )
+        self.assertEqual( finished + datetime.timedelta( seconds=60 ), self.work.dt )
+
+
+    def test_fixed_rate( self ):
+        workqueue.start_recurring( self.work, workqueue.Recurrence( 60, workqueue.FIXED_RATE ) )
+
+        workqueue.reschedule( self.work, self.start + datetime.timedelta( seconds=25 ) )
+        self.assertEqual( self.start + datetime.timedelta( seconds=60 ), self.work.dt )
+
+        # A run that took more than two periods skips the runs it missed
+        workqueue.reschedule( self.work, self.start + datetime.timedelta( seconds=190 ) )
+        self.assertEqual( self.start + datetime.timedelta( seconds=240 ), self.work.dt )
+
+
+    def test_jitter_and_spread( self ):
+        recurrence = workqueue.Recurrence( 60, workqueue.FIXED_RATE, jitter=5, spread=30 )
+        workqueue.start_recurring( self.work, recurrence )
+        first = self.work.dt
+        self.assertTrue( self.start <= first <= self.start + datetime.timedelta( seconds=30 ) )
+
+        for i in range( 1, 100 ):
+            workqueue.reschedule( self.work, self.work.dt )
+            # The jitter doesn't accumulate
+            offset = ( self.work.dt - first - datetime.timedelta( seconds=60 * i ) ).total_seconds()
+            self.assertLessEqual( abs( offset ), 5 )
+
+
+    def test_non_recurring_work_unit( self ):
+        self.assertFalse( workqueue.reschedule( self.work, self.start ) )
+        self.assertEqual( self.start, self.work.dt )
+
+
+    def test_invalid_recurrence( self ):
+        with self.assertRaises( ValueError ):
+            workqueue.Recurrence( 0 )
+        with self.assertRaises( ValueError ):
+            workqueue.Recurrence( 60, "hourly" )
+
+
+class KeyedWorkQueueTest( unittest.TestCase ):
+    def setUp( self ):
+        self.queues = []
+
+
+    def tearDown( self ):
+        for queue in self.queues:
+            if queue.is_alive():
+                queue.stop()
+            queue.join( timeout=5 )
+
+
+    def make_queue( self, scheduler ):
+        queue = workqueue.WorkQueue( scheduler=scheduler )
+        self.queues.append( queue )
+        queue.start()
+        return queue
+
+
+    def test_reschedule_pulls_a_work_unit_forward( self ):
+        for scheduler in ["heap", "wheel"]:
+            queue = self.make_queue( scheduler )
+            work = LambdaWorkunit( datetime.datetime.now() + datetime.timedelta( seconds=60 ), key="calendar" )
+            queue.enqueue( work )
+
+            self.assertTrue( queue.reschedule( "calendar", datetime.datetime.now() ) )
+            self.assertTrue( work.sem.acquire( timeout=5 ) ) # pylint: disable=consider-using-with
+            self.assertFalse( work.fail )
+            self.assertEqual( 0, queue.size() )
+            # Nothing is queued any more
+            self.assertFalse( queue.reschedule( "calendar", datetime.datetime.now() ) )
+
+
+    def test_enqueue_or_reschedule_does_not_duplicate( self ):
+        for scheduler in ["heap", "wheel"]:
+            queue = self.make_queue( scheduler )
+            work = LambdaWorkunit( datetime.datetime.now() + datetime.timedelta( seconds=60 ), key="calendar" )
+            self.assertTrue( queue.enqueue_or_reschedule( work ) )
+
+            poll = LambdaWorkunit( datetime.datetime.now(), key="calendar" )
+            self.assertFalse( queue.enqueue_or_reschedule( poll ) )
+            self.assertTrue( work.sem.acquire( timeout=5 ) ) # pylint: disable=consider-using-with
+            self.assertFalse( poll.fired )
+            self.assertEqual( 0, queue.size() )
+
+
+    def test_cancel( self ):
+        for scheduler in ["heap", "wheel"]:
+            queue = self.make_queue( scheduler )
+            soon = datetime.datetime.now() + datetime.timedelta( seconds=0.2 )
+            cancelled = [ LambdaWorkunit( soon, key="calendar" ) for _ in range( 0, 2 ) ]
+            other = LambdaWorkunit( soon, key="repository" )
+            for work in cancelled + [other]:
+                queue.enqueue( work )
+
+            self.assertEqual( 2, queue.cancel( "calendar" ) )
+            self.assertEqual( 0, queue.cancel( "calendar" ) )
+            self.assertTrue( other.sem.acquire( timeout=5 ) ) # pylint: disable=consider-using-with
+            time.sleep( 0.1 )
+            for work in cancelled:
+                self.assertFalse( work.fired )
+
+
+    def test_cancel_the_only_work_unit( self ):
+        queue = self.make_queue( "heap" )
+        work = LambdaWorkunit( datetime.datetime.now() + datetime.timedelta( seconds=0.2 ), key="calendar" )
+        queue.enqueue( work )
+        self.assertEqual( 1, queue.cancel( "calendar" ) )
+
+        # The queue waits for the next work unit
+        later = LambdaWorkunit( datetime.datetime.now() + datetime.timedelta( seconds=0.3 ) )
+        queue.enqueue( later )
+        self.assertTrue( later.sem.acquire( timeout=5 ) ) # pylint: disable=consider-using-with
+        self.assertFalse( work.fired )
+
+
+    def test_cancel_a_running_recurring_work_unit( self ):
+        queue = self.make_queue( "heap" )
+        work = BlockingWorkunit( datetime.datetime.now(), key="calendar" )
+        queue.enqueue_recurring( work, workqueue.Recurrence( 0.05 ) )
+        self.assertTrue( work.started.wait( timeout=5 ) )
+
+        self.assertEqual( 1, queue.cancel( "calendar" ) )
+        work.started.clear()
+        work.release.set()
+        self.assertTrue( work.done.wait( timeout=5 ) )
+
+        # It isn't enqueued again
+        self.assertFalse( work.started.wait( timeout=0.3 ) )
+        self.assertEqual( 0, queue.size() )
+
+
+    def test_reschedule_a_running_work_unit( self ):
+        queue = self.make_queue( "heap" )
+        work = BlockingWorkunit( datetime.datetime.now(), key="calendar" )
+        queue.enqueue_recurring( work, workqueue.Recurrence( 60 ) )
+        self.assertTrue( work.started.wait( timeout=5 ) )
+
+        # Runs again now, rather than in a minute
+        self.assertTrue( queue.reschedule( "calendar", datetime.datetime.now() ) )
+        work.started.clear()
+        work.release.set()
+        self.assertTrue( work.started.wait( timeout=5 ) )
@@ -21,7 +21,7 @@ from prometheus_client import Gauge
 
 from myblinkstick.application import Sensor
 from myblinkstick.navbar import Navbar
-from myblinkstick.workqueue import Workunit
+from myblinkstick.workqueue import DEFAULT_POLL_RECURRENCE, Workunit
 
 
 credentialsInvalid = Gauge(
@@ -56,16 +56,14 @@ class OutlookWorkunit( Workunit ):
                   ws,
                   dt,
                   calendar,
-                  workqueue,
                   state_lock,
                   state,
                   tokens_cache,
                   app,
                   credentials ):
-        super().__init__( dt )
+        super().__init__( dt, key=calendar["name"] )
         self._ws = ws
         self._calendar = calendar
-        self._workqueue = workqueue
         self._state_lock = state_lock
         self._state = state
         self._tokens_cache = tokens_cache
@@ -170,20 +168,6 @@ class OutlookWorkunit( Workunit ):
             logging.exception( e )
             workunitExceptions.labels( calendar_name, type( e ).__name__ ).inc( 1 )
 
-        finally:
-            future = datetime.datetime.now() + datetime.timedelta( seconds=60 )
-            self._workqueue.enqueue(
-                OutlookWorkunit(
-                    self._ws,
-                    future,
-                    self._calendar,
-                    self._workqueue,
-                    self._state_lock,
-                    self._state,
-                    self._tokens_cache,
-                    self._app,
-                    self._credentials ) )
-
 
 class OutlookListener( Sensor ):
     def __init__(self, args):
@@ -368,17 +352,17 @@ class OutlookListener( Sensor ):
 
             self._state[calendar["name"]] = []
 
-            self._workqueue.enqueue(
+            self._workqueue.enqueue_recurring(
                 OutlookWorkunit(
                     self._ws,
                     datetime.datetime.now(),
                     calendar,
-                    self._workqueue,
                     self._state_lock,
                     self._state,
                     self._tokens_cache,
                     self._app,
-                    self._credentials ) )
+                    self._credentials ),
+                DEFAULT_POLL_RECURRENCE )
 
         self._up.set(1)
 